@@ -4,7 +4,6 @@ import json
 import os
 
 os.environ["GRADIO_SERVER_NAME"] = "0.0.0.0"
-import subprocess
 import threading
 import time
 import traceback
@@ -20,6 +19,8 @@ from flask import Flask, request
 
 import service.trans_dh_service
 from h_utils.custom import CustomError
+from service.model_readiness import ModelReadiness, load_ready_timeout
+from service.video_writer import FFmpegPipeWriter
 from y_utils.config import GlobalConfig
 from y_utils.logger import logger
 
@@ -38,24 +39,33 @@ def write_video_gradio(
     digital_auth=0,
     temp_queue=None,
 ):
-    output_mp4 = os.path.join(temp_dir, "{}-t.mp4".format(work_id))
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
     result_path = os.path.join(result_dir, "{}-r.mp4".format(work_id))
-    video_write = cv2.VideoWriter(output_mp4, fourcc, fps, (width, height))
-    print("Custom VideoWriter init done")
+    watermark_path = None
+    digital_auth_path = None
+    if watermark_switch == 1:
+        logger.info("Custom VideoWriter [{}]任务需要水印".format(work_id))
+        watermark_path = GlobalConfig.instance().watermark_path
+    if digital_auth == 1:
+        logger.info("Custom VideoWriter [{}]任务需要数字人标识".format(work_id))
+        digital_auth_path = GlobalConfig.instance().digital_auth_path
+    video_write = None
     try:
+        video_write = FFmpegPipeWriter(
+            result_path,
+            audio_path,
+            width,
+            height,
+            fps,
+            watermark_path=watermark_path,
+            digital_auth_path=digital_auth_path,
+        )
+        print("Custom VideoWriter init done")
         while True:
             state, reason, value_ = output_imgs_queue.get()
             if type(state) == bool and state == True:
                 logger.info(
                     "Custom VideoWriter [{}]视频帧队列处理已结束".format(work_id)
                 )
-                logger.info(
-                    "Custom VideoWriter Silence Video saved in {}".format(
-                        os.path.realpath(output_mp4)
-                    )
-                )
-                video_write.release()
                 break
             else:
                 if type(state) == bool and state == False:
@@ -67,68 +77,15 @@ def write_video_gradio(
                     raise CustomError(reason)
                 for result_img in value_:
                     video_write.write(result_img)
-        if video_write is not None:
-            video_write.release()
-        if watermark_switch == 1 and digital_auth == 1:
-            logger.info(
-                "Custom VideoWriter [{}]任务需要水印和数字人标识".format(work_id)
-            )
-            if width > height:
-                command = 'ffmpeg -y -i {} -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:(main_h-overlay_h)-10,overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().watermark_path,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-            else:
-                command = 'ffmpeg -y -i {} -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:(main_h-overlay_h)-10,overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().watermark_path,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-        elif watermark_switch == 1 and digital_auth == 0:
-            logger.info("Custom VideoWriter [{}]任务需要水印".format(work_id))
-            command = 'ffmpeg -y -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:(main_h-overlay_h)-10" -c:a aac -crf 15 -strict -2 {}'.format(
-                audio_path,
-                output_mp4,
-                GlobalConfig.instance().watermark_path,
-                result_path,
-            )
-            logger.info("command:{}".format(command))
-        elif watermark_switch == 0 and digital_auth == 1:
-            logger.info("Custom VideoWriter [{}]任务需要数字人标识".format(work_id))
-            if width > height:
-                command = 'ffmpeg -loglevel warning -y -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-            else:
-                command = 'ffmpeg -loglevel warning -y -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-        else:
-            command = "ffmpeg -loglevel warning -y -i {} -i {} -c:a aac -c:v libx264 -crf 15 -strict -2 {}".format(
-                audio_path, output_mp4, result_path
-            )
-            logger.info("Custom command:{}".format(command))
-        subprocess.call(command, shell=True)
+        video_write.close()
         print("###### Custom Video Writer write over")
         print(f"###### Video result saved in {os.path.realpath(result_path)}")
         result_queue.put([True, result_path])
         # temp_queue.put([True, result_path])
     except Exception as e:
+        # ffmpeg启动失败时也要回写结果，否则任务一直等待
+        if video_write is not None:
+            video_write.abort()
         logger.error(
             "Custom VideoWriter [{}]视频帧队列处理异常结束，异常原因:[{}]".format(
                 work_id, e.__str__()
@@ -150,7 +107,9 @@ service.trans_dh_service.write_video = write_video_gradio
 
 class VideoProcessor:
     def __init__(self):
-        self.task = service.trans_dh_service.TransDhTask()
+        self.readiness = ModelReadiness("trans_dh_service", load_ready_timeout())
+        with self.readiness:
+            self.task = service.trans_dh_service.TransDhTask()
         self.basedir = GlobalConfig.instance().result_dir
         self.is_initialized = False
         self._initialize_service()
@@ -159,7 +118,9 @@ class VideoProcessor:
     def _initialize_service(self):
         logger.info("开始初始化 trans_dh_service...")
         try:
-            time.sleep(5)
+            self.readiness.wait()
+            if not self.readiness.ready:
+                raise CustomError(f"模型进程未就绪: {self.readiness.to_dict()}")
             logger.info("trans_dh_service 初始化完成。")
             self.is_initialized = True
         except Exception as e:
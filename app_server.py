@@ -17,119 +17,293 @@ import time
 import traceback
 from enum import Enum
 import configparser
-import queue
-from threading import Lock
 
 from service.self_logger import logger
-from flask import Flask, request
+from flask import Flask, Response, abort, request, send_from_directory
 from service.config import *
+from service.concurrency_manager import ConcurrencyManager, load_concurrent_config
+from service.avatar_cache import install_avatar_cache, load_avatar_cache, template_key, video_key
+from service.feature_cache import install_feature_cache, load_feature_cache
+from service.streaming_bnf import load_streaming_bnf_config
+from service.avatar_registry import AvatarStatus, load_avatar_registry, silence_wav
+from service import metrics
+from service.tracing import export_trace, load_trace_config, task_context
+from service.sampling_profiler import load_profile_interval, profile_task
+from service.model_readiness import ModelReadiness, load_ready_timeout
+from service import model_loader
+from service.fork_server import DictSync, ForkRunner, SyncedDict, load_fork_config
+from h_utils.custom import CustomError
+from model_lib import batchable_models, enable_cross_job_batching
+from face_detect_utils.adaptive_detect import load_adaptive_config
+from face_detect_utils.detect_job import detect_job
+from face_detect_utils.keyframe_detect import load_keyframe_config
 # 导入AI服务模块
 from service.trans_dh_service import TransDhTask, Status, task_dic, a, init_p
-
+import service.trans_dh_service
+from service.job_store import install_job_store, load_job_store
+from service.result_cache import content_key, link_or_copy, load_result_cache, localize
+from service.single_flight import SingleFlight, load_single_flight_config
+from service.stage_graph import StageGraph, load_stage_executor
+from service.progressive_output import create_stream, load_progressive_config, playlist_ready, stream_dir, \
+    valid_code, write_video_progressive
+from service.video_writer import HLS_PLAYLIST
+from service.realtime_session import load_session_manager
+from service.template_loop import cycle_bounds, load_loop_mode, loop_cycle, read_video_info, write_loop_clips
+from service.segment_parallel import concat_segments, load_segment_config, plan_segments, remove_key_frames, \
+    segment_key_frames, split_audio, to_wav, write_key_frames
+from y_utils.md5 import md5sum
+from concurrent.futures import ThreadPoolExecutor
+
+import functools
 import json
+import math
+import shutil
 import threading
 import gc
 import cv2
 
 
-class ConcurrencyManager:
-    """并发管理器，支持可配置的并发数和队列等待"""
+def restore_job(code, d):
+    """重启前未完成的任务无法继续，恢复为失败状态"""
+    if d[0] == Status.run:
+        return [Status.error, d[1], '', '服务重启，任务已中断']
+    return d
 
-    def __init__(self, max_concurrent_tasks=4):
-        self.max_concurrent_tasks = max_concurrent_tasks
-        self.current_tasks = 0
-        self.task_queue = queue.Queue()
-        self.lock = Lock()
-        self.worker_thread = None
-        self._start_worker()
-        logger.info(f"并发管理器初始化完成，最大并发数: {max_concurrent_tasks}")
 
-    def _start_worker(self):
-        """启动工作线程来处理队列中的任务"""
-        def worker():
-            while True:
-                try:
-                    # 从队列中获取任务
-                    task_info = self.task_queue.get(timeout=1)
-                    if task_info is None:  # 停止信号
-                        break
-
-                    # 检查任务信息格式
-                    if len(task_info) != 3:
-                        logger.error(f"任务信息格式错误: {task_info}")
-                        continue
-
-                    # 等待可用的并发槽位
-                    while True:
-                        with self.lock:
-                            if self.current_tasks < self.max_concurrent_tasks:
-                                self.current_tasks += 1
-                                break
-                        time.sleep(0.1)
-
-                    # 执行任务
-                    task, args, task_id = task_info
-                    try:
-                        logger.info(f"开始执行任务: {task_id}, 当前并发数: {self.current_tasks}")
-                        
-                        # 执行AI任务
-                        task(*args)
-                            
-                    except Exception as e:
-                        logger.error(f"任务执行异常 {task_id}: {e}")
-                        traceback.print_exc()
-                    finally:
-                        # 释放并发槽位
-                        with self.lock:
-                            self.current_tasks -= 1
-                        logger.info(f"任务完成: {task_id}, 当前并发数: {self.current_tasks}")
-
-                except queue.Empty:
-                    continue
-                except Exception as e:
-                    logger.error(f"工作线程异常: {e}")
-                    traceback.print_exc()
+def job_running(d):
+    return d[0] == Status.run
 
-        self.worker_thread = threading.Thread(target=worker, daemon=True)
-        self.worker_thread.start()
 
-    def submit_task(self, task, task_id, *args):
-        """提交任务到队列"""
-        self.task_queue.put((task, args, task_id))
-        queue_size = self.task_queue.qsize()
-        logger.info(f"任务已提交到队列: {task_id}, 队列长度: {queue_size}")
-        return True
+# 任务状态改为带过期清理的存储，配置sqlite时重启后可查询；运行中的任务不过期
+task_dic = install_job_store(service.trans_dh_service, load_job_store(restore_job, job_running))
+profile_results = SyncedDict()
+# 流式输出或分段生成开启时改用可同时输出HLS分片、可指定关键帧的写视频进程
+stream_keep_seconds = load_progressive_config()
+segment_config = load_segment_config()
+if stream_keep_seconds is not None or segment_config is not None:
+    service.trans_dh_service.write_video = write_video_progressive
 
-    def get_queue_size(self):
-        """获取队列长度"""
-        return self.task_queue.qsize()
 
-    def get_current_tasks(self):
-        """获取当前运行的任务数"""
-        with self.lock:
-            return self.current_tasks
+def mark_crashed(code, exitcode):
+    """任务子进程异常退出（如被OOM杀掉）时补写任务状态"""
+    d = task_dic.get(code)
+    if d is None or d[0] == Status.run:
+        task_dic[code] = [Status.error, d[1] if d is not None else 0, '', f'任务进程异常退出，退出码: {exitcode}']
 
 
-def load_concurrent_config():
-    """从配置文件加载并发配置"""
-    try:
-        config = configparser.ConfigParser()
-        config.read('config/config.ini')
-        batch_size = config.getint('digital', 'batch_size', fallback=4)
-        logger.info(f"从配置文件读取并发数: {batch_size}")
-        return batch_size
-    except Exception as e:
-        logger.warning(f"读取配置失败，使用默认并发数4: {e}")
-        return 4
-
+# zygote模式下每个任务在从本进程fork出的子进程中执行，任务状态同步回本进程；只做故障隔离，模型仍在模型子进程中
+fork_runner = None
+if load_fork_config():
+    fork_runner = ForkRunner([DictSync('task_dic', lambda: task_dic), DictSync('profile', lambda: profile_results)],
+                             on_crash=mark_crashed)
 
 # 创建全局并发管理器
 concurrent_tasks = load_concurrent_config()
-concurrency_manager = ConcurrencyManager(concurrent_tasks)
+concurrency_manager = ConcurrencyManager(concurrent_tasks, runner=fork_runner)
+avatar_registry = load_avatar_registry()
+result_cache = load_result_cache(result_dir)
+# 同一模板视频的并发任务只下载、计算md5一次
+template_flight = SingleFlight('模板下载') if load_single_flight_config() else None
+# 输入文件在提交后由此线程池准备（下载、计算md5、查缓存），不占用并发槽位
+prepare_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='prepare')
+# 准备阶段中互不依赖的分支（音频、模板视频）在此线程池并发执行
+stage_executor = load_stage_executor()
+# 在init_models中按配置创建，准备阶段用于预热
+avatar_cache = None
+feature_cache = None
+model_readiness = ModelReadiness('AI模型', load_ready_timeout())
+session_manager = load_session_manager(temp_dir, concurrency_manager)
 
 app = Flask(__name__)
 
 
+def run_task(task, code, video_url, key=None, profile=False, cache_key=None, work_dir=None):
+    """执行任务，本地模板视频按md5命中预处理缓存，profile为True时在采样分析器下执行，成功结果按cache_key缓存"""
+    try:
+        with task_context(code), template_key(key or video_key(video_url)), detect_job(code):
+            if profile:
+                with profile_task(code, result_dir, load_profile_interval()) as profile_path:
+                    profile_results[code] = profile_path
+                    task.work()
+            else:
+                profile_results.pop(code, None)
+                task.work()
+        d = task_dic.get(code)
+        if cache_key is not None and d is not None and d[0] == Status.success and d[2]:
+            result_cache.put(cache_key, d[2], {'video_duration': d[5], 'width': d[6], 'height': d[7]})
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def localize_template(video_url, work_dir):
+    """下载模板视频并计算md5，同一地址的并发任务共用一次下载，结果链接到各自目录"""
+    def download():
+        path = localize(video_url, work_dir, 'video')
+        return path, md5sum(path)
+
+    if template_flight is None:
+        return download()
+    (path, md5), leader = template_flight.do(video_url, download)
+    if leader or path == video_url:
+        return path, md5
+    try:
+        os.makedirs(work_dir, exist_ok=True)
+        return link_or_copy(path, os.path.join(work_dir, os.path.basename(path))), md5
+    except OSError as e:
+        # 先到的任务可能已结束并清理了目录
+        logger.warning(f"复用模板下载失败，重新下载: {e}")
+        return download()
+
+
+def prepare_task(code, audio_url, video_url, options, key, profile):
+    """
+    音频和模板视频两条分支并发下载并计算md5，各自分支上再预热音频特征缓存和模板预处理缓存，
+    然后按内容md5和参数查结果缓存，命中直接返回已有结果，未命中用本地文件提交任务
+    """
+    work_dir = os.path.join(temp_dir, f"{code}-inputs")
+    try:
+        graph = StageGraph(code, stage_executor)
+        graph.add('audio_input', lambda: localize(audio_url, work_dir, 'audio'))
+        graph.add('audio_md5', md5sum, deps=('audio_input',))
+        graph.add('video_input', lambda: localize_template(video_url, work_dir))
+        if feature_cache is not None:
+            graph.add('feature_prewarm', feature_cache.prewarm, deps=('audio_md5',))
+        if avatar_cache is not None:
+            graph.add('avatar_prewarm', lambda video: avatar_cache.prewarm(key or video[1]), deps=('video_input',))
+        results = graph.run()
+        audio_path = results['audio_input']
+        video_path, video_md5 = results['video_input']
+        key = key or video_md5
+        cache_key = None
+        meta = None
+        if result_cache is not None:
+            cache_key = content_key(results['audio_md5'], key, options)
+            meta = result_cache.get(cache_key)
+        if meta is not None:
+            result_path = result_cache.materialize(cache_key, os.path.join(result_dir, f"{code}-r.mp4"))
+            task_dic[code] = [Status.success, 100, result_path, '命中结果缓存', 0,
+                              meta['video_duration'], meta['width'], meta['height']]
+            shutil.rmtree(work_dir, ignore_errors=True)
+            logger.info(f"任务{code}命中结果缓存: {cache_key}")
+            return
+        if segment_config is not None and start_segmented(code, audio_path, video_path, options, key, cache_key,
+                                                          work_dir):
+            return
+        task = TransDhTask(code, audio_path, video_path, options['watermark_switch'], options['digital_auth'],
+                           options['chaofen'], options['pn'])
+        concurrency_manager.submit_task(run_task, code, task, code, video_path, key, profile, cache_key, work_dir)
+    except Exception as e:
+        logger.error(f"任务{code}输入准备失败: {e}")
+        traceback.print_exc()
+        task_dic[code] = [Status.error, 0, '', f'输入文件准备失败: {e}']
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def start_segmented(code, audio_path, video_path, options, key, cache_key, work_dir):
+    """长音频按模板循环周期切成带上下文的多段，各段作为子任务并行生成；音频不够长时返回False走普通流程"""
+    wav_path = os.path.join(work_dir, 'audio_16k.wav')
+    duration = to_wav(audio_path, wav_path)
+    if duration < segment_config['min_seconds']:
+        return False
+    frame_count, fps = read_video_info(video_path)
+    cycle = loop_cycle(frame_count, load_loop_mode())
+    segments = plan_segments(int(round(duration * fps)), cycle,
+                             segment_config['max_segments'] or concurrency_manager.max_concurrent_tasks,
+                             segment_config['min_segment_seconds'] * fps,
+                             int(round(segment_config['left_context_seconds'] * fps)),
+                             int(round(segment_config['right_context_seconds'] * fps)))
+    if len(segments) < 2:
+        return False
+    segment_dir = os.path.join(work_dir, 'segments')
+    os.makedirs(segment_dir, exist_ok=True)
+    paths = split_audio(wav_path, segments, fps, segment_dir)
+    logger.info(f"任务{code}分段并行生成: 音频{duration:.1f}s, 模板周期{cycle}帧, "
+                f"{[segment.to_dict() for segment in segments]}")
+    threading.Thread(target=run_segmented, args=(code, wav_path, paths, video_path, segments, fps, options, key,
+                                                 cache_key, work_dir), name=f'segments-{code}', daemon=True).start()
+    return True
+
+
+def run_segmented(code, wav_path, paths, video_path, segments, fps, options, key, cache_key, work_dir):
+    """提交各段子任务并等待完成，截掉上下文后无损拼接为最终结果"""
+    start = time.time()
+    sub_codes = [f"{code}-seg{segment.index}" for segment in segments]
+    progress = 0
+    try:
+        for sub_code, segment, path in zip(sub_codes, segments, paths):
+            write_key_frames(result_dir, sub_code, segment_key_frames(segment, fps))
+            task_dic[sub_code] = [Status.run, 0, '', '排队中']
+            task = TransDhTask(sub_code, path, video_path, options['watermark_switch'], options['digital_auth'],
+                               options['chaofen'], options['pn'])
+            concurrency_manager.submit_task(run_task, sub_code, task, sub_code, video_path, key)
+        while True:
+            states = [task_dic.get(sub_code) for sub_code in sub_codes]
+            failed = [d for d in states if d is None or d[0] == Status.error]
+            if failed:
+                raise CustomError(failed[0][3] if failed[0] is not None else '分段子任务状态丢失')
+            progress = int(sum(float(d[1] or 0) for d in states) / len(states) * 0.95)
+            if all(d[0] == Status.success for d in states):
+                break
+            task_dic[code] = [Status.run, progress, '', f'分段生成中，共{len(segments)}段']
+            time.sleep(1)
+        result_path = concat_segments([d[2] for d in states], segments, fps, wav_path,
+                                      os.path.join(result_dir, f"{code}-r.mp4"), work_dir)
+        cap = cv2.VideoCapture(result_path)
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        duration = segments[-1].end / fps
+        task_dic[code] = [Status.success, 100, result_path, '', round(time.time() - start, 2), duration, width, height]
+        logger.info(f"任务{code}分段生成完成，耗时: {time.time() - start:.1f}s")
+        if cache_key is not None:
+            result_cache.put(cache_key, result_path, {'video_duration': duration, 'width': width, 'height': height})
+    except Exception as e:
+        logger.error(f"任务{code}分段生成失败: {e}")
+        traceback.print_exc()
+        task_dic[code] = [Status.error, progress, '', f'分段生成失败: {e}']
+    finally:
+        # 有子任务失败时等其余子任务结束再清理，避免其状态和关键帧配置被提前删除
+        while any((task_dic.get(sub_code) or [None])[0] == Status.run for sub_code in sub_codes):
+            time.sleep(1)
+        for sub_code in sub_codes:
+            d = task_dic.pop(sub_code, None)
+            if d is not None and d[2] and os.path.exists(d[2]):
+                os.remove(d[2])
+            remove_key_frames(result_dir, sub_code)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def render_session_chunk(clips, code, audio_path, clip):
+    """
+    实时会话的一块音频驱动一次任务，模板用该块周期位置对应的短模板片段，片段预处理首次生成后命中形象缓存；
+    在会话预留的并发槽位内执行
+    """
+    video_path, key = clips[clip]
+    task = TransDhTask(code, audio_path, video_path, 0, 0, 0, 1)
+    with template_key(key):
+        task.work()
+    d = task_dic.pop(code, None)
+    if d is None or d[0] != Status.success:
+        raise CustomError(d[3] if d is not None else '会话视频块生成无结果')
+    return d[2]
+
+
+def preprocess_avatar(avatar_id, video_path, key):
+    """用不短于模板时长的静音音频驱动一次任务，让预处理覆盖模板全部帧并写入缓存"""
+    code = f"avatar-{avatar_id}"
+    frame_count, fps = read_video_info(video_path)
+    seconds = math.ceil(frame_count / fps) + 1
+    audio_path = silence_wav(os.path.join(temp_dir, f'avatar_silence_{seconds}s.wav'), seconds)
+    task = TransDhTask(code, audio_path, video_path, 0, 0, 0, 1)
+    with template_key(key):
+        task.work()
+    d = task_dic.pop(code, None)
+    if d is None or d[0] != Status.success:
+        raise CustomError(d[3] if d is not None else '预处理任务无结果')
+    if d[2] and os.path.exists(d[2]):
+        os.remove(d[2])
+
+
 class EasyResponse:
     def __init__(
             self,
@@ -150,6 +324,9 @@ class ResponseCode(Enum):
     error2 = [10003, '获取锁异常']
     error3 = [10004, '任务不存在']
     duplicate_task = [10005, '任务已存在，正在执行中']
+    avatar_not_found = [10006, '数字人形象不存在']
+    avatar_not_ready = [10007, '数字人形象预处理未完成']
+    session_not_found = [10008, '实时会话不存在']
 
 @app.route('/easy/submit', methods=['POST'])
 def easy_submit():
@@ -164,7 +341,8 @@ def easy_submit():
                 default=lambda obj: obj.__dict__,
                 sort_keys=True, ensure_ascii=False,
                 indent=4)
-        if 'video_url' not in request_data or request_data['video_url'] == '':
+        _avatar_id = request_data.get('avatar_id', '')
+        if _avatar_id == '' and ('video_url' not in request_data or request_data['video_url'] == ''):
             return json.dumps(
                 EasyResponse(ResponseCode.error1.value[0], False, 'video_url参数缺失', {}),
                 default=lambda obj: obj.__dict__,
@@ -200,7 +378,27 @@ def easy_submit():
 
         # 获取其他参数
         _audio_url = request_data['audio_url']
-        _video_url = request_data['video_url']
+        _video_url = request_data.get('video_url', '')
+        _template_key = None
+        if _avatar_id != '':
+            # 已注册形象直接使用本地模板视频和预处理缓存
+            avatar = avatar_registry.get(_avatar_id)
+            if avatar is None:
+                return json.dumps(
+                    EasyResponse(ResponseCode.avatar_not_found.value[0], False, ResponseCode.avatar_not_found.value[1],
+                                 {'avatar_id': _avatar_id}),
+                    default=lambda obj: obj.__dict__,
+                    sort_keys=True, ensure_ascii=False,
+                    indent=4)
+            if avatar['status'] != AvatarStatus.ready.value:
+                return json.dumps(
+                    EasyResponse(ResponseCode.avatar_not_ready.value[0], False, ResponseCode.avatar_not_ready.value[1],
+                                 {'avatar_id': _avatar_id, 'status': avatar['status'], 'msg': avatar['msg']}),
+                    default=lambda obj: obj.__dict__,
+                    sort_keys=True, ensure_ascii=False,
+                    indent=4)
+            _video_url = avatar['video_path']
+            _template_key = avatar['md5']
 
         if 'watermark_switch' not in request_data or request_data['watermark_switch'] == '':
             _watermark_switch = 0
@@ -232,10 +430,33 @@ def easy_submit():
             else:
                 _pn = 0
 
-        # 创建并提交任务
-        task = TransDhTask(_code, _audio_url, _video_url, _watermark_switch, _digital_auth, _chaofen, _pn,)
-        # 使用并发管理器提交任务到队列
-        concurrency_manager.submit_task(task.work, _code)
+        _profile = str(request_data.get('profile', '')) == '1'
+        _stream = str(request_data.get('stream', '')) == '1' and stream_keep_seconds is not None
+        if _stream and not valid_code(_code):
+            return json.dumps(
+                EasyResponse(ResponseCode.error1.value[0], False, '流式输出的code只能包含字母、数字、下划线和短横线', {}),
+                default=lambda obj: obj.__dict__,
+                sort_keys=True, ensure_ascii=False,
+                indent=4)
+
+        if result_cache is not None or template_flight is not None or stage_executor is not None \
+                or segment_config is not None:
+            # 先占住code，准备完成前查询为运行中，重复提交会被拒绝
+            task_dic[_code] = [Status.run, 0, '', '准备输入文件']
+            options = {'watermark_switch': _watermark_switch, 'digital_auth': _digital_auth,
+                       'chaofen': _chaofen, 'pn': _pn}
+            prepare_executor.submit(prepare_task, _code, _audio_url, _video_url, options, _template_key, _profile)
+        else:
+            # 创建并提交任务
+            task = TransDhTask(_code, _audio_url, _video_url, _watermark_switch, _digital_auth, _chaofen, _pn,)
+            # 使用并发管理器提交任务到队列
+            concurrency_manager.submit_task(run_task, _code, task, _code, _video_url, _template_key, _profile)
+        if _stream:
+            # 提交成功后再建目录；写视频进程在生成开始后才检查目录，不会错过
+            try:
+                create_stream(result_dir, _code, stream_keep_seconds)
+            except Exception as e:
+                logger.warning(f"任务 {_code} 创建流式输出目录失败，仅输出完整视频: {e}")
         logger.info(f"新任务已提交: {_code}")
 
         return json.dumps(
@@ -255,6 +476,103 @@ def easy_submit():
         gc.collect()
 
 
+@app.route('/avatar/register', methods=['POST'])
+def avatar_register():
+    """注册数字人形象，后台下载模板视频并完成预处理"""
+    try:
+        request_data = json.loads(request.data)
+        if avatar_cache is None:
+            # 预处理结果只能写入模板缓存，未开启时注册不会让后续任务变快
+            raise CustomError('未开启[avatar_cache]，不支持注册数字人形象')
+        if 'video_url' not in request_data or request_data['video_url'] == '':
+            return json.dumps(
+                EasyResponse(ResponseCode.error1.value[0], False, 'video_url参数缺失', {}),
+                default=lambda obj: obj.__dict__,
+                sort_keys=True, ensure_ascii=False,
+                indent=4)
+        _avatar_id, created = avatar_registry.register(request_data['video_url'],
+                                                       request_data.get('avatar_id') or None)
+        if not created:
+            existing = avatar_registry.get(_avatar_id)
+            return json.dumps(
+                EasyResponse(ResponseCode.success.value[0], True, '形象已注册',
+                             {'avatar_id': _avatar_id, 'status': existing['status']}),
+                default=lambda obj: obj.__dict__,
+                sort_keys=True, ensure_ascii=False,
+                indent=4)
+        # 注册状态保存在本进程内存中，不放到子进程执行
+        concurrency_manager.submit_task(avatar_registry.process, f"avatar-{_avatar_id}", _avatar_id, preprocess_avatar,
+                                        isolated=False)
+        logger.info(f"数字人形象已提交注册: {_avatar_id}")
+        return json.dumps(
+            EasyResponse(ResponseCode.success.value[0], True, ResponseCode.success.value[1],
+                         {'avatar_id': _avatar_id, 'status': AvatarStatus.pending.value}),
+            default=lambda obj: obj.__dict__,
+            sort_keys=True, ensure_ascii=False,
+            indent=4)
+    except CustomError as e:
+        return json.dumps(
+            EasyResponse(ResponseCode.error1.value[0], False, str(e), {}),
+            default=lambda obj: obj.__dict__,
+            sort_keys=True, ensure_ascii=False,
+            indent=4)
+    except Exception as e:
+        logger.error(f"注册数字人形象异常: {e}")
+        traceback.print_exc()
+        return json.dumps(
+            EasyResponse(ResponseCode.system_error.value[0], False, ResponseCode.system_error.value[1], {}),
+            default=lambda obj: obj.__dict__,
+            sort_keys=True, ensure_ascii=False,
+            indent=4)
+
+
+@app.route('/avatar/status', methods=['GET'])
+def avatar_status():
+    """查询数字人形象注册状态"""
+    _avatar_id = request.args.get('avatar_id', '')
+    if _avatar_id == '':
+        return json.dumps(
+            EasyResponse(ResponseCode.error1.value[0], False, 'avatar_id参数缺失', {}),
+            default=lambda obj: obj.__dict__,
+            sort_keys=True, ensure_ascii=False,
+            indent=4)
+    avatar = avatar_registry.get(_avatar_id)
+    if avatar is None:
+        return json.dumps(
+            EasyResponse(ResponseCode.avatar_not_found.value[0], False, ResponseCode.avatar_not_found.value[1],
+                         {'avatar_id': _avatar_id}),
+            default=lambda obj: obj.__dict__,
+            sort_keys=True, ensure_ascii=False,
+            indent=4)
+    return json.dumps(
+        EasyResponse(ResponseCode.success.value[0], True, '', avatar),
+        default=lambda obj: obj.__dict__,
+        sort_keys=True, ensure_ascii=False,
+        indent=4)
+
+
+def playlist_url(code):
+    """任务有HLS输出时返回播放列表地址"""
+    if stream_keep_seconds is None or not playlist_ready(result_dir, code):
+        return None
+    return f"{request.host_url.rstrip('/')}/easy/stream/{code}/{HLS_PLAYLIST}"
+
+
+@app.route('/easy/stream/<code>/<path:name>', methods=['GET'])
+def easy_stream(code, name):
+    """生成过程中的HLS播放列表和fMP4分片"""
+    path = stream_dir(result_dir, code)
+    if stream_keep_seconds is None or path is None:
+        abort(404)
+    if name == HLS_PLAYLIST:
+        response = send_from_directory(path, name,
+                                       mimetype='application/vnd.apple.mpegurl')
+        # 生成中的播放列表持续追加分片
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return send_from_directory(path, name, mimetype='video/mp4')
+
+
 @app.route('/easy/query', methods=['GET'])
 def easy_query():
     del_flag = False
@@ -281,7 +599,8 @@ def easy_query():
                         'status': _status.value,
                         'progress': _progress,
                         'result': _result,
-                        'msg': _msg
+                        'msg': _msg,
+                        'playlist': playlist_url(_code)
                     }),
                     default=lambda obj: obj.__dict__,
                     sort_keys=True, ensure_ascii=False,
@@ -298,7 +617,9 @@ def easy_query():
                         'cost': d[4],
                         "video_duration": d[5],
                         "width": d[6],
-                        "height": d[7]
+                        "height": d[7],
+                        "profile": profile_results.pop(_code, None),
+                        "playlist": playlist_url(_code)
                     }),
                     default=lambda obj: obj.__dict__,
                     sort_keys=True, ensure_ascii=False,
@@ -343,13 +664,51 @@ def easy_query():
 
 
 
+def init_batching():
+    """按配置开启跨任务的ONNX动态批处理"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if config.getint('batching', 'enable', fallback=0):
+        max_batch_size = config.getint('batching', 'max_batch_size', fallback=8)
+        max_wait_ms = config.getfloat('batching', 'max_wait_ms', fallback=5)
+        enable_cross_job_batching(max_batch_size, max_wait_ms)
+        logger.info(f"跨任务ONNX批处理已启用，最大批次: {max_batch_size}, 最长等待: {max_wait_ms}ms")
+        return True
+    return False
+
+
 def init_models():
     """模型初始化"""
+    global avatar_cache, feature_cache
     logger.info("🔧 开始初始化AI模型...")
-    a()
-    init_p()
-    time.sleep(15)
-    logger.info("✅ AI模型初始化完成")
+    batching = init_batching()
+    # 关键帧检测包在自适应检测外层，需后安装
+    load_adaptive_config()
+    load_keyframe_config()
+    # 在批处理、检测替换之后埋点，统计的是对外的完整调用耗时
+    if metrics.load_metrics_config():
+        metrics.install_metrics(concurrency_manager)
+    load_trace_config()
+    model_loader.load_model_loading_config()
+    # 模型子进程启动前替换预处理和音频特征计算，子进程才能继承缓存逻辑
+    avatar_cache = load_avatar_cache()
+    if avatar_cache is not None:
+        install_avatar_cache(avatar_cache, load_single_flight_config())
+    # 特征缓存包在流式提取外层，命中时不再编码
+    load_streaming_bnf_config()
+    feature_cache = load_feature_cache()
+    if feature_cache is not None:
+        install_feature_cache(feature_cache)
+    # 模型子进程加载完成后会阻塞在任务队列上，以此作为就绪信号
+    with model_readiness:
+        a()
+        init_p()
+    if model_readiness.wait():
+        logger.info("✅ AI模型初始化完成")
+    if batching:
+        batchable, total = batchable_models()
+        if total and not batchable:
+            logger.warning(f"已开启跨任务批处理，但本进程{total}个ONNX模型都没有动态batch维，批处理不会生效")
 
 
 
@@ -358,16 +717,23 @@ def init_models():
 def health_check():
     """健康检查接口"""
     try:
-        return json.dumps(
-            EasyResponse(ResponseCode.success.value[0], True, '服务正常', {
-                'status': 'healthy',
-                'models_initialized': True,
+        ready = model_readiness.ready
+        body = json.dumps(
+            EasyResponse(ResponseCode.success.value[0], True, '服务正常' if ready else '模型未就绪', {
+                'status': 'healthy' if ready else model_readiness.state,
+                'models_initialized': ready,
+                'model_readiness': model_readiness.to_dict(),
+                'model_load': model_loader.report.to_dict(),
+                'jobs': task_dic.status_counts(),
                 'worker_pid': os.getpid(),
                 'queue_size': concurrency_manager.get_queue_size(),
-                'current_tasks': concurrency_manager.get_current_tasks()
+                'current_tasks': concurrency_manager.get_current_tasks(),
+                'slots': concurrency_manager.get_slots()
             }),
             default=lambda obj: obj.__dict__,
             sort_keys=True, ensure_ascii=False, indent=2)
+        # 模型未就绪(加载中、超时或子进程退出)时返回503，负载均衡不转发任务
+        return body if ready else (body, 503)
     except Exception as e:
         return json.dumps(
             EasyResponse(ResponseCode.system_error.value[0], False, f'健康检查失败: {str(e)}', {}),
@@ -375,6 +741,127 @@ def health_check():
             sort_keys=True, ensure_ascii=False, indent=2)
 
 
+def session_response(code, success, msg, data):
+    return json.dumps(EasyResponse(code, success, msg, data), default=lambda obj: obj.__dict__,
+                      sort_keys=True, ensure_ascii=False, indent=4)
+
+
+def session_not_found(session_id):
+    return session_response(ResponseCode.session_not_found.value[0], False, ResponseCode.session_not_found.value[1],
+                            {'session_id': session_id})
+
+
+@app.route('/session/start', methods=['POST'])
+def session_start():
+    """为已注册形象创建实时会话，之后上传PCM音频并读取视频流"""
+    if session_manager is None:
+        return session_response(ResponseCode.error1.value[0], False, '实时会话未启用', {})
+    try:
+        request_data = json.loads(request.data)
+        _avatar_id = request_data.get('avatar_id', '')
+        avatar = avatar_registry.get(_avatar_id) if _avatar_id else None
+        if avatar is None:
+            return session_response(ResponseCode.avatar_not_found.value[0], False,
+                                    ResponseCode.avatar_not_found.value[1], {'avatar_id': _avatar_id})
+        if avatar['status'] != AvatarStatus.ready.value:
+            return session_response(ResponseCode.avatar_not_ready.value[0], False,
+                                    ResponseCode.avatar_not_ready.value[1],
+                                    {'avatar_id': _avatar_id, 'status': avatar['status']})
+        frame_count, fps = read_video_info(avatar['video_path'])
+        mode = load_loop_mode()
+        # 周期按不短于min_chunk_seconds均分成块，每块用从该周期位置开始的模板片段生成，块间模板位置连续
+        bounds = cycle_bounds(loop_cycle(frame_count, mode), math.ceil(session_manager.min_chunk_seconds * fps))
+        extra_frames = math.ceil(session_manager.lookahead_seconds * fps) + 1
+        clip_dir = (f"{os.path.splitext(avatar['video_path'])[0]}-clips-"
+                    f"{mode}-{bounds[-1]}x{len(bounds) - 1}-{extra_frames}")
+        paths = write_loop_clips(avatar['video_path'], clip_dir, bounds, extra_frames,
+                                 silence_wav(os.path.join(temp_dir, 'avatar_silence.wav')), mode)
+        clips = [(path, md5sum(path)) for path in paths]
+        session = session_manager.create(functools.partial(render_session_chunk, clips), bounds, fps)
+        return session_response(ResponseCode.success.value[0], True, ResponseCode.success.value[1], {
+            'session_id': session.session_id,
+            'sample_rate': 16000,
+            'sample_format': 's16le',
+            'chunk_seconds': round(session.chunk_seconds, 3),
+            'stream_url': f"{request.host_url.rstrip('/')}/session/{session.session_id}/stream"
+        })
+    except CustomError as e:
+        return session_response(ResponseCode.busy.value[0], False, str(e), {})
+    except Exception as e:
+        logger.error(f"创建实时会话异常: {e}")
+        traceback.print_exc()
+        return session_response(ResponseCode.system_error.value[0], False, ResponseCode.system_error.value[1], {})
+
+
+@app.route('/session/<session_id>/audio', methods=['POST'])
+def session_audio(session_id):
+    """上传一段16kHz单声道s16le PCM，可多次调用"""
+    session = session_manager.get(session_id) if session_manager is not None else None
+    if session is None:
+        return session_not_found(session_id)
+    try:
+        received = session.feed(request.get_data())
+    except CustomError as e:
+        return session_response(ResponseCode.error1.value[0], False, str(e), {'session_id': session_id})
+    return session_response(ResponseCode.success.value[0], True, ResponseCode.success.value[1],
+                            {'session_id': session_id, 'received_seconds': round(received, 3)})
+
+
+@app.route('/session/<session_id>/close', methods=['POST'])
+def session_close(session_id):
+    """音频输入结束，已上传的音频生成完后视频流结束"""
+    session = session_manager.get(session_id) if session_manager is not None else None
+    if session is None:
+        return session_not_found(session_id)
+    session.close()
+    return session_response(ResponseCode.success.value[0], True, ResponseCode.success.value[1], session.stats())
+
+
+@app.route('/session/<session_id>/stream', methods=['GET'])
+def session_stream(session_id):
+    """分块HTTP持续返回MPEG-TS视频"""
+    session = session_manager.get(session_id) if session_manager is not None else None
+    if session is None:
+        return session_not_found(session_id)
+    return Response(session.stream(), mimetype='video/mp2t')
+
+
+@app.route('/session/<session_id>/stats', methods=['GET'])
+def session_stats(session_id):
+    """会话延迟和实时率：latency为一块音频到齐到对应视频块产出的时间，rtf为处理耗时/音频时长"""
+    session = session_manager.get(session_id) if session_manager is not None else None
+    if session is None:
+        return session_not_found(session_id)
+    return session_response(ResponseCode.success.value[0], True, ResponseCode.success.value[1], session.stats())
+
+
+@app.route('/easy/trace', methods=['GET'])
+def easy_trace():
+    """下载任务的Chrome trace / Perfetto格式耗时追踪"""
+    _code = request.args.get('code', '')
+    if _code == '':
+        return json.dumps(
+            EasyResponse(ResponseCode.error1.value[0], False, 'code参数缺失', {}),
+            default=lambda obj: obj.__dict__,
+            sort_keys=True, ensure_ascii=False,
+            indent=4)
+    trace = export_trace(_code)
+    if trace is None:
+        return json.dumps(
+            EasyResponse(ResponseCode.error3.value[0], True, ResponseCode.error3.value[1], {}),
+            default=lambda obj: obj.__dict__,
+            sort_keys=True, ensure_ascii=False,
+            indent=4)
+    return Response(json.dumps(trace, ensure_ascii=False), mimetype='application/json',
+                    headers={'Content-Disposition': f'attachment; filename={_code}.trace.json'})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_export():
+    """Prometheus文本格式的运行指标"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/gpu/status', methods=['GET'])
 def gpu_status():
     """GPU状态查询接口"""
@@ -13,109 +13,18 @@ os.chdir('/code')
 import time
 import traceback
 from enum import Enum
-import configparser
-import queue
-from threading import Lock
 
 from service.self_logger import logger
 from flask import Flask, request
 from service.config import *
+from service.concurrency_manager import ConcurrencyManager, load_concurrent_config
 from service.trans_dh_service import TransDhTask, Status,a, init_p, task_dic
 
 import json
-import threading
 import gc
 import cv2
 
 
-class ConcurrencyManager:
-    """并发管理器，支持可配置的并发数和队列等待"""
-
-    def __init__(self, max_concurrent_tasks=4):
-        self.max_concurrent_tasks = max_concurrent_tasks
-        self.current_tasks = 0
-        self.task_queue = queue.Queue()
-        self.lock = Lock()
-        self.worker_thread = None
-        self._start_worker()
-        logger.info(f"并发管理器初始化完成，最大并发数: {max_concurrent_tasks}")
-
-    def _start_worker(self):
-        """启动工作线程来处理队列中的任务"""
-        def worker():
-            while True:
-                try:
-                    # 从队列中获取任务
-                    task_info = self.task_queue.get(timeout=1)
-                    if task_info is None:  # 停止信号
-                        break
-
-                    # 检查任务信息格式
-                    if len(task_info) != 3:
-                        logger.error(f"任务信息格式错误: {task_info}")
-                        continue
-
-                    # 等待可用的并发槽位
-                    while True:
-                        with self.lock:
-                            if self.current_tasks < self.max_concurrent_tasks:
-                                self.current_tasks += 1
-                                break
-                        time.sleep(0.1)
-
-                    # 执行任���
-                    task, args, task_id = task_info
-                    try:
-                        logger.info(f"开始执行任务: {task_id}, 当前并发数: {self.current_tasks}")
-                        task(*args)
-                    except Exception as e:
-                        logger.error(f"任务执行异常 {task_id}: {e}")
-                        traceback.print_exc()
-                    finally:
-                        # 释放并发槽位
-                        with self.lock:
-                            self.current_tasks -= 1
-                        logger.info(f"任务完成: {task_id}, 当前并发数: {self.current_tasks}")
-
-                except queue.Empty:
-                    continue
-                except Exception as e:
-                    logger.error(f"工作线程异常: {e}")
-                    traceback.print_exc()
-
-        self.worker_thread = threading.Thread(target=worker, daemon=True)
-        self.worker_thread.start()
-
-    def submit_task(self, task, task_id, *args):
-        """提交任务到队列"""
-        self.task_queue.put((task, args, task_id))
-        queue_size = self.task_queue.qsize()
-        logger.info(f"任务已提交到队列: {task_id}, 队列长度: {queue_size}")
-        return True
-
-    def get_queue_size(self):
-        """获取队列长度"""
-        return self.task_queue.qsize()
-
-    def get_current_tasks(self):
-        """获取当前运行的任务数"""
-        with self.lock:
-            return self.current_tasks
-
-
-def load_concurrent_config():
-    """从配置文件加载并发配置"""
-    try:
-        config = configparser.ConfigParser()
-        config.read('config/config.ini')
-        batch_size = config.getint('digital', 'batch_size', fallback=4)
-        logger.info(f"从配置文件读取并发数: {batch_size}")
-        return batch_size
-    except Exception as e:
-        logger.warning(f"读取配置失败，使用默认并发数4: {e}")
-        return 4
-
-
 # 创建全局并发管理器
 concurrent_tasks = load_concurrent_config()
 concurrency_manager = ConcurrencyManager(concurrent_tasks)
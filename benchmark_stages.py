@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线分阶段性能基准
+不依赖HTTP服务，用合成的视频和音频在进程内逐个驱动各处理阶段，
+输出每个阶段的帧率、p50/p99延迟和峰值内存(JSON)，纯CPU机器即可运行，用于版本间回归对比
+
+python benchmark_stages.py --frames 100 --output bench_stages.json
+python benchmark_stages.py --stages video_decode,scrfd,encode
+"""
+import argparse
+import http.server
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import wave
+
+# 基准固定跑CPU，保证不同机器结果可比
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+import cv2
+import numpy as np
+
+CPU_PROVIDERS = ['CPUExecutionProvider']
+RESOURCES = './face_detect_utils/resources'
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def read_peak_rss_mb():
+    """读取进程峰值常驻内存VmHWM"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """写clear_refs=5重置VmHWM，使峰值只统计当前阶段"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class SyntheticData:
+    """生成合成测试数据：带移动"人脸"椭圆的视频和调制正弦波音频"""
+
+    def __init__(self, work_dir, frames, width, height, fps=25, sample_rate=16000):
+        self.work_dir = work_dir
+        self.frames = frames
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.sample_rate = sample_rate
+        self.video_path = os.path.join(work_dir, 'synthetic.mp4')
+        self.audio_path = os.path.join(work_dir, 'synthetic.wav')
+        self._make_video()
+        self._make_audio()
+
+    def frame(self, i):
+        img = np.full((self.height, self.width, 3), 90, dtype=np.uint8)
+        cx = self.width // 2 + int(10 * np.sin(i / 10))
+        cy = self.height // 2 + int(6 * np.cos(i / 12))
+        axes = (self.width // 8, self.height // 6)
+        cv2.ellipse(img, (cx, cy), axes, 0, 0, 360, (150, 180, 220), -1)
+        cv2.circle(img, (cx - axes[0] // 3, cy - axes[1] // 4), axes[0] // 8, (40, 40, 40), -1)
+        cv2.circle(img, (cx + axes[0] // 3, cy - axes[1] // 4), axes[0] // 8, (40, 40, 40), -1)
+        cv2.ellipse(img, (cx, cy + axes[1] // 2), (axes[0] // 3, 4 + i % 10), 0, 0, 360, (60, 60, 160), -1)
+        return img
+
+    def face_crop(self, img, size):
+        h, w = img.shape[:2]
+        half = min(w // 6, h // 4)
+        crop = img[h // 2 - half:h // 2 + half, w // 2 - half:w // 2 + half]
+        return cv2.resize(crop, (size, size))
+
+    def _make_video(self):
+        writer = cv2.VideoWriter(self.video_path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps,
+                                 (self.width, self.height))
+        for i in range(self.frames):
+            writer.write(self.frame(i))
+        writer.release()
+
+    def _make_audio(self):
+        seconds = self.frames / self.fps
+        t = np.arange(int(seconds * self.sample_rate)) / self.sample_rate
+        wav = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t))
+        with wave.open(self.audio_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sample_rate)
+            f.writeframes((wav * 32767).astype(np.int16).tobytes())
+
+
+class Stage:
+    """一个待测阶段：setup返回可调用对象，每次调用处理units帧"""
+
+    def __init__(self, name, setup, iterations, units=1):
+        self.name = name
+        self.setup = setup
+        self.iterations = iterations
+        self.units = units
+
+    def run(self, warmup=2):
+        reset_ok = reset_peak_rss()
+        try:
+            fn = self.setup()
+        except Exception as e:
+            return {'status': 'skipped', 'reason': f"{type(e).__name__}: {e}"}
+        latencies = []
+        try:
+            for i in range(min(warmup, self.iterations)):
+                fn(i)
+            start = time.perf_counter()
+            for i in range(self.iterations):
+                t0 = time.perf_counter()
+                fn(i)
+                latencies.append((time.perf_counter() - t0) * 1000)
+            total = time.perf_counter() - start
+        except Exception as e:
+            traceback.print_exc()
+            return {'status': 'failed', 'reason': f"{type(e).__name__}: {e}"}
+        return {
+            'status': 'ok',
+            'iterations': self.iterations,
+            'frames': self.iterations * self.units,
+            'fps': round(self.iterations * self.units / total, 2) if total > 0 else 0,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'peak_rss_mb': round(read_peak_rss_mb(), 1),
+            'peak_rss_scope': 'stage' if reset_ok else 'process'
+        }
+
+
+def build_stages(data, frames, deepspeech_graph):
+    """各阶段的模型构造与调用，模型文件缺失或当前环境无法加载时该阶段记为skipped"""
+    crops = {}
+
+    def crop(size):
+        if size not in crops:
+            crops[size] = data.face_crop(data.frame(0), size)
+        return crops[size]
+
+    def setup_download():
+        from service.file_fetcher import fetch
+
+        handler = lambda *a, **kw: http.server.SimpleHTTPRequestHandler(*a, directory=data.work_dir, **kw)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.RequestHandlerClass.log_message = lambda *a: None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/synthetic.mp4"
+        return lambda i: fetch(url, os.path.join(data.work_dir, 'download.mp4'))
+
+    def setup_decode():
+        def decode(i):
+            cap = cv2.VideoCapture(data.video_path)
+            while cap.read()[0]:
+                pass
+            cap.release()
+        return decode
+
+    def setup_scrfd():
+        import onnxruntime as ort
+        from face_detect_utils.scrfd import SCRFD
+
+        path = os.path.join(RESOURCES, 'scrfd_500m_bnkps_shape640x640.onnx')
+        detector = SCRFD(model_file=path, session=ort.InferenceSession(path, providers=CPU_PROVIDERS))
+        detector.prepare(-1, input_size=(640, 640))
+        imgs = [data.frame(i) for i in range(8)]
+        return lambda i: detector.detect(imgs[i % len(imgs)], 0.5)
+
+    def setup_pfpld():
+        from face_detect_utils.face_detect import pfpld
+
+        model = pfpld(os.path.join(RESOURCES, 'pfpld_robust_sim_bs1_8003.onnx'))
+        return lambda i: model.forward(crop(112))
+
+    def setup_headpose():
+        from face_detect_utils.head_pose import Headpose
+
+        model = Headpose(os.path.join(RESOURCES, 'model_float32.onnx'))
+        return lambda i: model.get_head_pose(crop(224))
+
+    def setup_face_parsing():
+        from face_lib.face_parsing import FaceParsing
+
+        model = FaceParsing(provider='cpu')
+        return lambda i: model.forward(crop(512))
+
+    def setup_gfpgan():
+        from face_lib.face_restore import GFPGAN
+
+        model = GFPGAN(provider='cpu')
+        return lambda i: model.forward(crop(512))
+
+    def setup_ppg():
+        import torch
+        from wenet.compute_ctc_att_bnf import load_ppg_model
+
+        model = load_ppg_model('./wenet/examples/aishell/aidata/conf/train_conformer_multi_cn.yaml',
+                               './wenet/examples/aishell/aidata/exp/conformer/wenetmodel.pt', 'cpu')
+        with wave.open(data.audio_path) as f:
+            wav = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).astype(np.float32) / 32768
+        wav_tensor = torch.from_numpy(wav).unsqueeze(0)
+        wav_length = torch.LongTensor([wav.shape[0]])
+
+        def forward(i):
+            with torch.no_grad():
+                model(wav_tensor, wav_length)
+        return forward
+
+    def setup_deepspeech():
+        from landmark2face_wy.audio_handler import AudioHandler
+
+        if not os.path.exists(deepspeech_graph):
+            raise FileNotFoundError(deepspeech_graph)
+        handler = AudioHandler({'deepspeech_graph_fname': deepspeech_graph, 'audio_feature_type': 'deepspeech',
+                                'num_audio_features': 29, 'audio_window_size': 16, 'audio_window_stride': 1})
+        with wave.open(data.audio_path) as f:
+            wav = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        audio = {'bench': {'synthetic': {'audio': wav, 'sample_rate': data.sample_rate}}}
+        return lambda i: handler.process(audio)
+
+    def setup_encode():
+        from service.video_writer import FFmpegPipeWriter
+
+        imgs = [data.frame(i) for i in range(8)]
+        result_path = os.path.join(data.work_dir, 'encode.mp4')
+        state = {}
+
+        def encode(i):
+            if 'writer' not in state:
+                state['writer'] = FFmpegPipeWriter(result_path, data.audio_path, data.width, data.height,
+                                                   data.fps, preset='medium', crf=15)
+            state['writer'].write(imgs[i % len(imgs)])
+            # 每轮最后一帧关闭写入器，等待编码和音频合成完成的时间计入该帧
+            if i % frames == frames - 1:
+                state.pop('writer').close()
+        return encode
+
+    return [
+        Stage('download', setup_download, 5),
+        Stage('video_decode', setup_decode, 3, units=frames),
+        Stage('scrfd', setup_scrfd, frames),
+        Stage('pfpld', setup_pfpld, frames),
+        Stage('headpose', setup_headpose, frames),
+        Stage('face_parsing', setup_face_parsing, frames),
+        Stage('ppg_features', setup_ppg, 3, units=frames),
+        Stage('deepspeech_features', setup_deepspeech, 3, units=frames),
+        Stage('gfpgan', setup_gfpgan, frames),
+        Stage('encode', setup_encode, frames),
+    ]
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线分阶段性能基准')
+    parser.add_argument('--frames', type=int, default=100, help='合成视频帧数，也是逐帧阶段的迭代次数')
+    parser.add_argument('--width', type=int, default=1080)
+    parser.add_argument('--height', type=int, default=1920)
+    parser.add_argument('--stages', type=str, default='', help='逗号分隔的阶段名，默认全部')
+    parser.add_argument('--deepspeech_graph', type=str, default='./ds_graph/output_graph.pb',
+                        help='AudioHandler使用的DeepSpeech模型，不存在时跳过deepspeech_features阶段')
+    parser.add_argument('--output', type=str, default='bench_stages.json')
+    opt = parser.parse_args()
+
+    print("🧪 HeyGem 离线分阶段性能基准(CPU)")
+    print("=" * 50)
+    work_dir = tempfile.mkdtemp(prefix='dh_bench_')
+    try:
+        data = SyntheticData(work_dir, opt.frames, opt.width, opt.height)
+        selected = set(filter(None, opt.stages.split(',')))
+        results = {}
+        for stage in build_stages(data, opt.frames, opt.deepspeech_graph):
+            if selected and stage.name not in selected:
+                continue
+            print(f"\n🎯 {stage.name}")
+            result = stage.run()
+            results[stage.name] = result
+            if result['status'] == 'ok':
+                print(f"🔥 {result['fps']} 帧/秒, p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, "
+                      f"峰值内存 {result['peak_rss_mb']}MB")
+            else:
+                print(f"⚠️  {result['status']}: {result['reason']}")
+        report = {
+            'version': git_version(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'frames': opt.frames,
+            'resolution': f"{opt.width}x{opt.height}",
+            'stages': results
+        }
+        with open(opt.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n📋 测试结果已保存到 {opt.output}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
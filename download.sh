@@ -10,6 +10,9 @@ mkdir -p face_detect_utils/resources
 wget https://github.com/Holasyb918/HeyGem-Linux-Python-Hack/releases/download/ckpts_and_onnx/pfpld_robust_sim_bs1_8003.onnx -O face_detect_utils/resources/pfpld_robust_sim_bs1_8003.onnx
 wget https://github.com/Holasyb918/HeyGem-Linux-Python-Hack/releases/download/ckpts_and_onnx/scrfd_500m_bnkps_shape640x640.onnx -O face_detect_utils/resources/scrfd_500m_bnkps_shape640x640.onnx
 wget https://github.com/Holasyb918/HeyGem-Linux-Python-Hack/releases/download/ckpts_and_onnx/model_float32.onnx -O face_detect_utils/resources/model_float32.onnx
+# adaptive_detect复检模型，下载失败时不启用自适应人脸检测
+wget https://github.com/Holasyb918/HeyGem-Linux-Python-Hack/releases/download/ckpts_and_onnx/scrfd_10g_bnkps.onnx -O face_detect_utils/resources/scrfd_10g_bnkps.onnx \
+    || rm -f face_detect_utils/resources/scrfd_10g_bnkps.onnx
 
 # dh model
 mkdir -p landmark2face_wy/checkpoints/anylang
@@ -0,0 +1,138 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : adaptive_detect.py
+@ide    : PyCharm
+@time   : 2026-10-17 16:48:09
+"""
+import configparser
+import os
+import threading
+
+from face_detect_utils.detect_job import install_job_scope, job_or_default
+from face_detect_utils.keyframe_detect import bbox_iou
+from y_utils.logger import logger
+
+SCRFD_10G_PATH = './face_detect_utils/resources/scrfd_10g_bnkps.onnx'
+
+
+class _TrackState:
+    def __init__(self):
+        self.tracked = None
+
+
+class AdaptiveSCRFD:
+    """
+    先用scrfd_500m检测，置信度低、人脸过小或与跟踪框不一致时再用scrfd_10g复检；
+    跟踪框和模型使用统计挂在检测任务(detect_job)上，任务结束时随关键帧统计一起输出
+    """
+
+    def __init__(self, detect_fn, model_10g_path=SCRFD_10G_PATH, providers=None, min_score=0.7,
+                 min_face_size=64, min_iou=0.5):
+        self.detect_fn = detect_fn
+        self.model_10g_path = model_10g_path
+        self.providers = providers
+        self.min_score = min_score
+        self.min_face_size = min_face_size
+        self.min_iou = min_iou
+        self.detector_10g = None
+        self.lock = threading.Lock()
+
+    def _get_10g(self):
+        with self.lock:
+            if self.detector_10g is None:
+                from face_detect_utils.scrfd import SCRFD
+                import onnxruntime as ort
+
+                session = ort.InferenceSession(self.model_10g_path, providers=self.providers)
+                self.detector_10g = SCRFD(model_file=self.model_10g_path, session=session)
+                self.detector_10g.prepare(0, input_size=(640, 640))
+                logger.info(f"scrfd_10g检测模型加载完成: {self.model_10g_path}")
+            return self.detector_10g
+
+    def _escalate_reason(self, state, bboxes):
+        if bboxes is None or len(bboxes) == 0:
+            return 'no_face'
+        bbox = bboxes[0]
+        if bbox[4] < self.min_score:
+            return 'low_score'
+        if min(bbox[2] - bbox[0], bbox[3] - bbox[1]) < self.min_face_size:
+            return 'small_face'
+        if state.tracked is not None and bbox_iou(bbox, state.tracked) < self.min_iou:
+            return 'track_mismatch'
+        return None
+
+    def detect(self, img, *args, **kwargs):
+        job = job_or_default()
+        state = job.state(self, _TrackState)
+        bboxes, kpss = self.detect_fn(img, *args, **kwargs)
+        reason = self._escalate_reason(state, bboxes)
+        if reason is None:
+            job.count('500m')
+        else:
+            job.count('10g')
+            job.count('reason_' + reason)
+            kwargs = dict(kwargs)
+            kwargs.pop('input_size', None)
+            bboxes_10g, kpss_10g = self._get_10g().detect(img, *args, **kwargs)
+            if bboxes_10g is not None and len(bboxes_10g) > 0:
+                bboxes, kpss = bboxes_10g, kpss_10g
+        if bboxes is not None and len(bboxes) > 0:
+            state.tracked = bboxes[0][:4].copy()
+        return bboxes, kpss
+
+
+def install_adaptive_detection(**kwargs):
+    """替换scrfd_500m实例的SCRFD.detect，其他模型保持原逻辑"""
+    from face_detect_utils.scrfd import SCRFD
+
+    if getattr(SCRFD.detect, '_adaptive', False):
+        return
+    origin_detect = SCRFD.detect
+    adaptives = {}
+    lock = threading.Lock()
+
+    def reinit_locks():
+        # fork出的任务子进程里没有持锁的线程，重建锁
+        nonlocal lock
+        lock = threading.Lock()
+        for adaptive in adaptives.values():
+            adaptive.lock = threading.Lock()
+
+    os.register_at_fork(after_in_child=reinit_locks)
+
+    def detect(self, img, *args, **kw):
+        if '500m' not in os.path.basename(getattr(self, 'model_file', '') or ''):
+            return origin_detect(self, img, *args, **kw)
+        with lock:
+            adaptive = adaptives.get(id(self))
+            if adaptive is None:
+                providers = self.session.get_providers() if getattr(self, 'session', None) is not None else None
+                adaptive = adaptives[id(self)] = AdaptiveSCRFD(
+                    lambda *a, **k: origin_detect(self, *a, **k), providers=providers, **kwargs)
+        return adaptive.detect(img, *args, **kw)
+
+    detect._adaptive = True
+    SCRFD.detect = detect
+    install_job_scope()
+    logger.info(f"自适应人脸检测已启用: {kwargs}")
+
+
+def load_adaptive_config():
+    """读取[adaptive_detect]配置并按需启用"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('adaptive_detect', 'enable', fallback=0):
+        return
+    model_10g_path = config.get('adaptive_detect', 'model_10g_path', fallback=SCRFD_10G_PATH)
+    if not os.path.exists(model_10g_path):
+        # 缺少复检模型时所有帧都只能走500m，启用后的统计会误导，直接不启用
+        logger.warning(f"scrfd_10g检测模型不存在，不启用自适应人脸检测: {model_10g_path}，请执行download.sh下载")
+        return
+    install_adaptive_detection(
+        model_10g_path=model_10g_path,
+        min_score=config.getfloat('adaptive_detect', 'min_score', fallback=0.7),
+        min_face_size=config.getint('adaptive_detect', 'min_face_size', fallback=64),
+        min_iou=config.getfloat('adaptive_detect', 'min_iou', fallback=0.5))
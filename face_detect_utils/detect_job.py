@@ -0,0 +1,101 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : detect_job.py
+@ide    : PyCharm
+@time   : 2026-10-18 10:12:36
+"""
+import functools
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from y_utils.logger import logger
+
+_local = threading.local()
+
+
+class DetectJob:
+    """一次任务的人脸检测状态：各检测器的跟踪状态和统计挂在任务上，任务结束即丢弃，不会带到下一个任务"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.states = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def state(self, owner, factory):
+        """owner(检测器)在本任务内的状态，首次使用时由factory创建"""
+        with self.lock:
+            state = self.states.get(id(owner))
+            if state is None:
+                state = self.states[id(owner)] = factory()
+            return state
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        if stats.get('keyframe'):
+            logger.info(f"[{self.job_id}]关键帧检测统计: 完整检测{stats['keyframe']}帧, "
+                        f"ROI检测{stats.get('roi_detect', 0)}帧, 复用{stats.get('reused', 0)}帧")
+        small, large = stats.get('500m', 0), stats.get('10g', 0)
+        if small or large:
+            reasons = ', '.join(f"{k[7:]}:{v}" for k, v in stats.items() if k.startswith('reason_'))
+            logger.info(f"[{self.job_id}]人脸检测模型统计: scrfd_500m {small}帧, scrfd_10g {large}帧"
+                        f"({large / (small + large) * 100:.1f}%), 升级原因: {reasons or '无'}")
+
+
+def current_job():
+    return getattr(_local, 'job', None)
+
+
+def job_or_default():
+    """当前线程所在的检测任务；不在任何任务内时用按线程保存的默认任务(不会被重置)"""
+    job = current_job()
+    if job is None:
+        job = getattr(_local, 'default', None)
+        if job is None:
+            job = _local.default = DetectJob(f"thread-{threading.get_ident()}")
+    return job
+
+
+@contextmanager
+def detect_job(job_id):
+    """在当前线程声明一次检测任务，结束时输出统计；已在任务内时沿用外层任务"""
+    outer = current_job()
+    if outer is not None:
+        yield outer
+        return
+    job = _local.job = DetectJob(job_id)
+    try:
+        yield job
+    finally:
+        _local.job = None
+        job.report()
+
+
+def install_job_scope():
+    """
+    模板预处理(op.flow)也作为一次检测任务：预处理不在run_task所在线程/进程执行时(如模型子进程)，
+    跟踪状态和统计同样按每次预处理重置
+    """
+    from preprocess_audio_and_3dmm import op
+
+    if getattr(op.flow, '_detect_job', False):
+        return
+    origin_flow = op.flow
+
+    @functools.wraps(origin_flow)
+    def flow(self, *args, **kwargs):
+        with detect_job(f"preprocess-{os.getpid()}-{id(self)}"):
+            return origin_flow(self, *args, **kwargs)
+
+    flow._detect_job = True
+    op.flow = flow
@@ -0,0 +1,169 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : keyframe_detect.py
+@ide    : PyCharm
+@time   : 2026-10-17 16:02:41
+"""
+import configparser
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from face_detect_utils.detect_job import install_job_scope, job_or_default
+from y_utils.logger import logger
+
+
+def bbox_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class _TrackState:
+    def __init__(self):
+        self.shape = None
+        self.result = None
+        self.roi = None
+        self.roi_thumb = None
+        # 本任务内的帧序号和上一个关键帧的序号
+        self.frame_index = -1
+        self.key_index = None
+
+
+class KeyframeDetector:
+    """
+    关键帧检测：每interval帧或人脸区域运动超过drift_threshold时做一次完整SCRFD检测，
+    中间帧复用上一次结果，运动较大时先在扩展ROI内重新检测；
+    跟踪状态按检测任务(detect_job)保存，帧序号在任务内计数，每个任务从关键帧开始
+    """
+
+    def __init__(self, detect_fn, interval=10, drift_threshold=0.04, min_score=0.6, min_iou=0.5,
+                 roi_scale=1.8, roi_input_size=None, thumb_size=32):
+        self.detect_fn = detect_fn
+        self.interval = interval
+        self.drift_threshold = drift_threshold
+        self.min_score = min_score
+        self.min_iou = min_iou
+        self.roi_scale = roi_scale
+        self.roi_input_size = roi_input_size
+        self.thumb_size = thumb_size
+
+    def _roi(self, img, bbox):
+        h, w = img.shape[:2]
+        cx, cy = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+        half = max(bbox[2] - bbox[0], bbox[3] - bbox[1]) * self.roi_scale / 2
+        return (int(max(0, cx - half)), int(max(0, cy - half)),
+                int(min(w, cx + half)), int(min(h, cy + half)))
+
+    def _thumb(self, img, roi):
+        crop = img[roi[1]:roi[3], roi[0]:roi[2]]
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        return cv2.resize(gray, (self.thumb_size, self.thumb_size)).astype(np.float32) / 255
+
+    def _keyframe(self, job, state, img, args, kwargs):
+        bboxes, kpss = self.detect_fn(img, *args, **kwargs)
+        state.key_index = state.frame_index
+        job.count('keyframe')
+        self._remember(state, img, bboxes, kpss)
+        return bboxes, kpss
+
+    def _remember(self, state, img, bboxes, kpss):
+        state.shape = img.shape
+        state.result = (bboxes, kpss)
+        if bboxes is not None and len(bboxes) > 0:
+            state.roi = self._roi(img, bboxes[0])
+            state.roi_thumb = self._thumb(img, state.roi)
+        else:
+            state.roi = None
+            state.roi_thumb = None
+
+    def _roi_detect(self, state, img, args, kwargs):
+        x1, y1, x2, y2 = state.roi
+        kwargs = dict(kwargs)
+        kwargs['input_size'] = self.roi_input_size
+        bboxes, kpss = self.detect_fn(img[y1:y2, x1:x2], *args, **kwargs)
+        if bboxes is None or len(bboxes) == 0 or bboxes[0][4] < self.min_score:
+            return None
+        bboxes = bboxes.copy()
+        bboxes[:, [0, 2]] += x1
+        bboxes[:, [1, 3]] += y1
+        if kpss is not None:
+            kpss = kpss.copy()
+            kpss[..., 0] += x1
+            kpss[..., 1] += y1
+        if bbox_iou(bboxes[0], state.result[0][0]) < self.min_iou:
+            return None
+        return bboxes, kpss
+
+    def detect(self, img, *args, **kwargs):
+        job = job_or_default()
+        state = job.state(self, _TrackState)
+        state.frame_index += 1
+        if state.result is None or state.roi is None or img.shape != state.shape \
+                or state.frame_index - state.key_index >= self.interval or state.result[0][0][4] < self.min_score:
+            return self._keyframe(job, state, img, args, kwargs)
+        motion = float(np.abs(self._thumb(img, state.roi) - state.roi_thumb).mean())
+        if motion <= self.drift_threshold:
+            job.count('reused')
+            # 调用方可能原地修改检测结果，返回副本
+            return tuple(None if value is None else value.copy() for value in state.result)
+        if self.roi_input_size is not None:
+            result = self._roi_detect(state, img, args, kwargs)
+            if result is not None:
+                job.count('roi_detect')
+                self._remember(state, img, *result)
+                return result
+        return self._keyframe(job, state, img, args, kwargs)
+
+
+def install_keyframe_detection(interval=10, drift_threshold=0.04, min_score=0.6, roi_input_size=None):
+    """替换SCRFD.detect，每个检测器实例在每个检测任务内维护跟踪状态"""
+    from face_detect_utils.scrfd import SCRFD
+
+    if getattr(SCRFD.detect, '_keyframe', False):
+        return
+    origin_detect = SCRFD.detect
+    trackers = {}
+    lock = threading.Lock()
+
+    def reinit_lock():
+        # fork出的任务子进程里没有持锁的线程，重建锁
+        nonlocal lock
+        lock = threading.Lock()
+
+    os.register_at_fork(after_in_child=reinit_lock)
+
+    def detect(self, img, *args, **kwargs):
+        with lock:
+            tracker = trackers.get(id(self))
+            if tracker is None:
+                tracker = trackers[id(self)] = KeyframeDetector(
+                    lambda *a, **kw: origin_detect(self, *a, **kw), interval, drift_threshold, min_score,
+                    roi_input_size=roi_input_size)
+        return tracker.detect(img, *args, **kwargs)
+
+    detect._keyframe = True
+    SCRFD.detect = detect
+    install_job_scope()
+    logger.info(f"关键帧人脸检测已启用，间隔: {interval}帧, 漂移阈值: {drift_threshold}")
+
+
+def load_keyframe_config():
+    """读取[face_track]配置并按需启用关键帧检测"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('face_track', 'enable', fallback=0):
+        return
+    roi_input_size = config.getint('face_track', 'roi_input_size', fallback=0)
+    install_keyframe_detection(
+        config.getint('face_track', 'interval', fallback=10),
+        config.getfloat('face_track', 'drift_threshold', fallback=0.04),
+        config.getfloat('face_track', 'min_score', fallback=0.6),
+        (roi_input_size, roi_input_size) if roi_input_size else None)
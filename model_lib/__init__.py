@@ -1,4 +1,4 @@
-from .base_wrapper import ONNXModel
+from .base_wrapper import ONNXModel, BatchServer, batchable_models, enable_cross_job_batching
 from .model_base import ModelBase
 
 
@@ -3,4 +3,5 @@
 
 
 from .onnx_model import ONNXModel
+from .batch_server import BatchServer, batchable_models, enable_cross_job_batching
 
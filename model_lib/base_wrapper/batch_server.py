@@ -0,0 +1,229 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/17
+
+
+import os
+import queue
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from y_utils.logger import logger
+from .onnx_model import ONNXModel
+
+
+class _Request:
+    def __init__(self, image_tensor, kwargs):
+        self.image_tensor = image_tensor
+        self.kwargs = kwargs
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def group_key(self):
+        return self.image_tensor.shape[1:], self.image_tensor.dtype, tuple(sorted(self.kwargs.items()))
+
+
+class BatchServer:
+    """
+    Merge forward calls from concurrent callers of one ONNXModel into a single batched run.
+    Requests are collected until max_batch_size samples or max_wait_ms, and dispatched at once when
+    no other caller is waiting; they are concatenated on axis 0,
+    optionally zero padded to max_batch_size, and the outputs are split back per caller.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=5, pad_batch=False, rank=None):
+        self.model = model
+        self.rank = rank
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pad_batch = pad_batch
+        self.requests = queue.Queue()
+        # callers inside forward, queued or being served
+        self.callers = 0
+        self.callers_lock = threading.Lock()
+        self.batch_count = 0
+        self.sample_count = 0
+        self.thread = threading.Thread(target=self._loop, name='onnx-batch-server', daemon=True)
+        self.thread.start()
+
+    def forward(self, image_tensor, **kwargs):
+        request = _Request(np.asarray(image_tensor), kwargs)
+        with self.callers_lock:
+            self.callers += 1
+        try:
+            self.requests.put(request)
+            request.event.wait()
+        finally:
+            with self.callers_lock:
+                self.callers -= 1
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stop(self):
+        self.requests.put(None)
+
+    def _collect(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first.image_tensor)
+        deadline = time.time() + self.max_wait
+        while size < self.max_batch_size:
+            # every caller is already in this batch, waiting would only add latency
+            if self.callers <= len(batch):
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # stop after this batch
+                self.requests.put(None)
+                break
+            batch.append(request)
+            size += len(request.image_tensor)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                groups = {}
+                for request in batch:
+                    groups.setdefault(request.group_key(), []).append(request)
+                for requests in groups.values():
+                    self._run(requests)
+            except Exception as e:
+                # a bad batch must not kill the server thread and leave its callers waiting
+                for request in batch:
+                    if not request.event.is_set():
+                        request.error = e
+                        request.event.set()
+
+    def _run(self, requests):
+        sizes = [len(request.image_tensor) for request in requests]
+        batch = np.concatenate([request.image_tensor for request in requests], axis=0)
+        if self.pad_batch and len(batch) < self.max_batch_size:
+            pad = np.zeros((self.max_batch_size - len(batch),) + batch.shape[1:], dtype=batch.dtype)
+            batch = np.concatenate([batch, pad], axis=0)
+        try:
+            outputs = self.model.forward(batch, **requests[0].kwargs)
+            self.batch_count += 1
+            self.sample_count += sum(sizes)
+            offset = 0
+            for request, size in zip(requests, sizes):
+                if isinstance(outputs, (list, tuple)):
+                    request.result = [output[offset:offset + size] for output in outputs]
+                else:
+                    request.result = outputs[offset:offset + size]
+                offset += size
+        except Exception as e:
+            for request in requests:
+                request.error = e
+        finally:
+            for request in requests:
+                request.event.set()
+
+    def mean_batch_size(self):
+        return self.sample_count / self.batch_count if self.batch_count else 0
+
+
+def batch_input_rank(model):
+    """only single input models with a symbolic batch axis can be merged, returns the input rank or None"""
+    inputs = model.onnx_session.get_inputs()
+    if len(inputs) != 1 or isinstance(inputs[0].shape[0], int):
+        return None
+    return len(inputs[0].shape)
+
+
+# keyed by the model instance itself, entries go away with the model
+_servers = weakref.WeakKeyDictionary()
+# models created after batching was enabled
+_models = weakref.WeakSet()
+_servers_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # batch threads do not survive fork, a forked child builds its own servers on first use
+    global _servers_lock
+    _servers.clear()
+    _models.clear()
+    _servers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def enable_cross_job_batching(max_batch_size=8, max_wait_ms=5):
+    """
+    Route ONNXModel.forward of dynamic batch models through one BatchServer per model instance,
+    so concurrent jobs sharing a process share inference calls.
+    """
+    if getattr(ONNXModel.forward, '_batch_server', False):
+        return
+    origin_forward = ONNXModel.forward
+    origin_init = ONNXModel.__init__
+
+    def __init__(self, *args, **kwargs):
+        origin_init(self, *args, **kwargs)
+        _models.add(self)
+        try:
+            if batch_input_rank(self) is None:
+                shapes = [tuple(i.shape) for i in self.onnx_session.get_inputs()]
+                logger.warning(f"ONNX模型输入没有动态batch维，跨任务批处理对其不生效: {shapes}")
+        except Exception:
+            pass
+
+    class _Direct:
+        # weak reference, the server must not keep its model alive
+        def __init__(self, model):
+            self.model = weakref.ref(model)
+
+        def forward(self, image_tensor, **kwargs):
+            return origin_forward(self.model(), image_tensor, **kwargs)
+
+    def create_server(model):
+        rank = batch_input_rank(model)
+        if rank is None:
+            return False
+        server = BatchServer(_Direct(model), max_batch_size, max_wait_ms, rank=rank)
+        weakref.finalize(model, server.stop)
+        return server
+
+    def forward(self, image_tensor, **kwargs):
+        if not isinstance(image_tensor, np.ndarray) or image_tensor.ndim == 0:
+            return origin_forward(self, image_tensor, **kwargs)
+        with _servers_lock:
+            server = _servers.get(self)
+            if server is None:
+                server = _servers[self] = create_server(self)
+        # unbatched single samples and other ranks cannot be concatenated on axis 0
+        if server is False or image_tensor.ndim != server.rank:
+            return origin_forward(self, image_tensor, **kwargs)
+        return server.forward(image_tensor, **kwargs)
+
+    forward._batch_server = True
+    ONNXModel.__init__ = __init__
+    ONNXModel.forward = forward
+
+
+def batchable_models():
+    """(models with a symbolic batch axis, models created) since batching was enabled"""
+    models = list(_models)
+    batchable = 0
+    for model in models:
+        try:
+            batchable += batch_input_rank(model) is not None
+        except Exception:
+            pass
+    return batchable, len(models)
@@ -2,16 +2,13 @@ import argparse
 import gc
 import json
 import os
-import subprocess
 import sys
 import threading
-import time
 import traceback
 import uuid
 from enum import Enum
 
 import queue
-import cv2
 from flask import Flask, request
 
 if sys.version_info.major != 3 or sys.version_info.minor != 8:
@@ -21,6 +18,11 @@ if sys.version_info.major != 3 or sys.version_info.minor != 8:
 import service.trans_dh_service
 
 from h_utils.custom import CustomError
+from service.video_writer import FFmpegPipeWriter
+from service.avatar_cache import install_avatar_cache, load_avatar_cache, template_key, video_key
+from service.feature_cache import install_feature_cache, load_feature_cache
+from service.streaming_bnf import load_streaming_bnf_config
+from service.model_readiness import ModelReadiness, load_ready_timeout
 from y_utils.config import GlobalConfig
 from y_utils.logger import logger
 
@@ -59,24 +61,33 @@ def write_video(
     watermark_switch=0,
     digital_auth=0,
 ):
-    output_mp4 = os.path.join(temp_dir, "{}-t.mp4".format(work_id))
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
     result_path = os.path.join(result_dir, "{}-r.mp4".format(work_id))
-    video_write = cv2.VideoWriter(output_mp4, fourcc, fps, (width, height))
-    print("Custom VideoWriter init done")
+    watermark_path = None
+    digital_auth_path = None
+    if watermark_switch == 1:
+        logger.info("Custom VideoWriter [{}]任务需要水印".format(work_id))
+        watermark_path = GlobalConfig.instance().watermark_path
+    if digital_auth == 1:
+        logger.info("Custom VideoWriter [{}]任务需要数字人标识".format(work_id))
+        digital_auth_path = GlobalConfig.instance().digital_auth_path
+    video_write = None
     try:
+        video_write = FFmpegPipeWriter(
+            result_path,
+            audio_path,
+            width,
+            height,
+            fps,
+            watermark_path=watermark_path,
+            digital_auth_path=digital_auth_path,
+        )
+        print("Custom VideoWriter init done")
         while True:
             state, reason, value_ = output_imgs_queue.get()
             if type(state) == bool and state == True:
                 logger.info(
                     "Custom VideoWriter [{}]视频帧队列处理已结束".format(work_id)
                 )
-                logger.info(
-                    "Custom VideoWriter Silence Video saved in {}".format(
-                        os.path.realpath(output_mp4)
-                    )
-                )
-                video_write.release()
                 break
             else:
                 if type(state) == bool and state == False:
@@ -88,68 +99,15 @@ def write_video(
                     raise CustomError(reason)
                 for result_img in value_:
                     video_write.write(result_img)
-        if video_write is not None:
-            video_write.release()
-        if watermark_switch == 1 and digital_auth == 1:
-            logger.info(
-                "Custom VideoWriter [{}]任务需要水印和数字人标识".format(work_id)
-            )
-            if width > height:
-                command = 'ffmpeg -y -i {} -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:(main_h-overlay_h)-10,overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().watermark_path,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-            else:
-                command = 'ffmpeg -y -i {} -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:(main_h-overlay_h)-10,overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().watermark_path,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-        elif watermark_switch == 1 and digital_auth == 0:
-            logger.info("Custom VideoWriter [{}]任务需要水印".format(work_id))
-            command = 'ffmpeg -y -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:(main_h-overlay_h)-10" -c:a aac -crf 15 -strict -2 {}'.format(
-                audio_path,
-                output_mp4,
-                GlobalConfig.instance().watermark_path,
-                result_path,
-            )
-            logger.info("command:{}".format(command))
-        elif watermark_switch == 0 and digital_auth == 1:
-            logger.info("Custom VideoWriter [{}]任务需要数字人标识".format(work_id))
-            if width > height:
-                command = 'ffmpeg -loglevel warning -y -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-            else:
-                command = 'ffmpeg -loglevel warning -y -i {} -i {} -i {} -filter_complex "overlay=(main_w-overlay_w)-10:10" -c:a aac -crf 15 -strict -2 {}'.format(
-                    audio_path,
-                    output_mp4,
-                    GlobalConfig.instance().digital_auth_path,
-                    result_path,
-                )
-                logger.info("command:{}".format(command))
-        else:
-            command = "ffmpeg -loglevel warning -y -i {} -i {} -c:a aac -c:v libx264 -crf 15 -strict -2 {}".format(
-                audio_path, output_mp4, result_path
-            )
-            logger.info("Custom command:{}".format(command))
-        subprocess.call(command, shell=True)
+        video_write.close()
         print("###### Custom Video Writer write over")
         print(f"###### Video result saved in {os.path.realpath(result_path)}")
         exit(0)
         result_queue.put([True, result_path])
     except Exception as e:
+        # ffmpeg启动失败时也要回写结果，否则任务一直等待
+        if video_write is not None:
+            video_write.abort()
         logger.error(
             "Custom VideoWriter [{}]视频帧队列处理异常结束，异常原因:[{}]".format(
                 work_id, e.__str__()
@@ -181,11 +139,23 @@ def main():
     else:
         video_url = opt.video_path
     sys.argv = [sys.argv[0]]
-    task = service.trans_dh_service.TransDhTask()
-    time.sleep(10) # somehow, this works...
+    avatar_cache = load_avatar_cache()
+    if avatar_cache is not None:
+        install_avatar_cache(avatar_cache)
+    load_streaming_bnf_config()
+    feature_cache = load_feature_cache()
+    if feature_cache is not None:
+        install_feature_cache(feature_cache)
+    # 等模型子进程加载完成并开始等待任务
+    with ModelReadiness("TransDhTask", load_ready_timeout()) as readiness:
+        task = service.trans_dh_service.TransDhTask()
+    if not readiness.wait():
+        logger.error(f"模型进程未就绪，退出: {readiness.to_dict()}")
+        sys.exit(1)
 
     code = "1004"
-    task.work(audio_url, video_url, code, 0, 0, 0, 0)
+    with template_key(video_key(video_url)):
+        task.work(audio_url, video_url, code, 0, 0, 0, 0)
 
 
 if __name__ == "__main__":
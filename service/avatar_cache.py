@@ -0,0 +1,359 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : avatar_cache.py
+@ide    : PyCharm
+@time   : 2026-10-17 11:03:52
+"""
+import configparser
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from service.fork_server import reinit_after_fork
+from service.single_flight import file_lock
+from y_utils.logger import logger
+from y_utils.md5 import md5sum
+
+ARTIFACTS_FILE = 'artifacts.pkl'
+META_FILE = 'meta.json'
+# 命中时只在内存里更新访问时间，距上次落盘超过此间隔才重写meta.json
+ACCESS_FLUSH_SECONDS = 600
+# 随音频时长变化的op构造参数，不计入key，同一模板配不同音频共用一份预处理结果
+AUDIO_PARAMS = ('max_len',)
+
+_local = threading.local()
+
+
+@contextmanager
+def template_key(key):
+    """在当前线程内声明模板视频的md5，预处理结果按此key读写缓存"""
+    previous = getattr(_local, 'key', None)
+    _local.key = key
+    try:
+        yield key
+    finally:
+        _local.key = previous
+
+
+def current_template_key():
+    return getattr(_local, 'key', None)
+
+
+class AvatarCache:
+    """模板视频预处理结果磁盘缓存，key为视频md5，超出磁盘预算时按LRU淘汰"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+        self.entries = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+        logger.info(f"模板预处理缓存初始化完成: {cache_dir}, 条目数: {len(self.entries)}, "
+                    f"占用: {self.total_bytes() / 1024 ** 2:.1f}MB, 上限: {max_bytes / 1024 ** 2:.1f}MB")
+
+    def _load_index(self):
+        for key in os.listdir(self.cache_dir):
+            if key.startswith('.'):
+                continue
+            meta_path = os.path.join(self.cache_dir, key, META_FILE)
+            if not os.path.exists(meta_path):
+                # 写入未完成的残留目录
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+                continue
+            try:
+                with open(meta_path, 'r') as f:
+                    self.entries[key] = json.load(f)
+            except Exception as e:
+                logger.warning(f"模板缓存元数据损坏，删除条目 {key}: {e}")
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self._entry_dir(key), META_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        meta_path = os.path.join(self._entry_dir(key), META_FILE)
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def total_bytes(self):
+        return sum(meta['size'] for meta in self.entries.values())
+
+    def key_lock(self, key):
+        """同一模板同一时刻只允许一个任务（跨进程）计算预处理结果"""
+        return file_lock(os.path.join(self.cache_dir, '.locks', key))
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        """读取缓存，未命中返回None"""
+        with self.lock:
+            meta = self.entries.get(key)
+            if meta is None:
+                # 可能由其他进程（如zygote任务子进程）写入
+                meta = self._read_meta(key)
+                if meta is None:
+                    return None
+                self.entries[key] = meta
+            now = time.time()
+            meta['last_access'] = now
+            meta['hits'] = meta.get('hits', 0) + 1
+            if now - meta.get('flushed_access', meta.get('created', 0)) > ACCESS_FLUSH_SECONDS:
+                meta['flushed_access'] = now
+                self._write_meta(key, meta)
+        try:
+            with open(os.path.join(self._entry_dir(key), ARTIFACTS_FILE), 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.warning(f"模板缓存读取失败，删除条目 {key}: {e}")
+            self.remove(key)
+            return None
+
+    def put(self, key, artifacts, template=None):
+        """写入缓存，先写临时目录再原子重命名，避免并发读到半成品；template记录条目所属模板，供预热查找"""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            artifacts_path = os.path.join(tmp_dir, ARTIFACTS_FILE)
+            with open(artifacts_path, 'wb') as f:
+                pickle.dump(artifacts, f, protocol=4)
+            now = time.time()
+            meta = {'key': key, 'template': template, 'size': os.path.getsize(artifacts_path),
+                    'created': now, 'last_access': now, 'hits': 0}
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            with self.lock:
+                if key in self.entries:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return
+                os.replace(tmp_dir, entry_dir)
+                self.entries[key] = meta
+                self._evict(keep=key)
+            logger.info(f"模板预处理结果已缓存: {key}, 大小: {meta['size'] / 1024 ** 2:.1f}MB")
+        except Exception as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.warning(f"模板预处理结果缓存失败 {key}: {e}")
+
+    def prewarm(self, template, chunk_size=16 * 1024 * 1024):
+        """把模板已缓存的预处理结果读入页缓存并刷新访问时间，任务随后的预处理命中时不再等磁盘，返回读取字节数"""
+        with self.lock:
+            keys = [key for key, meta in self.entries.items() if meta.get('template') == template]
+            now = time.time()
+            for key in keys:
+                self.entries[key]['last_access'] = now
+        size = 0
+        for key in keys:
+            try:
+                with open(os.path.join(self._entry_dir(key), ARTIFACTS_FILE), 'rb') as f:
+                    while True:
+                        chunk = f.read(chunk_size)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+            except OSError:
+                # 预热期间可能被淘汰
+                continue
+        return size
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self, keep=None):
+        """按最近访问时间淘汰，直到总大小不超过预算，调用方需持有锁"""
+        total = self.total_bytes()
+        for key, meta in sorted(self.entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= meta['size']
+            del self.entries[key]
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            logger.info(f"模板缓存淘汰: {key}, 释放: {meta['size'] / 1024 ** 2:.1f}MB")
+
+
+def _detach(value):
+    """multiprocessing.Manager代理对象无法跨进程复用，转成普通对象后再缓存"""
+    if type(value).__name__.endswith('Proxy') and hasattr(value, '_getvalue'):
+        return value._getvalue()
+    return value
+
+
+class _Fingerprint:
+    """
+    op构造参数分两类：标量参数(帧数上限、模式、驱动标记等)进params，帧数据和模板文件内容进digest，
+    已知模板md5时不计算内容摘要；检测器等模型对象不参与key
+    """
+
+    def __init__(self, hash_content):
+        self.params = []
+        self.digest = hashlib.md5() if hash_content else None
+        self.content = False
+
+    def add(self, value, params=None):
+        params = self.params if params is None else params
+        value = _detach(value)
+        if isinstance(value, str) and os.path.isfile(value):
+            self.content = True
+            if self.digest is not None:
+                self.digest.update(md5sum(value).encode('utf-8'))
+            return True
+        if value is None or isinstance(value, (bool, int, float, str)):
+            params.append(value)
+            return True
+        if hasattr(value, 'shape') and hasattr(value, 'tobytes'):
+            self.content = True
+            if self.digest is not None:
+                self.digest.update(f"{value.shape}{value.dtype}".encode('utf-8'))
+                try:
+                    self.digest.update(memoryview(value))
+                except (TypeError, BufferError):
+                    self.digest.update(value.tobytes())
+            return True
+        if isinstance(value, (list, tuple)):
+            nested = []
+            if all(self.add(item, nested) for item in value):
+                params.append(nested)
+                return True
+        return False
+
+
+def _cache_key(template, params):
+    payload = json.dumps({'template': template, 'params': params}, sort_keys=True, default=repr)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def install_avatar_cache(cache, single_flight=True):
+    """
+    替换preprocess_audio_and_3dmm.op的__init__/flow，命中缓存时跳过人脸检测、关键点、头部姿态和平滑；
+    single_flight为True时同一模板的并发任务只有一个计算，其余等待后读缓存
+    """
+    from preprocess_audio_and_3dmm import op
+
+    if getattr(op.flow, '_avatar_cache', None) is not None:
+        op.flow._avatar_cache = cache
+        op.flow._single_flight = single_flight
+        return
+    origin_init = op.__init__
+    origin_flow = op.flow
+    try:
+        arg_names = list(inspect.signature(origin_init).parameters)[1:]
+    except (TypeError, ValueError):
+        arg_names = []
+    if not set(AUDIO_PARAMS) <= set(arg_names):
+        logger.warning(f"无法取得op构造参数名，{AUDIO_PARAMS}按位置传入时仍会计入缓存key")
+
+    def __init__(self, *args, **kwargs):
+        origin_init(self, *args, **kwargs)
+        # 构造参数（原始帧、检测器等）不进缓存，计算key时使用
+        self._avatar_cache_inputs = {id(v) for v in args} | {id(v) for v in kwargs.values()}
+        self._avatar_cache_args = (args, kwargs)
+
+    def resolve_key(self):
+        """
+        key由模板和op构造参数共同决定；模板优先取调用线程声明的md5，
+        op在模型子进程等其他线程中执行时拿不到，改为对构造参数中的帧数据/模板文件计算摘要
+        """
+        args, kwargs = self.__dict__.get('_avatar_cache_args', ((), {}))
+        template = current_template_key()
+        fingerprint = _Fingerprint(hash_content=template is None)
+        for index, value in enumerate(args):
+            if index < len(arg_names) and arg_names[index] in AUDIO_PARAMS:
+                continue
+            fingerprint.add(value)
+        for name, value in sorted(kwargs.items()):
+            if name not in AUDIO_PARAMS and fingerprint.add(value):
+                fingerprint.params.append(name)
+        if template is None:
+            if not fingerprint.content:
+                return None, None
+            template = fingerprint.digest.hexdigest()
+        return _cache_key(template, fingerprint.params), template
+
+    def flow(self, *args, **kwargs):
+        cache = flow._avatar_cache
+        key, template = resolve_key(self) if cache is not None else (None, None)
+        if key is None:
+            return origin_flow(self, *args, **kwargs)
+        entry = cache.get(key)
+        if entry is None and flow._single_flight:
+            with cache.key_lock(key):
+                # 等锁期间其他任务可能已算完
+                entry = cache.get(key)
+                if entry is None:
+                    return compute(self, key, template, cache, args, kwargs)
+        if entry is not None:
+            logger.info(f"模板预处理命中缓存: {key}")
+            self.__dict__.update(entry['state'])
+            return entry['result']
+        return compute(self, key, template, cache, args, kwargs)
+
+    def compute(self, key, template, cache, args, kwargs):
+        start = time.time()
+        result = origin_flow(self, *args, **kwargs)
+        cost = time.time() - start
+        inputs = self.__dict__.get('_avatar_cache_inputs', set())
+        state = {}
+        for name, value in self.__dict__.items():
+            if name in ('_avatar_cache_inputs', '_avatar_cache_args') or id(value) in inputs:
+                continue
+            value = _detach(value)
+            try:
+                pickle.dumps(value, protocol=4)
+            except Exception:
+                continue
+            state[name] = value
+        cache.put(key, {'state': state, 'result': _detach(result), 'cost': cost}, template)
+        return result
+
+    flow._avatar_cache = cache
+    flow._single_flight = single_flight
+    op.__init__ = __init__
+    op.flow = flow
+    logger.info("模板预处理缓存已启用")
+
+
+def load_avatar_cache():
+    """从配置文件加载模板缓存配置，未启用时返回None"""
+    try:
+        config = configparser.ConfigParser()
+        config.read('config/config.ini')
+        if not config.getint('avatar_cache', 'enable', fallback=0):
+            return None
+        cache_dir = config.get('avatar_cache', 'cache_dir', fallback='./avatar_cache')
+        max_size_gb = config.getfloat('avatar_cache', 'max_size_gb', fallback=20)
+        return AvatarCache(cache_dir, int(max_size_gb * 1024 ** 3))
+    except Exception as e:
+        logger.warning(f"模板缓存初始化失败，不启用缓存: {e}")
+        return None
+
+
+def video_key(video_path):
+    """本地模板视频返回md5，远程地址返回None"""
+    if video_path and os.path.isfile(video_path):
+        return md5sum(video_path)
+    return None
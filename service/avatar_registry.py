@@ -0,0 +1,160 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : avatar_registry.py
+@ide    : PyCharm
+@time   : 2026-10-17 11:52:20
+"""
+import configparser
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+import wave
+from enum import Enum
+
+from h_utils.custom import CustomError
+from service.file_fetcher import fetch, is_remote, local_allowed
+from y_utils.logger import logger
+from y_utils.md5 import md5sum
+
+REGISTRY_FILE = 'avatars.json'
+
+
+def normalize_avatar_id(avatar_id):
+    """avatar_id会拼进文件路径，只接受uuid(带或不带短横线)，统一为32位小写hex；不合法返回None"""
+    try:
+        return uuid.UUID(hex=avatar_id).hex
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class AvatarStatus(Enum):
+    pending = 'pending'
+    preprocessing = 'preprocessing'
+    ready = 'ready'
+    error = 'error'
+
+
+class AvatarRegistry:
+    """数字人形象注册表：模板视频只下载一次，后台完成预处理后按avatar_id复用"""
+
+    def __init__(self, avatar_dir, local_dirs=None):
+        self.avatar_dir = avatar_dir
+        self.local_dirs = local_dirs or []
+        self.lock = threading.Lock()
+        self.avatars = {}
+        os.makedirs(avatar_dir, exist_ok=True)
+        self._load()
+
+    def _registry_path(self):
+        return os.path.join(self.avatar_dir, REGISTRY_FILE)
+
+    def _load(self):
+        if not os.path.exists(self._registry_path()):
+            return
+        try:
+            with open(self._registry_path(), 'r', encoding='utf-8') as f:
+                self.avatars = json.load(f)
+            # 重启前未完成的预处理需要重新注册
+            for record in self.avatars.values():
+                if record['status'] in (AvatarStatus.pending.value, AvatarStatus.preprocessing.value):
+                    record['status'] = AvatarStatus.error.value
+                    record['msg'] = '服务重启，预处理中断'
+            logger.info(f"数字人形象注册表加载完成，共{len(self.avatars)}个")
+        except Exception as e:
+            logger.warning(f"数字人形象注册表加载失败: {e}")
+            self.avatars = {}
+
+    def _save(self):
+        """调用方需持有锁"""
+        tmp_path = self._registry_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.avatars, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._registry_path())
+
+    def _update(self, avatar_id, **fields):
+        with self.lock:
+            record = self.avatars[avatar_id]
+            record.update(fields)
+            record['update_time'] = time.time()
+            self._save()
+
+    def register(self, video_url, avatar_id=None):
+        """
+        登记新形象，返回(avatar_id, 是否新登记)，实际处理由process完成；
+        检查和登记在同一把锁内，同一avatar_id并发注册时只有一个会登记并触发预处理
+        """
+        if avatar_id is None:
+            avatar_id = uuid.uuid4().hex
+        else:
+            avatar_id = normalize_avatar_id(avatar_id)
+            if avatar_id is None:
+                raise CustomError('avatar_id必须为uuid')
+        if not is_remote(video_url) and not local_allowed(video_url, self.local_dirs):
+            raise CustomError('video_url只支持http(s)地址或允许目录下的本地文件')
+        with self.lock:
+            existing = self.avatars.get(avatar_id)
+            if existing is not None and existing['status'] != AvatarStatus.error.value:
+                return avatar_id, False
+            self.avatars[avatar_id] = {
+                'avatar_id': avatar_id,
+                'video_url': video_url,
+                'status': AvatarStatus.pending.value,
+                'video_path': None,
+                'md5': None,
+                'msg': '',
+                'create_time': time.time(),
+                'update_time': time.time()
+            }
+            self._save()
+        return avatar_id, True
+
+    def get(self, avatar_id):
+        avatar_id = normalize_avatar_id(avatar_id)
+        if avatar_id is None:
+            return None
+        with self.lock:
+            record = self.avatars.get(avatar_id)
+            return dict(record) if record is not None else None
+
+    def process(self, avatar_id, preprocess_fn):
+        """下载模板视频、计算md5并调用preprocess_fn(avatar_id, video_path, md5)完成预处理"""
+        record = self.get(avatar_id)
+        try:
+            video_path = os.path.join(self.avatar_dir, f"{avatar_id}.mp4")
+            fetch(record['video_url'], video_path, local_dirs=self.local_dirs)
+            key = md5sum(video_path)
+            self._update(avatar_id, status=AvatarStatus.preprocessing.value, video_path=video_path, md5=key)
+            start = time.time()
+            preprocess_fn(avatar_id, video_path, key)
+            self._update(avatar_id, status=AvatarStatus.ready.value, cost=round(time.time() - start, 2))
+            logger.info(f"数字人形象[{avatar_id}]预处理完成，md5: {key}")
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"数字人形象[{avatar_id}]预处理失败: {e}")
+            self._update(avatar_id, status=AvatarStatus.error.value, msg=str(e))
+
+
+def silence_wav(path, seconds=1, sample_rate=16000):
+    """生成静音音频，用于驱动一次只为预处理模板的任务"""
+    if not os.path.exists(path):
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(b'\x00\x00' * int(seconds * sample_rate))
+    return path
+
+
+def load_avatar_registry():
+    """从配置文件加载形象注册表目录和允许注册的本地目录"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    avatar_dir = config.get('avatar', 'avatar_dir', fallback='./avatar')
+    local_dirs = [d.strip() for d in config.get('avatar', 'local_dirs', fallback='').split(',') if d.strip()]
+    return AvatarRegistry(avatar_dir, local_dirs)
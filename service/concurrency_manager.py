@@ -0,0 +1,213 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : concurrency_manager.py
+@ide    : PyCharm
+@time   : 2026-10-17 10:12:36
+"""
+import configparser
+import itertools
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from threading import Lock
+
+from service.metrics import QUEUE_WAIT, TASKS
+from y_utils.logger import logger
+
+
+class TaskSlot:
+    """并发槽位，记录每个工作线程当前执行的任务"""
+
+    def __init__(self, index):
+        self.index = index
+        self.task_id = None
+        self.started_at = None
+        self.finished_count = 0
+        self.failed_count = 0
+
+    @property
+    def busy(self):
+        return self.task_id is not None
+
+    def to_dict(self):
+        running_seconds = None
+        if self.started_at is not None:
+            running_seconds = round(time.time() - self.started_at, 1)
+        return {
+            'slot': self.index,
+            'state': 'running' if self.busy else 'idle',
+            'task_id': self.task_id,
+            'running_seconds': running_seconds,
+            'finished_count': self.finished_count,
+            'failed_count': self.failed_count
+        }
+
+
+# 优先级数值小的先出队；预留槽位(实时会话)排在普通任务之前，停止信号排在最后
+PRIORITY_RESERVED = 0
+PRIORITY_NORMAL = 1
+PRIORITY_STOP = 2
+
+
+class SlotReservation:
+    """预留的并发槽位：持有一个工作线程，run提交的函数依次在该线程内执行，release后槽位归还"""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.calls = queue.Queue()
+        self.released = False
+
+    def hold(self):
+        """在工作线程内执行，直到release"""
+        while True:
+            call = self.calls.get()
+            if call is None:
+                break
+            future, fn, args = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def run(self, fn, *args):
+        """在预留槽位内执行fn并返回结果；槽位被占满时等到有工作线程空出"""
+        if self.released:
+            raise RuntimeError(f"槽位预留已释放: {self.task_id}")
+        future = Future()
+        self.calls.put((future, fn, args))
+        return future.result()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.calls.put(None)
+
+
+class ConcurrencyManager:
+    """
+    并发管理器，max_concurrent_tasks个工作线程并行执行任务，空闲线程阻塞在队列上等待新任务；
+    指定runner时隔离任务交给runner执行（如fork子进程）
+    """
+
+    def __init__(self, max_concurrent_tasks=4, runner=None):
+        self.max_concurrent_tasks = max(1, int(max_concurrent_tasks))
+        self.runner = runner
+        self.task_queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.lock = Lock()
+        self.slots = [TaskSlot(i) for i in range(self.max_concurrent_tasks)]
+        self.workers = []
+        self._start_workers()
+        logger.info(f"并发管理器初始化完成，最大并发数: {self.max_concurrent_tasks}")
+
+    def _start_workers(self):
+        """每个槽位启动一个工作线程"""
+        for slot in self.slots:
+            worker = threading.Thread(target=self._worker, args=(slot,),
+                                      name=f"task-slot-{slot.index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _worker(self, slot):
+        """工作线程：阻塞获取任务并执行，一个线程同一时刻只占用一个槽位"""
+        while True:
+            _, _, task_info = self.task_queue.get()
+            try:
+                if task_info is None:  # 停止信号
+                    break
+
+                # 检查任务信息格式
+                if len(task_info) != 5:
+                    logger.error(f"任务信息格式错误: {task_info}")
+                    continue
+
+                task, args, task_id, submit_time, isolated = task_info
+                with self.lock:
+                    slot.task_id = task_id
+                    slot.started_at = time.time()
+                QUEUE_WAIT.observe(slot.started_at - submit_time)
+                logger.info(f"槽位[{slot.index}]开始执行任务: {task_id}, 排队耗时: "
+                            f"{slot.started_at - submit_time:.2f}s, 当前并发数: {self.get_current_tasks()}")
+                try:
+                    if isolated and self.runner is not None:
+                        self.runner.run(task, args, task_id)
+                    else:
+                        task(*args)
+                    with self.lock:
+                        slot.finished_count += 1
+                    TASKS.inc(result='finished')
+                except Exception as e:
+                    with self.lock:
+                        slot.failed_count += 1
+                    TASKS.inc(result='failed')
+                    logger.error(f"任务执行异常 {task_id}: {e}")
+                    traceback.print_exc()
+                finally:
+                    # 释放并发槽位
+                    with self.lock:
+                        slot.task_id = None
+                        slot.started_at = None
+                    logger.info(f"槽位[{slot.index}]任务完成: {task_id}, 当前并发数: {self.get_current_tasks()}")
+            except Exception as e:
+                logger.error(f"工作线程异常: {e}")
+                traceback.print_exc()
+            finally:
+                self.task_queue.task_done()
+
+    def submit_task(self, task, task_id, *args, isolated=True, priority=PRIORITY_NORMAL):
+        """提交任务到队列，isolated为False的任务始终在工作线程内执行；同优先级按提交顺序执行"""
+        self.task_queue.put((priority, next(self.sequence), (task, args, task_id, time.time(), isolated)))
+        queue_size = self.task_queue.qsize()
+        logger.info(f"任务已提交到队列: {task_id}, 队列长度: {queue_size}")
+        return True
+
+    def reserve(self, task_id):
+        """
+        预留一个槽位给长时间持续提交小任务的调用方(如实时会话)：优先于排队的普通任务拿到下一个空闲工作线程，
+        之后一直占用到release，期间计入并发数
+        """
+        reservation = SlotReservation(task_id)
+        self.submit_task(reservation.hold, task_id, isolated=False, priority=PRIORITY_RESERVED)
+        return reservation
+
+    def shutdown(self, wait=True):
+        """向每个工作线程发送停止信号"""
+        for _ in self.workers:
+            self.task_queue.put((PRIORITY_STOP, next(self.sequence), None))
+        if wait:
+            for worker in self.workers:
+                worker.join()
+
+    def get_queue_size(self):
+        """获取队列长度"""
+        return self.task_queue.qsize()
+
+    def get_current_tasks(self):
+        """获取当前运行的任务数"""
+        with self.lock:
+            return sum(1 for slot in self.slots if slot.busy)
+
+    def get_slots(self):
+        """获取各槽位状态"""
+        with self.lock:
+            return [slot.to_dict() for slot in self.slots]
+
+
+def load_concurrent_config():
+    """从配置文件加载并发配置"""
+    try:
+        config = configparser.ConfigParser()
+        config.read('config/config.ini')
+        batch_size = config.getint('digital', 'batch_size', fallback=4)
+        logger.info(f"从配置文件读取并发数: {batch_size}")
+        return batch_size
+    except Exception as e:
+        logger.warning(f"读取配置失败，使用默认并发数4: {e}")
+        return 4
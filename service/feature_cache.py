@@ -0,0 +1,316 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : feature_cache.py
+@ide    : PyCharm
+@time   : 2026-10-17 23:40:36
+"""
+import configparser
+import functools
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from service.fork_server import reinit_after_fork
+from service.instrumentation import patch
+from y_utils.logger import logger
+from y_utils.md5 import md5sum
+
+META_FILE = 'meta.json'
+WENET_MODEL = './wenet/examples/aishell/aidata/exp/conformer/wenetmodel.pt'
+
+# 缓存的音频特征计算位置：(模块, 函数或类.方法, 特征类型, 决定特征的模型文件)
+FEATURE_HOOKS = (
+    ('wenet.compute_ctc_att_bnf', 'compute_bnf', 'bnf', WENET_MODEL),
+    ('wenet.compute_ctc_att_bnf', 'PPGModel.forward', 'ppg', WENET_MODEL),
+    ('landmark2face_wy.audio_handler', 'AudioHandler.convert_to_deepspeech', 'deepspeech', None),
+)
+
+_local = threading.local()
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _torch():
+    try:
+        import torch
+        return torch
+    except ImportError:
+        return None
+
+
+def _digest(value, h, sources=None):
+    """把参数内容写入摘要：数组按数据，文件路径按文件md5(同时记入sources)；无法确定内容的参数不缓存"""
+    torch = _torch()
+    if torch is not None and isinstance(value, torch.nn.Module):
+        # 模型由版本号区分
+        return
+    if torch is not None and isinstance(value, torch.Tensor):
+        value = value.detach().cpu().numpy()
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        h.update(f"{value.dtype.str}{value.shape}".encode())
+        h.update(memoryview(value).cast('B'))
+    elif isinstance(value, str) and os.path.isfile(value):
+        file_md5 = md5sum(value)
+        h.update(file_md5.encode())
+        if sources is not None:
+            sources.append(file_md5)
+    elif value is None or isinstance(value, (str, bytes, int, float, bool)):
+        h.update(repr(value).encode())
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _digest(item, h, sources)
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            h.update(repr(key).encode())
+            _digest(value[key], h, sources)
+    else:
+        raise _Uncacheable(type(value).__name__)
+
+
+def _model_version(base_version, model_file):
+    """配置的版本号加模型文件的大小和修改时间，替换权重后旧特征自动失效"""
+    version = str(base_version)
+    if model_file and os.path.exists(model_file):
+        stat = os.stat(model_file)
+        version += f":{stat.st_size}:{int(stat.st_mtime)}"
+    return version
+
+
+def _split(result):
+    """结果拆成数组列表，返回(容器类型, [(数组, 类型, dtype, device)])，不支持的结果返回None"""
+    torch = _torch()
+    container = type(result).__name__ if isinstance(result, (tuple, list)) else 'single'
+    parts = []
+    for value in (result if container != 'single' else [result]):
+        if torch is not None and isinstance(value, torch.Tensor):
+            parts.append((value.detach().cpu().numpy(), 'torch', str(value.dtype).replace('torch.', ''),
+                          str(value.device)))
+        elif isinstance(value, np.ndarray):
+            parts.append((value, 'numpy', value.dtype.str, None))
+        else:
+            return None
+    return container, parts
+
+
+class FeatureCache:
+    """
+    音频特征磁盘缓存，key为音频内容md5+特征类型+模型版本，每条为一个目录，
+    浮点特征按store_dtype(默认float16)存为.npy，读取时内存映射，超出磁盘预算时按LRU淘汰
+    """
+
+    def __init__(self, cache_dir, max_bytes, store_dtype='float16', version='1'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.store_dtype = np.dtype(store_dtype)
+        self.version = version
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+        self.entries = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+        logger.info(f"音频特征缓存初始化完成: {cache_dir}, 条目数: {len(self.entries)}, "
+                    f"占用: {self.total_bytes() / 1024 ** 2:.1f}MB, 上限: {max_bytes / 1024 ** 2:.1f}MB")
+
+    def _load_index(self):
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            meta = self._read_meta(key)
+            if meta is None or '.' in key:
+                # 写入未完成的残留目录
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            self.entries[key] = meta
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self._entry_dir(key), META_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def total_bytes(self):
+        return sum(meta['size'] for meta in self.entries.values())
+
+    def key(self, feature_type, model_file, args, kwargs, sources=None):
+        """按参数内容计算key，参数中有无法确定内容的对象时返回None；参数中音频文件的md5记入sources"""
+        h = hashlib.md5()
+        h.update(f"{feature_type}:{_model_version(self.version, model_file)}".encode())
+        try:
+            _digest(list(args), h, sources)
+            _digest(kwargs, h, sources)
+        except _Uncacheable as e:
+            logger.debug(f"音频特征{feature_type}参数类型{e}无法确定内容，不缓存")
+            return None
+        return h.hexdigest()
+
+    def get(self, key):
+        """命中时按原类型还原结果，数组为只读磁盘文件的写时复制映射；未命中返回None"""
+        with self.lock:
+            meta = self.entries.get(key)
+            if meta is None:
+                # 可能由其他进程（如模型子进程）写入
+                meta = self._read_meta(key)
+                if meta is None:
+                    return None
+                self.entries[key] = meta
+            meta['last_access'] = time.time()
+        try:
+            values = [self._load_part(key, i, part) for i, part in enumerate(meta['parts'])]
+        except Exception as e:
+            logger.warning(f"音频特征缓存读取失败，删除条目 {key}: {e}")
+            self.remove(key)
+            return None
+        if meta['container'] == 'single':
+            return values[0]
+        return tuple(values) if meta['container'] == 'tuple' else values
+
+    def _load_part(self, key, index, part):
+        array = np.load(os.path.join(self._entry_dir(key), f"{index}.npy"), mmap_mode='c')
+        if part['kind'] == 'torch':
+            torch = _torch()
+            tensor = torch.from_numpy(np.asarray(array)).to(getattr(torch, part['dtype']))
+            return tensor.to(part['device']) if part['device'] != 'cpu' else tensor
+        if array.dtype.str != part['dtype']:
+            return array.astype(part['dtype'])
+        return array
+
+    def put(self, key, result, cost, sources=()):
+        """写入缓存，先写临时目录再原子重命名，结果类型不支持时跳过；sources为参数中音频文件的md5，供预热查找"""
+        split = _split(result)
+        if split is None:
+            return
+        container, parts = split
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            size = 0
+            for i, (array, _, _, _) in enumerate(parts):
+                if array.dtype.kind == 'f' and array.dtype.itemsize > self.store_dtype.itemsize:
+                    array = array.astype(self.store_dtype)
+                path = os.path.join(tmp_dir, f"{i}.npy")
+                np.save(path, array)
+                size += os.path.getsize(path)
+            now = time.time()
+            meta = {'key': key, 'container': container, 'size': size, 'cost': cost, 'sources': list(sources),
+                    'created': now, 'last_access': now,
+                    'parts': [{'kind': kind, 'dtype': dtype, 'device': device} for _, kind, dtype, device in parts]}
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            with self.lock:
+                if key in self.entries or os.path.exists(entry_dir):
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return
+                os.replace(tmp_dir, entry_dir)
+                self.entries[key] = meta
+                self._evict(keep=key)
+            logger.info(f"音频特征已缓存: {key}, 大小: {size / 1024 ** 2:.1f}MB")
+        except Exception as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.warning(f"音频特征缓存失败 {key}: {e}")
+
+    def prewarm(self, audio_md5):
+        """
+        把由该音频文件计算出的特征读入页缓存并刷新访问时间，返回读取字节数；
+        只能找到计算时以文件路径为参数的条目，以数组为参数的条目无法与音频文件对应
+        """
+        with self.lock:
+            keys = [key for key, meta in self.entries.items() if audio_md5 in meta.get('sources', ())]
+            now = time.time()
+            for key in keys:
+                self.entries[key]['last_access'] = now
+        size = 0
+        for key in keys:
+            entry_dir = self._entry_dir(key)
+            try:
+                for name in os.listdir(entry_dir):
+                    with open(os.path.join(entry_dir, name), 'rb') as f:
+                        size += len(f.read())
+            except OSError:
+                continue
+        return size
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self, keep=None):
+        """按最近访问时间淘汰，直到总大小不超过预算，调用方需持有锁"""
+        total = self.total_bytes()
+        for key, meta in sorted(self.entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= meta['size']
+            del self.entries[key]
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            logger.info(f"音频特征缓存淘汰: {key}, 释放: {meta['size'] / 1024 ** 2:.1f}MB")
+
+
+def _cached(cache, feature_type, model_file, is_method):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # 外层特征已在缓存中处理时，内部调用（compute_bnf内的PPGModel.forward）不再重复缓存
+            if getattr(_local, 'active', False):
+                return fn(*args, **kwargs)
+            sources = []
+            key = cache.key(feature_type, model_file, args[1:] if is_method else args, kwargs, sources)
+            if key is None:
+                return fn(*args, **kwargs)
+            result = cache.get(key)
+            if result is not None:
+                logger.info(f"音频特征{feature_type}命中缓存: {key}")
+                return result
+            _local.active = True
+            start = time.time()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                _local.active = False
+            cache.put(key, result, time.time() - start, sources)
+            return result
+        return wrapper
+    return wrap
+
+
+def install_feature_cache(cache):
+    """替换音频特征计算函数，需在模型子进程启动前调用"""
+    for module_name, qualname, feature_type, model_file in FEATURE_HOOKS:
+        patch(module_name, qualname, _cached(cache, feature_type, model_file, '.' in qualname),
+              '_feature_cached')
+    logger.info("音频特征缓存已启用")
+
+
+def load_feature_cache():
+    """从配置文件加载音频特征缓存配置，未启用时返回None"""
+    try:
+        config = configparser.ConfigParser()
+        config.read('config/config.ini')
+        if not config.getint('feature_cache', 'enable', fallback=0):
+            return None
+        cache_dir = config.get('feature_cache', 'cache_dir', fallback='./feature_cache')
+        max_size_gb = config.getfloat('feature_cache', 'max_size_gb', fallback=10)
+        return FeatureCache(cache_dir, int(max_size_gb * 1024 ** 3),
+                            config.get('feature_cache', 'dtype', fallback='float16'),
+                            config.get('feature_cache', 'model_version', fallback='1'))
+    except Exception as e:
+        logger.warning(f"音频特征缓存初始化失败，不启用缓存: {e}")
+        return None
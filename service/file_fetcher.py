@@ -0,0 +1,60 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : file_fetcher.py
+@ide    : PyCharm
+@time   : 2026-10-17 11:41:08
+"""
+import os
+import shutil
+
+import requests
+
+from h_utils.custom import CustomError
+from y_utils.logger import logger
+
+
+def is_remote(url):
+    return url.startswith('http://') or url.startswith('https://')
+
+
+def local_allowed(path, local_dirs):
+    """本地路径解析后位于local_dirs某个目录之下时返回True"""
+    real = os.path.realpath(path)
+    for local_dir in local_dirs or ():
+        root = os.path.realpath(local_dir)
+        if os.path.commonpath([real, root]) == root:
+            return True
+    return False
+
+
+def fetch(url, dest_path, timeout=60, chunk_size=1024 * 1024, local_dirs=None):
+    """
+    下载远程文件或复制本地文件到dest_path，先写临时文件再重命名；
+    本地文件只允许来自local_dirs中的目录，防止通过地址读取服务器任意文件
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    tmp_path = f"{dest_path}.{os.getpid()}.part"
+    try:
+        if is_remote(url):
+            with requests.get(url, stream=True, timeout=timeout) as r:
+                if r.status_code != 200:
+                    raise CustomError(f"下载失败[{r.status_code}]: {url}")
+                with open(tmp_path, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+        else:
+            if not local_allowed(url, local_dirs):
+                raise CustomError(f"只支持http(s)地址或允许目录下的本地文件: {url}")
+            if not os.path.isfile(url):
+                raise CustomError(f"文件不存在: {url}")
+            shutil.copyfile(url, tmp_path)
+        os.replace(tmp_path, dest_path)
+        logger.info(f"文件获取完成: {url} -> {dest_path}, 大小: {os.path.getsize(dest_path) / 1024 ** 2:.1f}MB")
+        return dest_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,227 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : fork_server.py
+@ide    : PyCharm
+@time   : 2026-10-17 20:48:31
+"""
+import configparser
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import traceback
+import weakref
+
+from h_utils.custom import CustomError
+from y_utils.logger import logger
+
+
+def _new_lock(obj):
+    obj.lock = threading.Lock()
+
+
+def reinit_after_fork(obj, reset=_new_lock):
+    """
+    fork时其他线程可能正持有obj的锁或有进行中的调用，子进程里没有这些线程，锁永远不会释放；
+    登记后子进程启动时调用reset(obj)重建锁和进行中的状态(默认只重建obj.lock)，obj按弱引用持有
+    """
+    ref = weakref.ref(obj)
+
+    def after_in_child():
+        target = ref()
+        if target is not None:
+            reset(target)
+
+    os.register_at_fork(after_in_child=after_in_child)
+
+
+class SyncedDict(dict):
+    """需要DictSync同步的普通dict用此类型：子进程内要替换实例类型拦截写入，内置dict不支持"""
+
+
+class _WatchedList(list):
+    """子进程内本任务的状态列表，原地修改时唤醒同步线程，序列化时还原为普通list"""
+
+    def __init__(self, items, changed):
+        super().__init__(items)
+        self.changed = changed
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+def _notify_after(name):
+    origin = getattr(list, name)
+
+    def method(self, *args, **kwargs):
+        result = origin(self, *args, **kwargs)
+        self.changed.set()
+        return result
+    return method
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop', 'remove',
+              'clear', 'sort', 'reverse'):
+    setattr(_WatchedList, _name, _notify_after(_name))
+
+
+class DictSync:
+    """
+    子进程内对任务状态dict中本任务key的修改（含状态列表的原地修改）同步回父进程：
+    写入时唤醒同步线程发送，interval只是兜底，覆盖拦截不到的嵌套修改；
+    get_dict每次调用时取dict，兼容运行中被替换的模块属性
+    """
+
+    def __init__(self, name, get_dict, interval=5, min_interval=0.1):
+        self.name = name
+        self.get_dict = get_dict
+        self.interval = interval
+        self.min_interval = min_interval
+
+    @staticmethod
+    def _watch(target, key, changed):
+        """把target换成只在本进程存在的子类型，写入或删除key时置位changed"""
+        base = type(target)
+
+        def __setitem__(mapping, k, value):
+            if k == key and type(value) is list:
+                value = _WatchedList(value, changed)
+            base.__setitem__(mapping, k, value)
+            if k == key:
+                changed.set()
+
+        def __delitem__(mapping, k):
+            base.__delitem__(mapping, k)
+            if k == key:
+                changed.set()
+
+        namespace = {'__setitem__': __setitem__, '__delitem__': __delitem__}
+        if issubclass(base, dict):
+            def pop(mapping, k, *default):
+                result = base.pop(mapping, k, *default)
+                if k == key:
+                    changed.set()
+                return result
+            namespace['pop'] = pop
+        target.__class__ = type(base.__name__, (base,), namespace)
+        value = target.get(key)
+        if type(value) is list:
+            target[key] = value
+
+    def run_child(self, conn, key, stop_event, changed):
+        self._watch(self.get_dict(), key, changed)
+        last = None
+        while True:
+            changed.wait(self.interval)
+            # 连续的进度更新合并发送
+            stop_event.wait(self.min_interval)
+            changed.clear()
+            stopped = stop_event.is_set()
+            value = self.get_dict().get(key, _MISSING)
+            data = pickle.dumps(value, protocol=4)
+            if data != last:
+                conn.send_bytes(data)
+                last = data
+            if stopped:
+                break
+        conn.close()
+
+    def run_parent(self, conn, key):
+        target = self.get_dict()
+        try:
+            while True:
+                value = pickle.loads(conn.recv_bytes())
+                if value is _MISSING:
+                    target.pop(key, None)
+                else:
+                    target[key] = value
+        except EOFError:
+            pass
+        finally:
+            conn.close()
+
+
+class _Missing:
+    def __reduce__(self):
+        return '_MISSING'
+
+
+_MISSING = _Missing()
+
+
+class ForkRunner:
+    """
+    zygote模式：每个任务在从主进程fork出的子进程中执行，任务崩溃或被OOM杀掉时只影响该任务；
+    模型由a()/init_p()启动的模型子进程加载，不在主进程内，任务子进程仍经队列调用同一组模型子进程，
+    因此不共享权重、也不增加推理并行度，只提供任务之间的进程隔离；
+    fork时主进程有其他线程在运行，子进程会用到的锁都需经reinit_after_fork登记后在子进程内重建
+    """
+
+    def __init__(self, syncs=(), on_crash=None):
+        self.syncs = list(syncs)
+        self.on_crash = on_crash
+        self.context = multiprocessing.get_context('fork')
+
+    def _child(self, task, args, task_id, conns):
+        stop_event = threading.Event()
+        events = [threading.Event() for _ in self.syncs]
+        threads = [threading.Thread(target=sync.run_child, args=(conn, task_id, stop_event, changed),
+                                    name=f'sync-{sync.name}', daemon=True)
+                   for sync, conn, changed in zip(self.syncs, conns, events)]
+        for thread in threads:
+            thread.start()
+        try:
+            task(*args)
+        finally:
+            stop_event.set()
+            for changed in events:
+                changed.set()
+            for thread in threads:
+                thread.join()
+
+    def run(self, task, args, task_id):
+        """在fork子进程中执行task(*args)并阻塞到子进程结束"""
+        pipes = [self.context.Pipe(duplex=False) for _ in self.syncs]
+        # 非daemon：任务内部还会再启动写视频等子进程
+        process = self.context.Process(target=self._child, args=(task, args, task_id, [w for _, w in pipes]),
+                                       name=f"task-{task_id}")
+        start = time.time()
+        process.start()
+        for _, writer in pipes:
+            writer.close()
+        readers = [threading.Thread(target=sync.run_parent, args=(reader, task_id),
+                                    name=f'sync-{sync.name}-{task_id}', daemon=True)
+                   for sync, (reader, _) in zip(self.syncs, pipes)]
+        for reader in readers:
+            reader.start()
+        process.join()
+        for reader in readers:
+            reader.join(timeout=5)
+        logger.info(f"任务子进程结束: {task_id}, pid: {process.pid}, 退出码: {process.exitcode}, "
+                    f"耗时: {time.time() - start:.1f}s")
+        if process.exitcode != 0:
+            if self.on_crash is not None:
+                try:
+                    self.on_crash(task_id, process.exitcode)
+                except Exception:
+                    traceback.print_exc()
+            raise CustomError(f"任务子进程异常退出，退出码: {process.exitcode}")
+
+
+def load_fork_config():
+    """
+    读取[zygote]配置，返回是否启用；跨任务批处理靠同一进程内多个任务的并发调用凑批，
+    任务分散到各自的子进程后凑不成批，两者同时开启时不启用zygote
+    """
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('zygote', 'enable', fallback=0):
+        return False
+    if config.getint('batching', 'enable', fallback=0):
+        logger.warning("[batching]已开启，zygote模式下任务分散在各自子进程中无法跨任务凑批，不启用zygote")
+        return False
+    return True
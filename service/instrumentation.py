@@ -0,0 +1,185 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : instrumentation.py
+@ide    : PyCharm
+@time   : 2026-10-17 18:02:37
+"""
+import os
+import pickle
+import select
+import struct
+import sys
+import threading
+import time
+from multiprocessing import util
+
+from service.fork_server import reinit_after_fork
+from y_utils.logger import logger
+
+# 不超过该长度的管道写入是原子的
+PIPE_BUF = getattr(select, 'PIPE_BUF', 512)
+
+# 处理阶段埋点位置：(模块, 函数或类.方法, 阶段)
+STAGE_HOOKS = (
+    ('h_utils.request_utils', 'download_file', 'download'),
+    ('service.file_fetcher', 'fetch', 'download'),
+    ('preprocess_audio_and_3dmm', 'op.flow', 'preprocessing'),
+    ('wenet.compute_ctc_att_bnf', 'PPGModel.forward', 'audio_features'),
+    ('landmark2face_wy.audio_handler', 'AudioHandler.convert_to_deepspeech', 'audio_features'),
+    ('landmark2face_wy.test_3dmm_multi_exp_wenet', 'Face2faceModel.face3d2Face', 'generation'),
+    ('landmark2face_wy.test_3dmm_multi_exp_wenet', 'Face2faceModel.blendImages', 'compositing'),
+)
+
+
+class ProcessRelay:
+    """
+    fork出的子进程把数据批量发回创建者进程：子进程内先缓存，每秒发送一次，进程退出前再发送一次，
+    创建者进程由后台线程接收并交给handler处理。
+    所有子进程共用一条非阻塞管道，每条消息一次写入且不超过PIPE_BUF，写入是原子的，不需要跨进程锁，
+    子进程在发送途中被杀掉也不会卡住其他进程；管道写满超过send_timeout时丢弃本批数据
+    """
+
+    def __init__(self, name, handler, interval=1, send_timeout=1):
+        self.name = name
+        self.handler = handler
+        self.interval = interval
+        self.send_timeout = send_timeout
+        self.owner_pid = os.getpid()
+        self.reader = None
+        self.writer = None
+        self.outbox = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+        self.outbox_pid = None
+
+    def start(self):
+        if self.writer is None:
+            self.owner_pid = os.getpid()
+            self.reader, self.writer = os.pipe()
+            os.set_blocking(self.writer, False)
+            threading.Thread(target=self._collect_loop, name=f'{self.name}-collect', daemon=True).start()
+
+    def is_local(self):
+        return self.writer is None or os.getpid() == self.owner_pid
+
+    def send(self, item):
+        with self.lock:
+            self.outbox.append(item)
+            if self.outbox_pid == os.getpid():
+                return
+            self.outbox_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name=f'{self.name}-flush', daemon=True).start()
+        util.Finalize(None, self.flush, exitpriority=10)
+
+    def _messages(self, items):
+        """按PIPE_BUF把数据切成多条消息：4字节消息长度 + 若干(4字节长度 + pickle数据)"""
+        body = b''
+        for item in items:
+            data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+            data = struct.pack('<I', len(data)) + data
+            if len(data) + 4 > PIPE_BUF:
+                logger.warning(f"{self.name}单条数据超过{PIPE_BUF}字节，已丢弃")
+                continue
+            if len(body) + len(data) + 4 > PIPE_BUF:
+                yield struct.pack('<I', len(body)) + body
+                body = b''
+            body += data
+        if body:
+            yield struct.pack('<I', len(body)) + body
+
+    def _write(self, message):
+        deadline = time.time() + self.send_timeout
+        while True:
+            try:
+                os.write(self.writer, message)
+                return True
+            except BlockingIOError:
+                if time.time() >= deadline:
+                    return False
+                time.sleep(0.01)
+            except OSError:
+                return False
+
+    def flush(self):
+        with self.lock:
+            items, self.outbox = self.outbox, []
+        if not items or self.writer is None:
+            return
+        for message in self._messages(items):
+            if not self._write(message):
+                self.dropped += 1
+                logger.warning(f"{self.name}子进程数据发送超时，已丢弃，累计丢弃{self.dropped}批")
+                return
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def _dispatch(self, body):
+        offset = 0
+        while offset < len(body):
+            size = struct.unpack_from('<I', body, offset)[0]
+            offset += 4
+            try:
+                self.handler(pickle.loads(body[offset:offset + size]))
+            except Exception as e:
+                logger.warning(f"{self.name}子进程数据处理失败: {e}")
+            offset += size
+
+    def _collect_loop(self):
+        buffer = b''
+        while True:
+            try:
+                data = os.read(self.reader, 65536)
+            except OSError:
+                time.sleep(self.interval)
+                continue
+            if not data:
+                break
+            buffer += data
+            while len(buffer) >= 4:
+                size = struct.unpack_from('<I', buffer)[0]
+                if len(buffer) < size + 4:
+                    break
+                body, buffer = buffer[4:size + 4], buffer[size + 4:]
+                self._dispatch(body)
+
+
+def patch(module_name, qualname, wrap, marker):
+    """
+    用wrap(原函数)替换模块函数或类方法，已带marker的跳过；
+    模块函数还会替换其他已加载模块中通过from import绑定的同一对象
+    """
+    try:
+        module = __import__(module_name, fromlist=[qualname.split('.')[0]])
+        owner = module
+        *path, name = qualname.split('.')
+        for part in path:
+            owner = getattr(owner, part)
+        origin = getattr(owner, name)
+    except Exception as e:
+        logger.warning(f"埋点失败 {module_name}.{qualname}: {e}")
+        return False
+    if getattr(origin, marker, False):
+        return True
+    wrapper = wrap(origin)
+    setattr(wrapper, marker, True)
+    descriptor = owner.__dict__.get(name) if isinstance(owner, type) else None
+    if isinstance(descriptor, (staticmethod, classmethod)):
+        # origin已是绑定后的函数，重新包装原函数保持描述符类型
+        wrapper = type(descriptor)(wrap(descriptor.__func__))
+        setattr(wrapper.__func__, marker, True)
+    setattr(owner, name, wrapper)
+    if not path:
+        for loaded in list(sys.modules.values()):
+            try:
+                if loaded is not None and loaded is not module and getattr(loaded, name, None) is origin:
+                    setattr(loaded, name, wrapper)
+            except Exception:
+                continue
+    return True
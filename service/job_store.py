@@ -0,0 +1,288 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : job_store.py
+@ide    : PyCharm
+@time   : 2026-10-17 21:26:07
+"""
+import configparser
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+from collections.abc import MutableMapping
+
+from y_utils.logger import logger
+
+
+def status_of(value):
+    """任务状态列表第0项为Status枚举"""
+    try:
+        status = value[0]
+    except (TypeError, IndexError, KeyError):
+        return None
+    return getattr(status, 'value', status)
+
+
+class MemoryJobStore(MutableMapping):
+    """
+    task_dic的替代实现：行为与dict一致（返回的状态列表可原地修改），
+    额外按状态建立索引，超过ttl未更新的任务由后台线程清理；
+    编译模块对状态列表的原地修改不经过本类，is_active判定为运行中的任务不清理
+    """
+
+    def __init__(self, ttl=24 * 3600, sweep_interval=60, is_active=None):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.is_active = is_active
+        self.values = {}
+        self.updated = {}
+        self.by_status = {}
+        self.lock = threading.RLock()
+        self._register_fork_handler()
+        self._start_thread(self._sweep_loop, 'job-store-sweep')
+
+    def _register_fork_handler(self):
+        # fork时后台线程可能持有锁，子进程内重建锁
+        ref = weakref.ref(self)
+
+        def after_in_child():
+            store = ref()
+            if store is not None:
+                store._after_fork_in_child()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=after_in_child)
+
+    def _after_fork_in_child(self):
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _start_thread(target, name):
+        threading.Thread(target=target, name=name, daemon=True).start()
+
+    def _index(self, key, value):
+        for codes in self.by_status.values():
+            codes.discard(key)
+        if value is not None:
+            self.by_status.setdefault(status_of(value), set()).add(key)
+
+    def __getitem__(self, key):
+        with self.lock:
+            return self.values[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.updated[key] = time.time()
+            self._index(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.values[key]
+            self.updated.pop(key, None)
+            self._index(key, None)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.values))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.values)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.values
+
+    def update_progress(self, key, progress):
+        """只更新进度，不重建状态列表"""
+        with self.lock:
+            self.values[key][1] = progress
+            self.updated[key] = time.time()
+
+    def codes_by_status(self, status):
+        """按状态取任务code，调用前刷新原地修改过的状态"""
+        status = getattr(status, 'value', status)
+        with self.lock:
+            self._reindex()
+            return sorted(self.by_status.get(status, ()))
+
+    def status_counts(self):
+        with self.lock:
+            self._reindex()
+            return {str(status): len(codes) for status, codes in self.by_status.items() if codes}
+
+    def _reindex(self):
+        for key, value in self.values.items():
+            if key not in self.by_status.get(status_of(value), ()):
+                self._index(key, value)
+
+    def _active(self, value):
+        if self.is_active is None:
+            return False
+        try:
+            return bool(self.is_active(value))
+        except Exception:
+            return False
+
+    def expire(self, now=None):
+        """清理超过ttl未更新的任务，返回清理数量；运行中的任务不清理，结束后从最后一次检查时起算ttl"""
+        now = now or time.time()
+        with self.lock:
+            expired = []
+            for key, updated in list(self.updated.items()):
+                if self._active(self.values.get(key)):
+                    self.updated[key] = max(updated, now)
+                elif now - updated > self.ttl:
+                    expired.append(key)
+            for key in expired:
+                del self[key]
+        if expired:
+            logger.info(f"任务状态过期清理: {len(expired)}条")
+        return len(expired)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.expire()
+            except Exception as e:
+                logger.warning(f"任务状态过期清理失败: {e}")
+
+
+class SQLiteJobStore(MemoryJobStore):
+    """
+    单机持久化：内存中保留可原地修改的状态对象，后台线程按flush_interval把变化合并成一个事务写入SQLite，
+    请求线程和任务线程的写入不等待磁盘；重启时恢复任务状态，未完成的任务标记为中断
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs (code TEXT PRIMARY KEY, status TEXT, value BLOB, updated_at REAL)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs(updated_at)",
+    )
+
+    def __init__(self, path, ttl=24 * 3600, sweep_interval=60, flush_interval=0.5, on_restore=None,
+                 is_active=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.persisted = {}
+        self.deleted = set()
+        self.persist = True
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        super().__init__(ttl, sweep_interval, is_active)
+        self._restore(on_restore)
+        self._start_thread(self._flush_loop, 'job-store-flush')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _after_fork_in_child(self):
+        # zygote任务子进程的状态由父进程同步落盘，子进程不写库
+        super()._after_fork_in_child()
+        self.persist = False
+
+    def _restore(self, on_restore):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - self.ttl,))
+            rows = conn.execute("SELECT code, value, updated_at FROM jobs").fetchall()
+        restored = 0
+        for code, data, updated_at in rows:
+            try:
+                value = pickle.loads(data)
+            except Exception as e:
+                logger.warning(f"任务状态恢复失败 {code}: {e}")
+                continue
+            if on_restore is not None:
+                value = on_restore(code, value)
+            with self.lock:
+                self.values[code] = value
+                self.updated[code] = updated_at
+                self._index(code, value)
+            self.persisted[code] = data
+            restored += 1
+        logger.info(f"任务状态库: {self.path}, 恢复{restored}条")
+
+    def __delitem__(self, key):
+        with self.lock:
+            super().__delitem__(key)
+            self.deleted.add(key)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+            self.deleted.discard(key)
+
+    def flush(self):
+        """把有变化的任务状态写入SQLite，原地修改通过序列化结果比对发现"""
+        if not self.persist:
+            return
+        with self.lock:
+            items = list(self.values.items())
+            deleted, self.deleted = self.deleted, set()
+            updated = dict(self.updated)
+        now = time.time()
+        rows = []
+        for code, value in items:
+            try:
+                data = pickle.dumps(value, protocol=4)
+            except Exception as e:
+                logger.warning(f"任务状态无法序列化 {code}: {e}")
+                continue
+            if self.persisted.get(code) != data:
+                # 原地修改的进度也算一次更新，避免运行中的任务被过期清理
+                updated_at = max(updated.get(code, now), now - self.flush_interval)
+                with self.lock:
+                    if code in self.updated:
+                        self.updated[code] = max(self.updated[code], updated_at)
+                rows.append((code, str(status_of(value)), data, updated_at))
+                self.persisted[code] = data
+        for code in deleted:
+            self.persisted.pop(code, None)
+        if not rows and not deleted:
+            return
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO jobs (code, status, value, updated_at) VALUES (?, ?, ?, ?)",
+                             rows)
+            conn.executemany("DELETE FROM jobs WHERE code = ?", [(code,) for code in deleted])
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"任务状态落盘失败: {e}")
+
+
+def load_job_store(on_restore=None, is_active=None):
+    """按[job_store]配置创建任务状态存储，is_active判定任务是否仍在运行"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    backend = config.get('job_store', 'backend', fallback='memory')
+    ttl = config.getfloat('job_store', 'ttl_hours', fallback=24) * 3600
+    if backend == 'sqlite':
+        return SQLiteJobStore(config.get('job_store', 'path', fallback='./data/jobs.db'), ttl,
+                              on_restore=on_restore, is_active=is_active)
+    return MemoryJobStore(ttl, is_active=is_active)
+
+
+def install_job_store(module, store, name='task_dic'):
+    """替换模块中的全局任务状态dict，已有条目迁移到新存储"""
+    existing = getattr(module, name, None)
+    if existing is not None and existing is not store:
+        for key, value in list(existing.items()):
+            store[key] = value
+    setattr(module, name, store)
+    return store
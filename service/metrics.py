@@ -0,0 +1,318 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : metrics.py
+@ide    : PyCharm
+@time   : 2026-10-17 17:25:12
+"""
+import configparser
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from service.fork_server import reinit_after_fork
+from service.instrumentation import STAGE_HOOKS, ProcessRelay, patch
+from y_utils.logger import logger
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _reinit_registry_lock():
+    global _registry_lock
+    _registry_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reinit_registry_lock)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+        with _registry_lock:
+            _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _record(self, key, value):
+        if _relay.is_local():
+            self._apply(key, value)
+        else:
+            _relay.send((self.name, key, value))
+
+    def _apply(self, key, value):
+        raise NotImplementedError
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        self._record(self._key(labels), amount)
+
+    def _apply(self, key, value):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+    def _samples(self):
+        with self.lock:
+            return [('', _format_labels(self.labelnames, key), value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(_Metric):
+    """取值在采集时由callback计算，callback返回数值或{标签元组: 数值}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        if self.callback is None:
+            return []
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"指标{self.name}采集失败: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', _format_labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        self._record(self._key(labels), value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _apply(self, key, value):
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append(('_bucket', _format_labels(self.labelnames, key, ('le', _format_value(bound))),
+                                    cumulative))
+                samples.append(('_sum', _format_labels(self.labelnames, key), total))
+                samples.append(('_count', _format_labels(self.labelnames, key), count))
+        return samples
+
+
+def _receive(item):
+    name, key, value = item
+    metric = _registry.get(name)
+    if metric is not None:
+        metric._apply(key, value)
+
+
+# 模型子进程、写视频子进程由fork创建，观测值汇总到主进程
+_relay = ProcessRelay('metrics', _receive)
+
+
+def render():
+    """输出Prometheus文本格式的全部指标"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+QUEUE_WAIT = Histogram('dh_queue_wait_seconds', '任务从提交到开始执行的排队时间')
+STAGE_DURATION = Histogram('dh_stage_duration_seconds',
+                           '各处理阶段单次调用耗时，encoding为逐帧写入编码器的耗时', ('stage',))
+ONNX_LATENCY = Histogram('dh_onnx_run_seconds', 'onnxruntime session.run耗时', ('model',),
+                         buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+FRAMES = Counter('dh_frames_generated_total', '写入编码器的视频帧数')
+TASKS = Counter('dh_tasks_total', '执行完成的任务数', ('result',))
+
+
+class _FrameRate:
+    """按最近window秒内帧计数的增量计算帧率"""
+
+    def __init__(self, window=60):
+        self.window = window
+        self.samples = deque()
+
+    def __call__(self):
+        now = time.time()
+        total = FRAMES.total()
+        self.samples.append((now, total))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.window:
+            self.samples.popleft()
+        start_time, start_total = self.samples[0]
+        return (total - start_total) / (now - start_time) if now > start_time else 0.0
+
+
+FRAME_RATE = Gauge('dh_frames_per_second', '最近60秒平均生成帧率', callback=_FrameRate())
+
+
+def _memory():
+    import psutil
+
+    process = psutil.Process()
+    children = process.children(recursive=True)
+    child_rss = 0
+    for child in children:
+        try:
+            child_rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return {('main',): process.memory_info().rss, ('children',): child_rss}
+
+
+RSS = Gauge('dh_process_resident_memory_bytes', '主进程与全部子进程的常驻内存', ('process',), callback=_memory)
+
+
+def timed(stage):
+    """按stage统计被包装函数的耗时"""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_DURATION.time(stage=stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def _instrument_onnxruntime():
+    from onnxruntime import InferenceSession
+
+    origin_run = InferenceSession.run
+    if getattr(origin_run, '_metrics', False):
+        return
+
+    def run(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return origin_run(self, *args, **kwargs)
+        finally:
+            model = os.path.basename(getattr(self, '_model_path', '') or '') or 'unknown'
+            ONNX_LATENCY.observe(time.perf_counter() - start, model=model)
+
+    run._metrics = True
+    InferenceSession.run = run
+
+
+def _instrument_writers():
+    import cv2
+    from service.video_writer import FFmpegPipeWriter
+
+    origin_write = FFmpegPipeWriter.write
+    if not getattr(origin_write, '_metrics', False):
+        def write(self, frame):
+            with STAGE_DURATION.time(stage='encoding'):
+                origin_write(self, frame)
+            FRAMES.inc()
+
+        write._metrics = True
+        FFmpegPipeWriter.write = write
+
+    # 编译模块内的write_video通过cv2.VideoWriter写帧
+    if not getattr(cv2.VideoWriter, '_metrics', False):
+        class VideoWriter(cv2.VideoWriter):
+            _metrics = True
+
+            def write(self, image):
+                with STAGE_DURATION.time(stage='encoding'):
+                    result = super().write(image)
+                FRAMES.inc()
+                return result
+
+        cv2.VideoWriter = VideoWriter
+
+
+def install_metrics(concurrency_manager=None):
+    """创建跨进程汇总通道并给各阶段埋点，需在模型子进程启动前调用"""
+    _relay.start()
+    if concurrency_manager is not None:
+        Gauge('dh_queue_depth', '排队等待执行的任务数', callback=concurrency_manager.get_queue_size)
+        Gauge('dh_running_tasks', '正在执行的任务数', callback=concurrency_manager.get_current_tasks)
+        Gauge('dh_concurrency_slots', '并发槽位数', callback=lambda: concurrency_manager.max_concurrent_tasks)
+    for module_name, qualname, stage in STAGE_HOOKS:
+        patch(module_name, qualname, timed(stage), '_metrics')
+    for install in (_instrument_onnxruntime, _instrument_writers):
+        try:
+            install()
+        except Exception as e:
+            logger.warning(f"指标埋点失败 {install.__name__}: {e}")
+    logger.info("运行指标采集已启用")
+
+
+def load_metrics_config():
+    """读取[metrics]配置"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    return bool(config.getint('metrics', 'enable', fallback=1))
@@ -0,0 +1,228 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : model_loader.py
+@ide    : PyCharm
+@time   : 2026-10-17 20:12:53
+"""
+import configparser
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from service.fork_server import reinit_after_fork
+from service.instrumentation import ProcessRelay, patch
+from service.model_readiness import add_ready_hook
+from y_utils.logger import logger
+
+# download.sh下载的模型权重
+MODEL_FILES = (
+    './face_attr_detect/face_attr_epoch_12_220318.onnx',
+    './face_detect_utils/resources/pfpld_robust_sim_bs1_8003.onnx',
+    './face_detect_utils/resources/scrfd_500m_bnkps_shape640x640.onnx',
+    './face_detect_utils/resources/model_float32.onnx',
+    './landmark2face_wy/checkpoints/anylang/dinet_v1_20240131.pth',
+    './pretrain_models/face_lib/face_parsing/79999_iter.onnx',
+    './pretrain_models/face_lib/face_restore/gfpgan/GFPGANv1.4.onnx',
+    './xseg/xseg_211104_4790000.onnx',
+    './wenet/examples/aishell/aidata/exp/conformer/wenetmodel.pt',
+)
+
+# 记录加载耗时的模型构造位置：(模块, 函数或类.方法)
+LOAD_HOOKS = (
+    ('model_lib.model_base', 'ModelBase.__init__'),
+    ('face_detect_utils.scrfd', 'SCRFD.__init__'),
+    ('face_detect_utils.face_detect', 'pfpld.__init__'),
+    ('face_detect_utils.head_pose', 'Headpose.__init__'),
+    ('wenet.compute_ctc_att_bnf', 'load_ppg_model'),
+    ('landmark2face_wy.audio_handler', 'AudioHandler.__init__'),
+    ('landmark2face_wy.test_3dmm_multi_exp_wenet', 'Face2faceModel.__init__'),
+)
+
+
+class ModelLoadReport:
+    """各模型加载/预热耗时，子进程内的记录汇总到主进程"""
+
+    def __init__(self):
+        self.models = {}
+        self.prefetch = {}
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+        self.relay = ProcessRelay('model-load', self._apply)
+
+    def _apply(self, item):
+        key, field, seconds, pid = item
+        with self.lock:
+            record = self.models.setdefault(key, {'pid': pid})
+            record[field] = round(seconds, 3)
+
+    def record(self, name, field, seconds):
+        pid = os.getpid()
+        logger.info(f"模型{name}[{pid}] {'加载' if field == 'load_seconds' else '预热'}耗时: {seconds:.2f}s")
+        item = (f"{name}@{pid}", field, seconds, pid)
+        if self.relay.is_local():
+            self._apply(item)
+        else:
+            self.relay.send(item)
+
+    def to_dict(self):
+        with self.lock:
+            return {'models': dict(self.models), 'prefetch': dict(self.prefetch)}
+
+
+report = ModelLoadReport()
+
+
+def prefetch_model_files(paths=MODEL_FILES, max_workers=4, chunk_size=16 * 1024 * 1024):
+    """线程池并行把模型文件读入页缓存，模型进程随后顺序加载时不再等磁盘IO"""
+    def read(path):
+        start = time.time()
+        with open(path, 'rb') as f:
+            while f.read(chunk_size):
+                pass
+        return path, time.time() - start
+
+    paths = [path for path in paths if os.path.isfile(path)]
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='model-prefetch')
+    futures = [executor.submit(read, path) for path in paths]
+
+    def done(future):
+        try:
+            path, seconds = future.result()
+            report.prefetch[os.path.basename(path)] = round(seconds, 3)
+        except Exception as e:
+            logger.warning(f"模型文件预读失败: {e}")
+
+    for future in futures:
+        future.add_done_callback(done)
+    executor.shutdown(wait=False)
+    return futures
+
+
+class _WarmupPool:
+    """
+    ONNXModel构造时调用的warm_up放到线程池执行，与后续模型加载并行；
+    子进程报告就绪前等全部预热结束，有预热失败时抛出，子进程不报告就绪
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_pid = None
+        self.futures = []
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+
+    def submit(self, fn, *args):
+        with self.lock:
+            # fork后的子进程里父进程的线程池不可用，按进程重建
+            if self.executor_pid != os.getpid():
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='model-warmup')
+                self.executor_pid = os.getpid()
+                self.futures = []
+            future = self.executor.submit(fn, *args)
+            self.futures.append(future)
+            return future
+
+    def join(self):
+        with self.lock:
+            futures = list(self.futures) if self.executor_pid == os.getpid() else []
+        wait(futures)
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise RuntimeError(f"{len(errors)}个模型预热失败: {errors[0]}")
+
+
+def _timed_load(name):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            result = fn(*args, **kwargs)
+            label = name
+            if name.endswith('.__init__') and args:
+                label = type(args[0]).__name__
+                model_path = getattr(args[0], 'model_path', None) or getattr(args[0], 'model_file', None)
+                if model_path:
+                    label = f"{label}:{os.path.basename(str(model_path))}"
+            report.record(label, 'load_seconds', time.time() - start)
+            return result
+        return wrapper
+    return wrap
+
+
+def _install_onnx_warmup(pool):
+    from model_lib.base_wrapper.onnx_model import ONNXModel
+
+    if getattr(ONNXModel.__init__, '_parallel_warmup', False):
+        return
+    origin_init = ONNXModel.__init__
+    origin_warm_up = ONNXModel.warm_up
+    local = threading.local()
+
+    def run_warm_up(model, name, args, kwargs):
+        start = time.time()
+        try:
+            origin_warm_up(model, *args, **kwargs)
+        except Exception as e:
+            logger.error(f"模型{name}[{os.getpid()}]预热失败: {e}")
+            raise
+        report.record(name, 'warmup_seconds', time.time() - start)
+
+    def warm_up(self, *args, **kwargs):
+        # 构造函数内的预热记下参数改为异步，其他调用保持同步
+        if getattr(local, 'pending', None) is self:
+            local.deferred = (args, kwargs)
+            return None
+        return origin_warm_up(self, *args, **kwargs)
+
+    def __init__(self, onnx_path, *args, **kwargs):
+        start = time.time()
+        outer = getattr(local, 'pending', None), getattr(local, 'deferred', None)
+        local.pending, local.deferred = self, None
+        try:
+            origin_init(self, onnx_path, *args, **kwargs)
+            deferred = local.deferred
+        finally:
+            local.pending, local.deferred = outer
+        name = f"ONNXModel:{os.path.basename(str(onnx_path))}"
+        report.record(name, 'load_seconds', time.time() - start)
+        # 只推迟构造函数本来就会执行的预热
+        if deferred is not None:
+            pool.submit(run_warm_up, self, name, *deferred)
+
+    __init__._parallel_warmup = True
+    ONNXModel.__init__ = __init__
+    ONNXModel.warm_up = warm_up
+
+
+def install_model_loading(prefetch=True, warmup=True, max_workers=4):
+    """需在模型子进程启动前调用：并行预读权重、记录各模型加载耗时、ONNX模型并行预热"""
+    report.relay.start()
+    if prefetch:
+        prefetch_model_files(max_workers=max_workers)
+    for module_name, qualname in LOAD_HOOKS:
+        patch(module_name, qualname, _timed_load(qualname), '_load_timed')
+    if warmup:
+        try:
+            pool = _WarmupPool(max_workers)
+            _install_onnx_warmup(pool)
+            add_ready_hook(pool.join)
+        except Exception as e:
+            logger.warning(f"ONNX模型并行预热未启用: {e}")
+    logger.info(f"模型并行加载已启用，预读: {prefetch}, 并行预热: {warmup}, 线程数: {max_workers}")
+
+
+def load_model_loading_config():
+    """读取[model_loading]配置并按需启用"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('model_loading', 'enable', fallback=1):
+        return
+    install_model_loading(bool(config.getint('model_loading', 'prefetch', fallback=1)),
+                          bool(config.getint('model_loading', 'warmup', fallback=1)),
+                          config.getint('model_loading', 'max_workers', fallback=4))
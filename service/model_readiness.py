@@ -0,0 +1,219 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : model_readiness.py
+@ide    : PyCharm
+@time   : 2026-10-17 19:40:26
+"""
+import configparser
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.queues
+import os
+import threading
+import time
+
+from y_utils.logger import logger
+
+# 正在fork的模型子进程的就绪管道写端，fork后只有该子进程持有
+_pending_conn = None
+_child_conn = None
+_ready_hooks = []
+
+
+def add_ready_hook(fn):
+    """报告就绪前需要等待完成的工作，如模型预热"""
+    if fn not in _ready_hooks:
+        _ready_hooks.append(fn)
+
+
+def _run_ready_hooks():
+    """执行全部就绪前置任务，返回失败原因列表"""
+    errors = []
+    for hook in list(_ready_hooks):
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"就绪前置任务执行失败: {e}")
+            errors.append(str(e))
+    return errors
+
+
+def _after_fork_in_child():
+    global _pending_conn, _child_conn
+    _child_conn, _pending_conn = _pending_conn, None
+    if _child_conn is not None:
+        _install_queue_hooks()
+
+
+def mark_ready():
+    """
+    模型子进程加载和预热完成后调用，经自己的管道通知父进程(预热失败时发送失败原因)；
+    同一进程只通知一次，不在就绪跟踪中的进程调用无效果
+    """
+    global _child_conn
+    conn = _child_conn
+    if conn is None:
+        return
+    _child_conn = None
+    errors = _run_ready_hooks()
+    try:
+        conn.send((os.getpid(), errors))
+        conn.close()
+    except OSError:
+        pass
+
+
+def _install_queue_hooks():
+    """
+    只在被跟踪的模型子进程里安装：trans_dh_service的模型进程没有加载完成的回调，
+    加载完成后第一次阻塞在任务队列上取任务即视为就绪
+    """
+    for cls in (multiprocessing.queues.Queue, multiprocessing.queues.SimpleQueue):
+        origin_get = cls.get
+        if getattr(origin_get, '_readiness', False):
+            continue
+
+        def get(self, *args, _origin_get=origin_get, **kwargs):
+            if _child_conn is not None:
+                mark_ready()
+            return _origin_get(self, *args, **kwargs)
+
+        get._readiness = True
+        cls.get = get
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class ModelReadiness:
+    """
+    with块内启动的fork子进程视为模型进程，每个子进程有一条单向管道，加载和预热完成后发送自己的pid；
+    全部子进程报告后即为就绪，替代固定时长的sleep。子进程退出时管道关闭，等待立即结束
+    """
+
+    def __init__(self, name='models', timeout=120):
+        self.name = name
+        self.timeout = timeout
+        self.processes = {}
+        self.conns = {}
+        self.ready_pids = set()
+        self.failed = {}
+        self.state = 'pending'
+        self.started_at = None
+        self.ready_at = None
+        self.lock = threading.Lock()
+        self._origin_start = None
+
+    def __enter__(self):
+        self.started_at = time.time()
+        origin_start = self._origin_start = multiprocessing.process.BaseProcess.start
+        watcher = self
+
+        def start(process):
+            global _pending_conn
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            _pending_conn = writer
+            try:
+                origin_start(process)
+            finally:
+                _pending_conn = None
+                # 父进程关闭写端，子进程退出时读端收到EOF
+                writer.close()
+            target = getattr(process, '_target', None)
+            # Manager服务进程不从队列取任务，spawn子进程不继承钩子，都不参与就绪判断
+            if getattr(target, '__name__', '') == '_run_server' \
+                    or not type(process._popen).__module__.endswith('popen_fork'):
+                reader.close()
+                return
+            watcher.processes[process.pid] = process
+            watcher.conns[process.pid] = reader
+
+        multiprocessing.process.BaseProcess.start = start
+        self.state = 'loading'
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        multiprocessing.process.BaseProcess.start = self._origin_start
+        if exc_type is not None:
+            self.state = 'error'
+        return False
+
+    def _receive(self, timeout):
+        """等待任一管道可读并收下就绪报告，返回预热失败或未就绪就已退出的子进程"""
+        conns = {conn: pid for pid, conn in self.conns.items()}
+        if not conns:
+            time.sleep(min(timeout, 0.05))
+        for conn in (multiprocessing.connection.wait(list(conns), timeout) if conns else ()):
+            pid = conns[conn]
+            try:
+                ready_pid, errors = conn.recv()
+                if errors:
+                    self.failed[pid] = errors
+                else:
+                    self.ready_pids.add(ready_pid)
+            except (EOFError, OSError):
+                pass
+            conn.close()
+            del self.conns[pid]
+        # 管道关闭时进程可能还没退出完，子进程的子进程也可能继承写端，按进程状态确认
+        return list(self.failed) + [pid for pid, process in self.processes.items()
+                                    if pid not in self.ready_pids and pid not in self.failed
+                                    and not process.is_alive()]
+
+    def _check(self, timeout):
+        dead = self._receive(timeout)
+        if dead:
+            self.state = 'error'
+            logger.error(f"{self.name}初始化失败，子进程已退出或预热失败: {dead}, {self.failed}")
+        elif all(pid in self.ready_pids for pid in self.processes):
+            # 主进程内加载的模型也要等预热完成
+            if _run_ready_hooks():
+                self.state = 'error'
+                return
+            self.state = 'ready'
+            self.ready_at = time.time()
+            logger.info(f"{self.name}已就绪，{len(self.processes)}个子进程，耗时{self.ready_at - self.started_at:.1f}s")
+
+    def wait(self, timeout=None):
+        """阻塞到全部模型进程就绪；子进程退出记为error，超时记为timeout(超时后仍报告就绪时转为ready)"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        while self.state == 'loading':
+            remaining = deadline - time.time()
+            with self.lock:
+                if remaining <= 0:
+                    self.state = 'timeout'
+                    waiting = [pid for pid in self.processes if pid not in self.ready_pids]
+                    logger.warning(f"{self.name}等待就绪超时({timeout}s)，未确认就绪的子进程: {waiting}")
+                    break
+                self._check(min(remaining, 1))
+        return self.state == 'ready'
+
+    @property
+    def ready(self):
+        """全部模型进程确认就绪时才可接收任务；超时后只在迟到的就绪报告补齐时转为就绪"""
+        if self.state == 'timeout':
+            with self.lock:
+                if self.state == 'timeout':
+                    self._check(0)
+        return self.state == 'ready'
+
+    def to_dict(self):
+        end = self.ready_at or time.time()
+        return {
+            'state': self.state,
+            'processes': len(self.processes),
+            'ready_processes': len(self.ready_pids),
+            'elapsed_seconds': round(end - self.started_at, 1) if self.started_at else None
+        }
+
+
+def load_ready_timeout():
+    """读取[startup]就绪等待上限，单位秒"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    return config.getfloat('startup', 'ready_timeout', fallback=120)
@@ -0,0 +1,156 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : progressive_output.py
+@ide    : PyCharm
+@time   : 2026-10-18 00:58:12
+"""
+import configparser
+import os
+import re
+import shutil
+import time
+
+from h_utils.custom import CustomError
+from service.segment_parallel import load_key_frames
+from service.video_writer import HLS_PLAYLIST, FFmpegPipeWriter
+from y_utils.config import GlobalConfig
+from y_utils.logger import logger
+
+STREAM_SUBDIR = 'stream'
+CODE_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def valid_code(code):
+    """流式输出的任务code只允许字母、数字、下划线和短横线，code会拼进目录路径"""
+    return isinstance(code, str) and CODE_PATTERN.fullmatch(code) is not None
+
+
+def stream_dir(result_dir, code):
+    """任务的HLS目录；code不合法或解析后不在result_dir/stream下时返回None"""
+    if not valid_code(code):
+        return None
+    root = os.path.realpath(os.path.join(result_dir, STREAM_SUBDIR))
+    path = os.path.realpath(os.path.join(root, code))
+    if os.path.dirname(path) != root:
+        return None
+    return path
+
+
+def create_stream(result_dir, code, keep_seconds):
+    """
+    为任务创建HLS输出目录，写视频进程看到目录存在时才输出分片（跨进程的开关）；
+    顺带清理超过keep_seconds的旧目录
+    """
+    root = os.path.join(result_dir, STREAM_SUBDIR)
+    os.makedirs(root, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if now - os.path.getmtime(path) > keep_seconds:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
+    path = stream_dir(result_dir, code)
+    if path is None:
+        raise CustomError(f"任务code不合法: {code}")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def playlist_ready(result_dir, code):
+    """播放列表已写出第一个分片时返回True"""
+    path = stream_dir(result_dir, code)
+    return path is not None and os.path.exists(os.path.join(path, HLS_PLAYLIST))
+
+
+def write_video_progressive(
+    output_imgs_queue,
+    temp_dir,
+    result_dir,
+    work_id,
+    audio_path,
+    result_queue,
+    width,
+    height,
+    fps,
+    watermark_switch=0,
+    digital_auth=0,
+    *args,
+    **kwargs,
+):
+    """
+    trans_dh_service.write_video的替代：提交时要求流式输出的任务，同一次编码同时写mp4和HLS分片；
+    分段生成的子任务在截取点强制关键帧
+    """
+    result_path = os.path.join(result_dir, "{}-r.mp4".format(work_id))
+    hls_dir = stream_dir(result_dir, work_id)
+    if hls_dir is not None and not os.path.isdir(hls_dir):
+        hls_dir = None
+    output_args = None
+    key_frames = load_key_frames(result_dir, work_id)
+    if key_frames:
+        output_args = ['-force_key_frames', ','.join(str(t) for t in key_frames)]
+    watermark_path = None
+    digital_auth_path = None
+    if watermark_switch == 1:
+        logger.info("Custom VideoWriter [{}]任务需要水印".format(work_id))
+        watermark_path = GlobalConfig.instance().watermark_path
+    if digital_auth == 1:
+        logger.info("Custom VideoWriter [{}]任务需要数字人标识".format(work_id))
+        digital_auth_path = GlobalConfig.instance().digital_auth_path
+    video_write = None
+    try:
+        video_write = FFmpegPipeWriter(
+            result_path,
+            audio_path,
+            width,
+            height,
+            fps,
+            watermark_path=watermark_path,
+            digital_auth_path=digital_auth_path,
+            output_args=output_args,
+            hls_dir=hls_dir,
+            segment_seconds=load_segment_seconds(),
+        )
+        while True:
+            state, reason, value_ = output_imgs_queue.get()
+            if type(state) == bool and state == True:
+                logger.info("Custom VideoWriter [{}]视频帧队列处理已结束".format(work_id))
+                break
+            if type(state) == bool and state == False:
+                logger.error("Custom VideoWriter [{}]任务视频帧队列 -> 异常原因:[{}]".format(work_id, reason))
+                raise CustomError(reason)
+            for result_img in value_:
+                video_write.write(result_img)
+        video_write.close()
+        logger.info("Custom VideoWriter [{}]视频已保存: {}".format(work_id, result_path))
+        result_queue.put([True, result_path])
+    except Exception as e:
+        if video_write is not None:
+            video_write.abort()
+        logger.error("Custom VideoWriter [{}]视频帧队列处理异常结束，异常原因:[{}]".format(work_id, e.__str__()))
+        result_queue.put([False, "[{}]视频帧队列处理异常结束，异常原因:[{}]".format(work_id, e.__str__())])
+    logger.info("Custom VideoWriter 后处理进程结束")
+
+
+def _read_config():
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    return config
+
+
+def load_segment_seconds():
+    return _read_config().getfloat('progressive_output', 'segment_seconds', fallback=2)
+
+
+def load_progressive_config():
+    """读取[progressive_output]配置，启用时返回旧目录保留秒数，否则返回None"""
+    config = _read_config()
+    if not config.getint('progressive_output', 'enable', fallback=0):
+        return None
+    return config.getfloat('progressive_output', 'keep_hours', fallback=24) * 3600
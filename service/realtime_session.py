@@ -0,0 +1,449 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : realtime_session.py
+@ide    : PyCharm
+@time   : 2026-10-18 01:52:30
+"""
+import bisect
+import configparser
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import traceback
+import uuid
+import wave
+
+import cv2
+
+from h_utils.custom import CustomError
+from y_utils.logger import logger
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+class SessionMux:
+    """
+    会话内常驻的ffmpeg：stdin读bgr24原始帧，另一条管道读s16le PCM，整个会话编码为一路连续的MPEG-TS，
+    时间戳由编码器连续生成，不再每块单独起ffmpeg封装
+    """
+
+    def __init__(self, width, height, fps, on_data):
+        self.width = width
+        self.height = height
+        self.on_data = on_data
+        audio_read, audio_write = os.pipe()
+        command = ['ffmpeg', '-loglevel', 'warning',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:0',
+                   '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '1', '-i', f'pipe:{audio_read}',
+                   '-map', '0:v', '-map', '1:a',
+                   '-c:v', 'libx264', '-preset', 'veryfast', '-tune', 'zerolatency', '-pix_fmt', 'yuv420p',
+                   '-c:a', 'aac', '-muxdelay', '0', '-flush_packets', '1', '-f', 'mpegts', 'pipe:1']
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            pass_fds=(audio_read,))
+        except Exception:
+            os.close(audio_write)
+            raise
+        finally:
+            os.close(audio_read)
+        self.audio = open(audio_write, 'wb')
+        self.audio_queue = queue.Queue()
+        # 音频和视频走两条管道，分别由不同线程写入，ffmpeg等其中一路时另一路不会互相阻塞
+        self.audio_thread = threading.Thread(target=self._write_audio_loop, name='session-mux-audio', daemon=True)
+        self.read_thread = threading.Thread(target=self._read_loop, name='session-mux-read', daemon=True)
+        self.audio_thread.start()
+        self.read_thread.start()
+
+    def _write_audio_loop(self):
+        try:
+            while True:
+                pcm = self.audio_queue.get()
+                if pcm is None:
+                    break
+                self.audio.write(pcm)
+                self.audio.flush()
+        except OSError:
+            pass
+        finally:
+            try:
+                self.audio.close()
+            except OSError:
+                pass
+
+    def _read_loop(self):
+        while True:
+            data = self.process.stdout.read1(65536)
+            if not data:
+                break
+            self.on_data(data)
+
+    def write(self, frames, pcm):
+        """写入一块的视频帧和对应音频"""
+        self.audio_queue.put(pcm)
+        try:
+            for frame in frames:
+                if frame.shape[0] != self.height or frame.shape[1] != self.width:
+                    frame = cv2.resize(frame, (self.width, self.height))
+                self.process.stdin.write(frame.tobytes())
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise CustomError("会话ffmpeg进程异常退出，返回码: {}".format(self.process.poll()))
+
+    def close(self):
+        """输入结束，等ffmpeg输出完剩余数据"""
+        self.audio_queue.put(None)
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.audio_thread.join()
+        self.read_thread.join()
+        ret = self.process.wait()
+        if ret != 0:
+            raise CustomError("会话视频编码失败，返回码: {}".format(ret))
+
+    def abort(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.audio_queue.put(None)
+        self.read_thread.join()
+        self.process.wait()
+
+
+class RealtimeSession:
+    """
+    实时会话：客户端持续上传16kHz单声道s16le PCM，按bounds把模板循环周期分成的块切分音频，
+    每块(附带lookahead音频作为右侧上下文)交给render_fn(code, wav_path, clip)生成视频，
+    clip为块在周期内的序号，对应一段从该周期位置开始的短模板，块间的模板位置因此连续；
+    截取本块帧数后写入会话常驻的SessionMux，编码为一路连续的MPEG-TS，客户端以分块HTTP持续读取；
+    给出slot时每块在预留的并发槽位内生成
+    """
+
+    def __init__(self, session_id, render_fn, work_dir, bounds, fps, lookahead_seconds=0.5, slot=None,
+                 max_buffered=64):
+        self.session_id = session_id
+        self.render_fn = render_fn
+        self.slot = slot
+        self.work_dir = work_dir
+        self.fps = fps
+        self.bounds = bounds
+        self.cycle = bounds[-1]
+        self.lookahead_samples = int(lookahead_seconds * SAMPLE_RATE)
+        self.pcm = bytearray()
+        self.base = 0
+        self.received = 0
+        self.arrivals = []
+        self.closed = False
+        self.aborted = False
+        self.rendering = False
+        self.error = None
+        self.cond = threading.Condition()
+        # 客户端读取跟不上时输出阻塞，反压到编码和生成，不无限缓存
+        self.output = queue.Queue(maxsize=max_buffered)
+        self.mux = None
+        self.frames_written = 0
+        self.chunks = []
+        self.created = time.time()
+        self.last_active = time.time()
+        self.first_audio_at = None
+        self.first_video_at = None
+        os.makedirs(work_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name=f'session-{session_id}', daemon=True)
+        self.thread.start()
+        logger.info(f"实时会话[{session_id}]已创建，块长: {self.chunk_seconds:.2f}s")
+
+    @property
+    def chunk_seconds(self):
+        return self.cycle / (len(self.bounds) - 1) / self.fps
+
+    def _sample_of(self, frame):
+        return int(round(frame / self.fps * SAMPLE_RATE))
+
+    def feed(self, data):
+        """追加PCM数据，返回累计接收的音频秒数"""
+        if self.closed:
+            raise CustomError('会话已结束')
+        data = data[:len(data) - len(data) % SAMPLE_WIDTH]
+        now = time.time()
+        with self.cond:
+            self.pcm.extend(data)
+            self.received += len(data) // SAMPLE_WIDTH
+            self.arrivals.append((self.received, now))
+            self.last_active = now
+            if self.first_audio_at is None:
+                self.first_audio_at = now
+            self.cond.notify_all()
+            return self.received / SAMPLE_RATE
+
+    def close(self):
+        """音频输入结束，剩余音频生成完后结束输出"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def expire_if_idle(self, now, timeout):
+        """空闲超过timeout且没有正在生成的块时标记中止，返回是否已中止"""
+        with self.cond:
+            if self.rendering or now - self.last_active <= timeout:
+                return False
+            self.closed = True
+            self.aborted = True
+            self.cond.notify_all()
+            return True
+
+    def _arrival_time(self, sample):
+        for total, arrived in self.arrivals:
+            if total >= sample:
+                return arrived
+        return time.time()
+
+    def _next_chunk(self):
+        """
+        等到下一块音频及其lookahead到齐(或输入结束)，
+        返回(起点, 终点, 起始帧, 结束帧, 周期内块序号, 含lookahead的PCM, 终点到达时间)
+        """
+        with self.cond:
+            start = self.base
+            frame_start = self.frames_written
+            position = frame_start % self.cycle
+            clip = bisect.bisect_right(self.bounds, position) - 1
+            frame_end = frame_start + self.bounds[clip + 1] - position
+            end = self._sample_of(frame_end)
+            while not self.closed and self.received < end + self.lookahead_samples:
+                self.cond.wait()
+            if self.aborted:
+                return None
+            if self.received < end:
+                # 输入结束，最后一块不足块长
+                frame_end = int(round(self.received / SAMPLE_RATE * self.fps))
+                end = self.received
+                if frame_end <= frame_start:
+                    return None
+            tail = min(end + self.lookahead_samples, self.received)
+            pcm = bytes(self.pcm[:(tail - start) * SAMPLE_WIDTH])
+            arrived = self._arrival_time(end)
+            del self.pcm[:(end - start) * SAMPLE_WIDTH]
+            self.base = end
+            self.arrivals = [item for item in self.arrivals if item[0] > end]
+            self.rendering = True
+            return start, end, frame_start, frame_end, clip, pcm, arrived
+
+    def _write_wav(self, path, pcm):
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(SAMPLE_WIDTH)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm)
+        return path
+
+    def _read_frames(self, video_path, count):
+        """读取生成视频的前count帧，不足时重复最后一帧"""
+        frames = []
+        cap = cv2.VideoCapture(video_path)
+        try:
+            while len(frames) < count:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                frames.append(frame)
+        finally:
+            cap.release()
+        if not frames:
+            raise CustomError(f"会话视频块无画面: {video_path}")
+        return frames + [frames[-1]] * (count - len(frames))
+
+    def _emit(self, data):
+        """写入有界输出队列，队列满时等待客户端读取，会话中止后丢弃"""
+        while not self.aborted:
+            try:
+                self.output.put(data, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _encode(self, video_path, pcm, frame_end):
+        """把本块帧和音频写入会话mux；帧数按会话起点累计的帧位置计算，块间取整误差不累积"""
+        count = frame_end - self.frames_written
+        frames = self._read_frames(video_path, count)
+        if self.mux is None:
+            height, width = frames[0].shape[:2]
+            self.mux = SessionMux(width, height, self.fps, self._emit)
+        self.mux.write(frames, pcm)
+        self.frames_written = frame_end
+
+    def _render(self, code, wav_path, clip):
+        if self.slot is None:
+            return self.render_fn(code, wav_path, clip)
+        return self.slot.run(self.render_fn, code, wav_path, clip)
+
+    def _run(self):
+        index = 0
+        try:
+            while True:
+                chunk = self._next_chunk()
+                if chunk is None:
+                    break
+                start, end, frame_start, frame_end, clip, pcm, arrived = chunk
+                duration = (end - start) / SAMPLE_RATE
+                render_start = time.time()
+                try:
+                    wav_path = self._write_wav(os.path.join(self.work_dir, f"chunk_{index}.wav"), pcm)
+                    video_path = self._render(f"{self.session_id}-{index}", wav_path, clip)
+                finally:
+                    # 生成期间不算空闲，结束后重新计时
+                    with self.cond:
+                        self.rendering = False
+                        self.last_active = time.time()
+                encode_start = time.time()
+                self._encode(video_path, pcm[:(end - start) * SAMPLE_WIDTH], frame_end)
+                emitted = time.time()
+                for path in (wav_path, video_path):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                if self.first_video_at is None:
+                    self.first_video_at = emitted
+                record = {
+                    'index': index,
+                    'clip': clip,
+                    'audio_seconds': round(duration, 3),
+                    'render_seconds': round(encode_start - render_start, 3),
+                    'encode_seconds': round(emitted - encode_start, 3),
+                    'latency_seconds': round(emitted - arrived, 3),
+                    'rtf': round((emitted - render_start) / duration, 3) if duration > 0 else None,
+                }
+                self.chunks.append(record)
+                logger.info(f"实时会话[{self.session_id}]视频块{index}: {record}")
+                index += 1
+            if self.mux is not None:
+                if self.aborted:
+                    self.mux.abort()
+                else:
+                    self.mux.close()
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            logger.error(f"实时会话[{self.session_id}]异常结束: {e}")
+            if self.mux is not None:
+                self.mux.abort()
+        finally:
+            self.closed = True
+            if self.slot is not None:
+                self.slot.release()
+            self._emit(None)
+
+    def stream(self):
+        """按生成顺序产出MPEG-TS数据，会话结束时停止"""
+        while True:
+            try:
+                data = self.output.get(timeout=1)
+            except queue.Empty:
+                if self.aborted:
+                    break
+                continue
+            if data is None:
+                break
+            self.last_active = time.time()
+            yield data
+
+    def stats(self):
+        chunks = list(self.chunks)
+        audio = sum(c['audio_seconds'] for c in chunks)
+        processing = sum(c['render_seconds'] + c['encode_seconds'] for c in chunks)
+        latencies = sorted(c['latency_seconds'] for c in chunks)
+        return {
+            'session_id': self.session_id,
+            'closed': self.closed,
+            'error': self.error,
+            'chunk_seconds': round(self.chunk_seconds, 3),
+            'received_seconds': round(self.received / SAMPLE_RATE, 3),
+            'generated_seconds': round(audio, 3),
+            'first_chunk_latency': round(self.first_video_at - self.first_audio_at, 3)
+            if self.first_video_at and self.first_audio_at else None,
+            'latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'latency_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+            'rtf': round(processing / audio, 3) if audio > 0 else None,
+            'chunks': chunks[-20:],
+        }
+
+    def cleanup(self):
+        """会话已中止且生成线程退出后删除工作目录"""
+        self.close()
+        self.thread.join()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class SessionManager:
+    """
+    实时会话表，限制同时进行的会话数，长时间无输入输出且没有正在生成的块的会话由后台线程清理；
+    给出concurrency_manager时每个会话预留一个并发槽位，且至少留一个槽位给普通任务
+    """
+
+    def __init__(self, temp_dir, max_sessions=2, idle_timeout=60, min_chunk_seconds=1, lookahead_seconds=0.5,
+                 concurrency_manager=None, max_buffered=64):
+        self.temp_dir = temp_dir
+        self.concurrency_manager = concurrency_manager
+        if concurrency_manager is not None:
+            max_sessions = min(max_sessions, concurrency_manager.max_concurrent_tasks - 1)
+            if max_sessions <= 0:
+                logger.warning("并发数为1，需留给普通任务，实时会话不可用")
+        self.max_sessions = max(0, max_sessions)
+        self.idle_timeout = idle_timeout
+        self.min_chunk_seconds = min_chunk_seconds
+        self.lookahead_seconds = lookahead_seconds
+        self.max_buffered = max_buffered
+        self.sessions = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self._sweep_loop, name='session-sweep', daemon=True).start()
+
+    def create(self, render_fn, bounds, fps):
+        with self.lock:
+            if self.max_sessions == 0:
+                raise CustomError("并发槽位不足，实时会话至少需要2个并发槽位")
+            active = [s for s in self.sessions.values() if not s.closed]
+            if len(active) >= self.max_sessions:
+                raise CustomError(f"实时会话数已达上限{self.max_sessions}")
+            session_id = uuid.uuid4().hex
+            slot = None
+            if self.concurrency_manager is not None:
+                slot = self.concurrency_manager.reserve(f"session-{session_id}")
+            session = RealtimeSession(session_id, render_fn, os.path.join(self.temp_dir, f"session-{session_id}"),
+                                      bounds, fps, self.lookahead_seconds, slot, self.max_buffered)
+            self.sessions[session_id] = session
+            return session
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(10)
+            now = time.time()
+            with self.lock:
+                idle = [sid for sid, s in self.sessions.items() if s.expire_if_idle(now, self.idle_timeout)]
+                removed = [self.sessions.pop(sid) for sid in idle]
+            for session in removed:
+                logger.info(f"实时会话[{session.session_id}]空闲超时，已清理")
+                session.cleanup()
+
+
+def load_session_manager(temp_dir, concurrency_manager=None):
+    """读取[realtime]配置，未启用时返回None"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('realtime', 'enable', fallback=0):
+        return None
+    return SessionManager(temp_dir,
+                          config.getint('realtime', 'max_sessions', fallback=2),
+                          config.getfloat('realtime', 'idle_timeout', fallback=60),
+                          config.getfloat('realtime', 'min_chunk_seconds', fallback=1),
+                          config.getfloat('realtime', 'lookahead_seconds', fallback=0.5),
+                          concurrency_manager,
+                          config.getint('realtime', 'max_buffered', fallback=64))
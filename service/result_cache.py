@@ -0,0 +1,176 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : result_cache.py
+@ide    : PyCharm
+@time   : 2026-10-17 22:04:19
+"""
+import configparser
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from urllib.parse import urlparse
+
+from service.file_fetcher import fetch, is_remote
+from service.fork_server import reinit_after_fork
+from y_utils.logger import logger
+
+META_SUFFIX = '.json'
+# 命中时只在内存里更新访问时间，距上次落盘超过此间隔才重写元数据
+ACCESS_FLUSH_SECONDS = 600
+
+
+def content_key(audio_md5, video_md5, options):
+    """输入内容md5加渲染参数组成缓存key，与任务code、下载地址无关"""
+    payload = json.dumps({'audio': audio_md5, 'video': video_md5, 'options': options}, sort_keys=True)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def localize(url, dest_dir, name):
+    """远程文件下载到dest_dir，保留原扩展名；本地文件直接使用"""
+    if not is_remote(url):
+        return url
+    ext = os.path.splitext(urlparse(url).path)[1]
+    return fetch(url, os.path.join(dest_dir, name + ext))
+
+
+def link_or_copy(src, dst):
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+    return dst
+
+
+class ResultCache:
+    """
+    结果视频缓存，位于result_dir下的子目录，每条为<key>.mp4和<key>.json，
+    命中时硬链接到新任务的结果路径，超出磁盘预算时按最近访问时间淘汰
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+        self.entries = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+        logger.info(f"结果缓存初始化完成: {cache_dir}, 条目数: {len(self.entries)}, "
+                    f"占用: {self.total_bytes() / 1024 ** 2:.1f}MB, 上限: {max_bytes / 1024 ** 2:.1f}MB")
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.mp4'), os.path.join(self.cache_dir, key + META_SUFFIX)
+
+    def _load_index(self):
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(META_SUFFIX):
+                continue
+            key = name[:-len(META_SUFFIX)]
+            video_path, meta_path = self._paths(key)
+            try:
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+                if not os.path.exists(video_path):
+                    raise FileNotFoundError(video_path)
+                self.entries[key] = meta
+            except Exception as e:
+                logger.warning(f"结果缓存条目损坏，删除 {key}: {e}")
+                self._delete_files(key)
+
+    def _delete_files(self, key):
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _read_meta(self, key):
+        video_path, meta_path = self._paths(key)
+        if not os.path.exists(video_path):
+            return None
+        try:
+            with open(meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        meta_path = self._paths(key)[1]
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def total_bytes(self):
+        return sum(meta['size'] for meta in self.entries.values())
+
+    def get(self, key):
+        """命中返回结果元数据（时长、宽高等），未命中返回None"""
+        with self.lock:
+            meta = self.entries.get(key)
+            if meta is None:
+                # 可能由其他进程（如zygote任务子进程）写入
+                meta = self._read_meta(key)
+                if meta is None:
+                    return None
+                self.entries[key] = meta
+            now = time.time()
+            meta['last_access'] = now
+            meta['hits'] = meta.get('hits', 0) + 1
+            if now - meta.get('flushed_access', meta.get('created', 0)) > ACCESS_FLUSH_SECONDS:
+                meta['flushed_access'] = now
+                self._write_meta(key, meta)
+            return dict(meta)
+
+    def materialize(self, key, dest_path):
+        """把缓存结果放到dest_path，同一文件系统内为硬链接，不占额外空间"""
+        return link_or_copy(self._paths(key)[0], dest_path)
+
+    def put(self, key, result_path, info):
+        """保存任务结果，info为需要随结果返回的字段"""
+        video_path, _ = self._paths(key)
+        try:
+            link_or_copy(result_path, video_path)
+            now = time.time()
+            meta = dict(info, key=key, size=os.path.getsize(video_path), created=now, last_access=now, hits=0)
+            with self.lock:
+                self._write_meta(key, meta)
+                self.entries[key] = meta
+                self._evict(keep=key)
+            logger.info(f"任务结果已缓存: {key}, 大小: {meta['size'] / 1024 ** 2:.1f}MB")
+        except Exception as e:
+            logger.warning(f"任务结果缓存失败 {key}: {e}")
+
+    def _evict(self, keep=None):
+        """按最近访问时间淘汰，直到总大小不超过预算，调用方需持有锁"""
+        total = self.total_bytes()
+        for key, meta in sorted(self.entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= meta['size']
+            del self.entries[key]
+            self._delete_files(key)
+            logger.info(f"结果缓存淘汰: {key}, 释放: {meta['size'] / 1024 ** 2:.1f}MB")
+
+
+def load_result_cache(result_dir):
+    """从配置文件加载结果缓存配置，未启用时返回None"""
+    try:
+        config = configparser.ConfigParser()
+        config.read('config/config.ini')
+        if not config.getint('result_cache', 'enable', fallback=0):
+            return None
+        cache_dir = config.get('result_cache', 'cache_dir', fallback=os.path.join(result_dir, 'cache'))
+        max_size_gb = config.getfloat('result_cache', 'max_size_gb', fallback=50)
+        return ResultCache(cache_dir, int(max_size_gb * 1024 ** 3))
+    except Exception as e:
+        logger.warning(f"结果缓存初始化失败，不启用缓存: {e}")
+        return None
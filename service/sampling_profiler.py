@@ -0,0 +1,155 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : sampling_profiler.py
+@ide    : PyCharm
+@time   : 2026-10-17 19:05:48
+"""
+import atexit
+import configparser
+import glob
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from multiprocessing import util
+
+from y_utils.logger import logger
+
+_local = threading.local()
+_child_samplers = []
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """后台线程按固定间隔采样各线程的Python调用栈，按flamegraph的collapsed格式累计次数"""
+
+    def __init__(self, interval=0.005, include=None):
+        self.interval = interval
+        self.include = include
+        self.counts = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                thread = threads.get(ident)
+                if ident == own or thread is None or (self.include is not None and not self.include(thread)):
+                    continue
+                self.counts[f"{thread.name.replace(';', ':')};{collapse(frame)}"] += 1
+            self.samples += 1
+
+    def write(self, path, prefix=''):
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{prefix}{stack} {count}\n")
+
+
+def _part_path(output_dir, code, pid, suffix):
+    return os.path.join(output_dir, f"{code}.profile.{pid}.{suffix}")
+
+
+def _after_fork_in_child():
+    """任务线程fork出的子进程（如写视频进程）继承线程上下文，在子进程内另起采样，退出时写出分片"""
+    info = getattr(_local, 'profile', None)
+    if info is None:
+        return
+    code, output_dir, interval = info
+    pid = os.getpid()
+    pending = _part_path(output_dir, code, pid, 'pending')
+    open(pending, 'w').close()
+    sampler = StackSampler(interval).start()
+
+    def finish(*args):
+        if sampler.stop_event.is_set():
+            return
+        sampler.stop()
+        sampler.write(_part_path(output_dir, code, pid, 'part'), prefix=f"subprocess-{pid};")
+        os.remove(pending)
+
+    # multiprocessing子进程启动时会清空已注册的Finalize，需在其after-fork回调里再注册
+    util.register_after_fork(sampler, lambda obj: util.Finalize(None, finish, exitpriority=20))
+    atexit.register(finish)
+    _child_samplers.append(sampler)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _merge(output_dir, code, result_path, wait_timeout):
+    """等待子进程分片写完后合并为一个collapsed文件"""
+    deadline = time.time() + wait_timeout
+    while glob.glob(_part_path(output_dir, code, '*', 'pending')) and time.time() < deadline:
+        time.sleep(0.1)
+    for pending in glob.glob(_part_path(output_dir, code, '*', 'pending')):
+        logger.warning(f"[{code}]子进程采样未在{wait_timeout}s内结束，已忽略: {pending}")
+        os.remove(pending)
+    with open(result_path, 'a') as out:
+        for part in sorted(glob.glob(_part_path(output_dir, code, '*', 'part'))):
+            with open(part) as f:
+                out.write(f.read())
+            os.remove(part)
+
+
+@contextmanager
+def profile_task(code, output_dir, interval=0.005, wait_timeout=10):
+    """
+    在采样器下执行一个任务：主进程采样当前任务线程及非任务槽位线程（不含其他并发任务），
+    当前线程fork出的子进程各自采样，结束后合并写入output_dir/<code>-profile.collapsed
+    """
+    current = threading.current_thread()
+    sampler = StackSampler(interval, lambda thread: thread is current or not thread.name.startswith('task-slot-'))
+    result_path = os.path.join(output_dir, f"{code}-profile.collapsed")
+    _local.profile = (code, output_dir, interval)
+    start = time.time()
+    sampler.start()
+    try:
+        yield result_path
+    finally:
+        _local.profile = None
+        sampler.stop()
+        try:
+            sampler.write(result_path, prefix='main;')
+            _merge(output_dir, code, result_path, wait_timeout)
+            logger.info(f"[{code}]采样分析完成，耗时{time.time() - start:.1f}s, 主进程采样{sampler.samples}次, "
+                        f"结果: {result_path}")
+        except Exception as e:
+            logger.error(f"[{code}]采样结果写出失败: {e}")
+
+
+def load_profile_interval():
+    """读取[profile]采样间隔，单位秒"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    return config.getfloat('profile', 'interval_ms', fallback=5) / 1000
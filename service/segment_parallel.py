@@ -0,0 +1,157 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : segment_parallel.py
+@ide    : PyCharm
+@time   : 2026-10-18 02:31:44
+"""
+import configparser
+import json
+import math
+import os
+import subprocess
+import wave
+
+from h_utils.custom import CustomError
+from y_utils.logger import logger
+
+SAMPLE_RATE = 16000
+SEGMENT_SUBDIR = 'segments'
+
+
+class Segment:
+    """
+    长音频的一段：[start, end)为本段输出的帧，left/right为前后附带的上下文帧，
+    生成后截掉上下文，只保留本段帧
+    """
+
+    def __init__(self, index, start, end, left, right):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.left = left
+        self.right = right
+
+    @property
+    def frames(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {'index': self.index, 'start': self.start, 'end': self.end, 'left': self.left, 'right': self.right}
+
+
+def plan_segments(total_frames, cycle, max_segments, min_segment_frames, left_context, right_context):
+    """
+    按模板循环周期切分，各段生成时的起点(含左侧上下文)都落在周期的整数倍上，即从模板第0帧开始，
+    段起点本身取周期整数倍之后left_context帧处，左侧上下文始终是left_context帧真实音频；
+    不足min_segment_frames的末段并入前一段
+    """
+    cycles = math.ceil(total_frames / cycle)
+    per_segment = max(math.ceil(cycles / max_segments), math.ceil(min_segment_frames / cycle), 1) * cycle
+    starts = [0] + [k + left_context for k in range(per_segment, total_frames, per_segment)
+                    if k + left_context < total_frames]
+    while len(starts) > 1 and total_frames - starts[-1] < min_segment_frames:
+        starts.pop()
+    segments = []
+    for index, start in enumerate(starts):
+        end = starts[index + 1] if index + 1 < len(starts) else total_frames
+        # 生成起点退到不晚于start-left_context的周期整数倍
+        left = start - (start - min(left_context, start)) // cycle * cycle
+        right = min(right_context, total_frames - end)
+        segments.append(Segment(index, start, end, left, right))
+    return segments
+
+
+def to_wav(audio_path, wav_path):
+    """转为16kHz单声道wav，之后按采样点精确切分"""
+    command = ['ffmpeg', '-loglevel', 'warning', '-y', '-i', audio_path, '-ac', '1', '-ar', str(SAMPLE_RATE),
+               '-f', 'wav', wav_path]
+    if subprocess.run(command).returncode != 0:
+        raise CustomError(f"音频转换失败: {audio_path}")
+    with wave.open(wav_path, 'rb') as f:
+        return f.getnframes() / SAMPLE_RATE
+
+
+def split_audio(wav_path, segments, fps, out_dir):
+    """按段(含上下文)切出音频，返回各段wav路径"""
+    paths = []
+    with wave.open(wav_path, 'rb') as src:
+        total = src.getnframes()
+        for segment in segments:
+            begin = int(round((segment.start - segment.left) * SAMPLE_RATE / fps))
+            finish = min(int(round((segment.end + segment.right) * SAMPLE_RATE / fps)), total)
+            src.setpos(begin)
+            path = os.path.join(out_dir, f"segment_{segment.index}.wav")
+            with wave.open(path, 'wb') as dst:
+                dst.setnchannels(1)
+                dst.setsampwidth(src.getsampwidth())
+                dst.setframerate(SAMPLE_RATE)
+                dst.writeframes(src.readframes(finish - begin))
+            paths.append(path)
+    return paths
+
+
+def _options_path(result_dir, code):
+    return os.path.join(result_dir, SEGMENT_SUBDIR, f"{code}.json")
+
+
+def write_key_frames(result_dir, code, times):
+    """记录分段任务需要强制关键帧的时间点，写视频进程据此编码，截取时可直接复制码流"""
+    path = _options_path(result_dir, code)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'key_frames': times}, f)
+
+
+def load_key_frames(result_dir, code):
+    try:
+        with open(_options_path(result_dir, code), 'r') as f:
+            return json.load(f)['key_frames']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def remove_key_frames(result_dir, code):
+    path = _options_path(result_dir, code)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def segment_key_frames(segment, fps):
+    return [round(segment.left / fps, 6), round((segment.left + segment.frames) / fps, 6)]
+
+
+def concat_segments(videos, segments, fps, audio_path, result_path, work_dir):
+    """各段截掉上下文后无损拼接视频流(不重新编码)，再合成完整音频"""
+    list_path = os.path.join(work_dir, 'segments.txt')
+    with open(list_path, 'w') as f:
+        for video, segment in zip(videos, segments):
+            f.write(f"file '{os.path.abspath(video)}'\n")
+            if segment.left:
+                f.write(f"inpoint {segment.left / fps:.6f}\n")
+            if segment.right:
+                f.write(f"outpoint {(segment.left + segment.frames) / fps:.6f}\n")
+    command = ['ffmpeg', '-loglevel', 'warning', '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+               '-i', audio_path, '-map', '0:v', '-map', '1:a', '-c:v', 'copy', '-c:a', 'aac', '-shortest',
+               '-movflags', '+faststart', result_path]
+    if subprocess.run(command).returncode != 0:
+        raise CustomError("分段视频拼接失败")
+    logger.info(f"分段视频拼接完成: {result_path}, 共{len(segments)}段")
+    return result_path
+
+
+def load_segment_config():
+    """读取[segment_parallel]配置，未启用时返回None"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('segment_parallel', 'enable', fallback=0):
+        return None
+    return {
+        'min_seconds': config.getfloat('segment_parallel', 'min_seconds', fallback=120),
+        'max_segments': config.getint('segment_parallel', 'max_segments', fallback=0),
+        'min_segment_seconds': config.getfloat('segment_parallel', 'min_segment_seconds', fallback=30),
+        'left_context_seconds': config.getfloat('segment_parallel', 'left_context_seconds', fallback=1),
+        'right_context_seconds': config.getfloat('segment_parallel', 'right_context_seconds', fallback=1),
+    }
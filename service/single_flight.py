@@ -0,0 +1,73 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : single_flight.py
+@ide    : PyCharm
+@time   : 2026-10-17 22:40:55
+"""
+import configparser
+import fcntl
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from service.fork_server import reinit_after_fork
+from y_utils.logger import logger
+
+
+class SingleFlight:
+    """进程内按key合并并发调用：第一个调用者执行fn，同时到达的调用者等待同一个Future"""
+
+    def __init__(self, name):
+        self.name = name
+        self.flights = {}
+        self.lock = threading.Lock()
+        reinit_after_fork(self, SingleFlight._after_fork_in_child)
+
+    def _after_fork_in_child(self):
+        # 进行中调用的执行者不在子进程里，等待它的Future不会完成
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """返回(结果, 是否由本次调用执行)"""
+        with self.lock:
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights[key] = Future()
+        if not leader:
+            logger.info(f"{self.name}合并并发请求，等待进行中的结果: {key}")
+            return future.result(), False
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, True
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.flights.pop(key, None)
+
+
+@contextmanager
+def file_lock(path):
+    """基于flock的排他锁，跨线程、跨进程有效（每次加锁单独打开文件）"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def load_single_flight_config():
+    """读取[single_flight]配置，返回是否启用"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    return bool(config.getint('single_flight', 'enable', fallback=1))
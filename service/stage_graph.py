@@ -0,0 +1,114 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : stage_graph.py
+@ide    : PyCharm
+@time   : 2026-10-17 23:12:08
+"""
+import configparser
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from service.metrics import STAGE_DURATION
+from y_utils.logger import logger
+
+
+class StageGraph:
+    """
+    任务内的阶段依赖图：每个阶段在其依赖全部完成后提交到线程池，互不依赖的分支并发执行；
+    阶段函数的参数依次为各依赖阶段的结果。executor为None时按添加顺序在当前线程执行
+    """
+
+    def __init__(self, name, executor=None):
+        self.name = name
+        self.executor = executor
+        self.stages = []
+        self.futures = {}
+        self.costs = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self.futures:
+                raise ValueError(f"阶段{name}依赖的阶段{dep}未定义")
+        if name in self.futures:
+            raise ValueError(f"阶段{name}重复定义")
+        self.stages.append((name, fn, tuple(deps)))
+        self.futures[name] = Future()
+        return self
+
+    def _execute(self, name, fn, deps):
+        future = self.futures[name]
+        if not future.set_running_or_notify_cancel():
+            return
+        start = time.time()
+        try:
+            result = fn(*[self.futures[dep].result() for dep in deps])
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        finally:
+            cost = time.time() - start
+            with self.lock:
+                self.costs[name] = cost
+            STAGE_DURATION.observe(cost, stage=name)
+        future.set_result(result)
+
+    def _schedule(self, name, fn, deps):
+        future = self.futures[name]
+        pending = [len(deps)]
+
+        def on_dep_done(dep_future):
+            error = dep_future.exception()
+            if error is not None:
+                # 依赖失败时本阶段不再执行，异常沿依赖链传递；多个依赖失败时只取最先到达的
+                with self.lock:
+                    if future.done():
+                        return
+                    future.set_running_or_notify_cancel()
+                future.set_exception(error)
+                return
+            with self.lock:
+                pending[0] -= 1
+                ready = pending[0] == 0
+            if ready:
+                self.executor.submit(self._execute, name, fn, deps)
+
+        if not deps:
+            self.executor.submit(self._execute, name, fn, deps)
+        for dep in deps:
+            self.futures[dep].add_done_callback(on_dep_done)
+
+    def run(self):
+        """执行全部阶段并返回{阶段名: 结果}，有阶段失败时抛出最先定义的失败阶段的异常"""
+        start = time.time()
+        if self.executor is None:
+            for name, fn, deps in self.stages:
+                self._execute(name, fn, deps)
+                if self.futures[name].exception() is not None:
+                    # 后续阶段不再执行，取消后等待其结果的调用方不会一直阻塞
+                    for future in self.futures.values():
+                        future.cancel()
+                    break
+        else:
+            for name, fn, deps in self.stages:
+                self._schedule(name, fn, deps)
+        try:
+            return {name: self.futures[name].result() for name, _, _ in self.stages}
+        finally:
+            with self.lock:
+                costs = ', '.join(f"{name} {cost:.2f}s" for name, cost in self.costs.items())
+            logger.info(f"[{self.name}]阶段耗时: {costs}, 总计 {time.time() - start:.2f}s")
+
+
+def load_stage_executor():
+    """读取[stage_graph]配置，启用时返回各任务共用的阶段线程池，否则返回None（阶段顺序执行）"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('stage_graph', 'enable', fallback=0):
+        return None
+    return ThreadPoolExecutor(max_workers=config.getint('stage_graph', 'workers', fallback=8),
+                              thread_name_prefix='stage')
@@ -0,0 +1,124 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : streaming_bnf.py
+@ide    : PyCharm
+@time   : 2026-10-18 00:21:47
+"""
+import configparser
+import functools
+
+import torch
+
+from service.instrumentation import patch
+from y_utils.logger import logger
+
+SAMPLE_RATE = 16000
+# PPGModel的fbank为25ms帧长、10ms帧移
+FRAME_LENGTH = 400
+FRAME_SHIFT = 160
+
+
+class StreamingBNFExtractor:
+    """
+    分块流式提取wenet BNF：音频按块计算fbank，Conformer编码器按chunk调用forward_chunk，
+    注意力和卷积状态在chunk间缓存，每个chunk算完即产出对应的特征窗口；
+    left_chunks限制注意力缓存长度，内存与音频总长无关
+    """
+
+    def __init__(self, model, chunk_size=16, left_chunks=8):
+        self.model = model
+        self.encoder = model.encoder
+        self.chunk_size = chunk_size
+        self.required_cache_size = chunk_size * left_chunks if left_chunks >= 0 else -1
+        subsampling = self.encoder.embed.subsampling_rate
+        self.context = self.encoder.embed.right_context + 1
+        self.stride = subsampling * chunk_size
+        self.window = (chunk_size - 1) * subsampling + self.context
+        self.reset()
+
+    def reset(self):
+        self.samples = None
+        self.feats = None
+        self.offset = 0
+        self.subsampling_cache = None
+        self.elayers_output_cache = None
+        self.conformer_cnn_cache = None
+
+    def _fbank(self, wav):
+        feats, _ = self.model._extract_feats(wav, torch.LongTensor([wav.size(1)]).to(wav.device))
+        return feats
+
+    def _encode(self, chunk):
+        (out, self.subsampling_cache, self.elayers_output_cache,
+         self.conformer_cnn_cache) = self.encoder.forward_chunk(chunk, self.offset, self.required_cache_size,
+                                                                self.subsampling_cache, self.elayers_output_cache,
+                                                                self.conformer_cnn_cache)
+        self.offset += out.size(1)
+        return out
+
+    def accept(self, wav):
+        """输入一段音频(1, 采样点)，返回已能确定的特征窗口列表，每个为(1, 帧数, 维度)"""
+        self.samples = wav if self.samples is None else torch.cat([self.samples, wav], dim=1)
+        if self.samples.size(1) < FRAME_LENGTH:
+            return []
+        # 只计算完整帧，剩余采样点与下一段拼接，分块结果与整段计算的帧对齐
+        frames = (self.samples.size(1) - FRAME_LENGTH) // FRAME_SHIFT + 1
+        consumed = frames * FRAME_SHIFT
+        feats = self._fbank(self.samples[:, :consumed + FRAME_LENGTH - FRAME_SHIFT])
+        self.samples = self.samples[:, consumed:]
+        self.feats = feats if self.feats is None else torch.cat([self.feats, feats], dim=1)
+        outputs = []
+        with torch.no_grad():
+            while self.feats.size(1) >= self.window:
+                outputs.append(self._encode(self.feats[:, :self.window]))
+                self.feats = self.feats[:, self.stride:]
+        return outputs
+
+    def finish(self):
+        """音频结束，处理剩余不足一个chunk的帧"""
+        outputs = []
+        with torch.no_grad():
+            while self.feats is not None and self.feats.size(1) >= self.context:
+                outputs.append(self._encode(self.feats[:, :self.window]))
+                self.feats = self.feats[:, self.stride:]
+        self.reset()
+        return outputs
+
+    def stream(self, wav, block_seconds=10):
+        """整段音频(1, 采样点)按block_seconds分块送入，逐个产出特征窗口"""
+        block = int(block_seconds * SAMPLE_RATE)
+        for start in range(0, wav.size(1), block):
+            yield from self.accept(wav[:, start:start + block])
+        yield from self.finish()
+
+
+def install_streaming_bnf(chunk_size=16, left_chunks=8, min_seconds=60, block_seconds=10):
+    """长于min_seconds的单条音频，PPGModel.forward改为分块流式编码后拼接，降低长音频的峰值内存"""
+    def wrap(forward):
+        @functools.wraps(forward)
+        def wrapper(self, wav, wav_length, *args, **kwargs):
+            if args or kwargs or wav.dim() != 2 or wav.size(0) != 1 or wav.size(1) < min_seconds * SAMPLE_RATE:
+                return forward(self, wav, wav_length, *args, **kwargs)
+            extractor = StreamingBNFExtractor(self, chunk_size, left_chunks)
+            wav = wav[:, :int(wav_length[0])]
+            return torch.cat(list(extractor.stream(wav, block_seconds)), dim=1)
+        return wrapper
+
+    if patch('wenet.compute_ctc_att_bnf', 'PPGModel.forward', wrap, '_streaming'):
+        logger.info(f"BNF流式提取已启用: chunk {chunk_size}, 左侧缓存{left_chunks}个chunk, 音频长于{min_seconds}s时使用")
+
+
+def load_streaming_bnf_config():
+    """读取[streaming_bnf]配置并按需启用"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('streaming_bnf', 'enable', fallback=0):
+        return False
+    install_streaming_bnf(config.getint('streaming_bnf', 'chunk_size', fallback=16),
+                          config.getint('streaming_bnf', 'left_chunks', fallback=8),
+                          config.getfloat('streaming_bnf', 'min_seconds', fallback=60),
+                          config.getfloat('streaming_bnf', 'block_seconds', fallback=10))
+    return True
@@ -0,0 +1,152 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : template_loop.py
+@ide    : PyCharm
+@time   : 2026-10-18 01:34:09
+"""
+import configparser
+import os
+import shutil
+import threading
+
+import cv2
+import numpy as np
+
+from service.video_writer import FFmpegPipeWriter
+
+
+def read_video_info(video_path):
+    """返回模板视频(帧数, fps)"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    finally:
+        cap.release()
+    return frame_count, fps
+
+
+def loop_cycle(frame_count, mode='pingpong'):
+    """
+    音频长于模板时模板循环播放，返回循环一周的帧数：pingpong为正放再倒放(首尾帧不重复)，forward为从头重放；
+    从周期整数倍处切开的每一段都从模板第0帧开始，与整段生成时的画面一致
+    """
+    if mode == 'pingpong' and frame_count > 1:
+        return 2 * frame_count - 2
+    return max(frame_count, 1)
+
+
+def template_frame_index(index, frame_count, mode='pingpong'):
+    """输出视频第index帧使用的模板帧序号，周期与loop_cycle一致"""
+    cycle = loop_cycle(frame_count, mode)
+    position = index % cycle
+    return position if position < frame_count else cycle - position
+
+
+def cycle_bounds(cycle, min_frames):
+    """
+    把一个循环周期均分为若干块，每块不短于min_frames帧(周期更短时整周期为一块)，
+    返回各块在周期内的起点帧序号，末项为周期帧数
+    """
+    count = max(1, cycle // max(1, min_frames))
+    return [int(round(i * cycle / count)) for i in range(count + 1)]
+
+
+def _decode(video_path, frame_count, path):
+    """模板全部帧解码到磁盘上的内存映射数组，避免长模板整段占用内存"""
+    cap = cv2.VideoCapture(video_path)
+    frames = None
+    count = 0
+    try:
+        while count < frame_count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if frames is None:
+                frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                                   shape=(frame_count,) + frame.shape)
+            frames[count] = frame
+            count += 1
+    finally:
+        cap.release()
+    if frames is None:
+        raise ValueError(f"模板视频无画面: {video_path}")
+    return frames, count
+
+
+def write_loop_clips(video_path, out_dir, bounds, extra_frames, audio_path, mode='pingpong'):
+    """
+    为周期内的每一块写出一段短模板：第j段按循环顺序从周期位置bounds[j]开始，长度为块长加extra_frames(右侧上下文)；
+    生成时从片段第0帧开始，画面与整段生成时该位置一致。片段写在out_dir下，已存在时直接返回路径列表
+    """
+    paths = [os.path.join(out_dir, f"clip_{j}.mp4") for j in range(len(bounds) - 1)]
+    if all(os.path.exists(path) for path in paths):
+        return paths
+    frame_count, fps = read_video_info(video_path)
+    tmp_dir = f"{out_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        frames, decoded = _decode(video_path, frame_count, os.path.join(tmp_dir, 'frames.npy'))
+        height, width = frames.shape[1:3]
+        for j, path in enumerate(paths):
+            writer = FFmpegPipeWriter(os.path.join(tmp_dir, os.path.basename(path)), audio_path, width, height, fps,
+                                      preset='veryfast', crf=10)
+            try:
+                for k in range(bounds[j], bounds[j + 1] + extra_frames):
+                    writer.write(frames[min(template_frame_index(k, frame_count, mode), decoded - 1)])
+                writer.close()
+            except Exception:
+                writer.abort()
+                raise
+        del frames
+        os.remove(os.path.join(tmp_dir, 'frames.npy'))
+        try:
+            os.rename(tmp_dir, out_dir)
+        except OSError:
+            # 其他会话已同时写好
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return paths
+
+
+def _thumbs(video_path, size=32, limit=None):
+    cap = cv2.VideoCapture(video_path)
+    thumbs = []
+    try:
+        while limit is None or len(thumbs) < limit:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            thumbs.append(cv2.resize(gray, (size, size)).astype(np.float32).ravel())
+    finally:
+        cap.release()
+    return np.stack(thumbs) if thumbs else np.zeros((0, size * size), np.float32)
+
+
+def match_loop_mode(result_path, template_path, max_frames=None):
+    """
+    把生成结果的每一帧匹配到最相似的模板帧(缩略灰度图的均方差，嘴部变化远小于整帧差异)，
+    返回各循环方式下预测序号与匹配序号一致的比例，用于核对loop_cycle与推理服务实际的循环方式
+    """
+    template = _thumbs(template_path)
+    result = _thumbs(result_path, limit=max_frames)
+    if len(template) == 0 or len(result) == 0:
+        return {}
+    matched = [int(np.argmin(((template - thumb) ** 2).mean(axis=1))) for thumb in result]
+    return {
+        mode: sum(matched[i] == template_frame_index(i, len(template), mode) for i in range(len(matched)))
+        / len(matched)
+        for mode in ('pingpong', 'forward')
+    }
+
+
+def load_loop_mode():
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    return config.get('template_loop', 'mode', fallback='pingpong')
@@ -0,0 +1,259 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : tracing.py
+@ide    : PyCharm
+@time   : 2026-10-17 18:20:14
+"""
+import configparser
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from service.fork_server import reinit_after_fork
+from service.instrumentation import STAGE_HOOKS, ProcessRelay, patch
+from y_utils.logger import logger
+
+# 阶段之外额外记录的模型调用和编码
+TRACE_HOOKS = STAGE_HOOKS + (
+    ('model_lib.base_wrapper.onnx_model', 'ONNXModel.forward', 'model'),
+    ('service.video_writer', 'FFmpegPipeWriter.write', 'encoding'),
+    ('service.video_writer', 'FFmpegPipeWriter.close', 'encoding'),
+)
+# 逐帧调用的钩子不逐次记录，同一线程窗口内的调用合并为一个span
+PER_FRAME_HOOKS = ('ONNXModel.forward', 'FFmpegPipeWriter.write')
+
+_local = threading.local()
+
+
+class _TaskTrace:
+    def __init__(self, code, max_spans):
+        self.code = code
+        self.start = time.time()
+        self.end = None
+        self.spans = deque(maxlen=max_spans)
+
+
+class TraceStore:
+    """
+    主进程内保存最近max_tasks个任务的span；没有任务上下文的span（如常驻模型子进程内的调用）
+    放入公共队列，导出时按任务起止时间归入
+    """
+
+    def __init__(self, max_tasks=20, max_spans=5000):
+        self.max_tasks = max_tasks
+        self.max_spans = max_spans
+        self.tasks = OrderedDict()
+        self.unattributed = deque(maxlen=max_spans)
+        self.threads = {}
+        self.lock = threading.Lock()
+        reinit_after_fork(self)
+
+    def begin(self, code, ts):
+        with self.lock:
+            self.tasks.pop(code, None)
+            trace = self.tasks[code] = _TaskTrace(code, self.max_spans)
+            trace.start = ts
+            while len(self.tasks) > self.max_tasks:
+                self.tasks.popitem(last=False)
+
+    def finish(self, code, ts):
+        with self.lock:
+            trace = self.tasks.get(code)
+            if trace is not None:
+                trace.end = ts
+
+    def add(self, span):
+        task, name, cat, ts, dur, pid, tid, thread_name, args = span
+        with self.lock:
+            self.threads[(pid, tid)] = thread_name
+            trace = self.tasks.get(task) if task is not None else None
+            if trace is not None:
+                trace.spans.append(span)
+            else:
+                self.unattributed.append(span)
+
+    def export(self, code):
+        """返回Chrome trace格式的dict，任务不存在时返回None"""
+        with self.lock:
+            trace = self.tasks.get(code)
+            if trace is None:
+                return None
+            start_us = trace.start * 1e6
+            end_us = (trace.end or time.time()) * 1e6
+            spans = list(trace.spans)
+            spans += [span for span in self.unattributed if span[3] < end_us and span[3] + span[4] > start_us]
+            threads = dict(self.threads)
+        events = []
+        seen = set()
+        for task, name, cat, ts, dur, pid, tid, thread_name, args in spans:
+            args = dict(args)
+            if task is None:
+                args['attributed'] = False
+            events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': ts, 'dur': dur, 'pid': pid, 'tid': tid,
+                           'args': args})
+            seen.add((pid, tid))
+        for pid in sorted({pid for pid, _ in seen}):
+            label = 'main' if pid == os.getpid() else f'subprocess {pid}'
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': label}})
+        for pid, tid in sorted(seen):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': threads.get((pid, tid), str(tid))}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'code': code, 'start': trace.start, 'end': trace.end}}
+
+
+_store = TraceStore()
+
+
+def _receive(item):
+    kind, value = item
+    if kind == 'span':
+        _store.add(value)
+    elif kind == 'begin':
+        _store.begin(*value)
+    else:
+        _store.finish(*value)
+
+
+# 模型子进程、写视频子进程、zygote任务子进程由fork创建，记录汇总到主进程
+_relay = ProcessRelay('trace', _receive)
+
+
+def current_task():
+    return getattr(_local, 'task', None)
+
+
+@contextmanager
+def task_context(code):
+    """当前线程进入任务上下文，线程内及其fork出的子进程中的span都归属该任务"""
+    previous = current_task()
+    _local.task = code
+    _emit('begin', (code, time.time()))
+    try:
+        with span('task', cat='task', code=code):
+            yield
+    finally:
+        _flush_aggregates()
+        _emit('finish', (code, time.time()))
+        _local.task = previous
+
+
+def _emit(kind, value):
+    if _relay.is_local():
+        _receive((kind, value))
+    else:
+        _relay.send((kind, value))
+
+
+@contextmanager
+def span(name, cat='stage', **args):
+    start = time.time()
+    perf_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        dur = (time.perf_counter() - perf_start) * 1e6
+        thread = threading.current_thread()
+        _emit('span', (current_task(), name, cat, start * 1e6, dur, os.getpid(), thread.ident, thread.name, args))
+
+
+def traced(name, cat):
+    """用span包装函数"""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, cat):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+class _Aggregate:
+    def __init__(self, task, start):
+        self.task = task
+        self.start = start
+        self.end = start
+        self.busy = 0
+        self.calls = 0
+
+
+def _emit_aggregate(name, cat, agg):
+    thread = threading.current_thread()
+    _emit('span', (agg.task, name, cat, agg.start * 1e6, (agg.end - agg.start) * 1e6, os.getpid(), thread.ident,
+                   thread.name, {'calls': agg.calls, 'busy_ms': round(agg.busy * 1000, 3)}))
+
+
+def _flush_aggregates():
+    """输出当前线程未满窗口的合并span，任务结束时调用"""
+    aggregates = getattr(_local, 'aggregates', None)
+    if aggregates:
+        for (name, cat), agg in aggregates.items():
+            _emit_aggregate(name, cat, agg)
+        aggregates.clear()
+
+
+def aggregated(name, cat, window):
+    """
+    逐帧调用合并记录：同一线程、同一任务window秒内的调用输出为一个span，args带调用次数和实际耗时；
+    不在任务线程内的调用（如模型子进程）在下次调用或窗口结束后输出
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            perf_start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                busy = time.perf_counter() - perf_start
+                aggregates = _local.__dict__.setdefault('aggregates', {})
+                task = current_task()
+                agg = aggregates.get((name, cat))
+                if agg is not None and (agg.task != task or start - agg.start > window):
+                    _emit_aggregate(name, cat, agg)
+                    agg = None
+                if agg is None:
+                    agg = aggregates[(name, cat)] = _Aggregate(task, start)
+                agg.end = start + busy
+                agg.busy += busy
+                agg.calls += 1
+        return wrapper
+    return wrap
+
+
+def export_trace(code):
+    return _store.export(code)
+
+
+def install_tracing(max_tasks=20, max_spans=5000, aggregate_ms=1000):
+    """给各阶段和模型调用加span，需在模型子进程启动前调用；每个任务最多保留max_spans个span"""
+    _store.max_tasks = max_tasks
+    _store.max_spans = max_spans
+    _store.unattributed = deque(_store.unattributed, maxlen=max_spans)
+    _relay.start()
+    for module_name, qualname, cat in TRACE_HOOKS:
+        if qualname in PER_FRAME_HOOKS:
+            wrapper = aggregated(qualname, cat, aggregate_ms / 1000)
+        else:
+            wrapper = traced(qualname, cat)
+        patch(module_name, qualname, wrapper, '_traced')
+    logger.info(f"任务追踪已启用，保留最近{max_tasks}个任务，每个任务最多{max_spans}个span，"
+                f"逐帧调用按{aggregate_ms}ms合并")
+
+
+def load_trace_config():
+    """读取[trace]配置并按需启用"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    if not config.getint('trace', 'enable', fallback=0):
+        return False
+    install_tracing(config.getint('trace', 'max_tasks', fallback=20),
+                    config.getint('trace', 'max_spans', fallback=5000),
+                    config.getint('trace', 'aggregate_ms', fallback=1000))
+    return True
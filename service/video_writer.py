@@ -0,0 +1,123 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : video_writer.py
+@ide    : PyCharm
+@time   : 2026-10-17 13:20:45
+"""
+import configparser
+import os
+import subprocess
+
+import cv2
+import numpy as np
+
+from h_utils.custom import CustomError
+from y_utils.logger import logger
+
+# 水印在右下角，数字人标识在右上角
+WATERMARK_OVERLAY = 'overlay=(main_w-overlay_w)-10:(main_h-overlay_h)-10'
+DIGITAL_AUTH_OVERLAY = 'overlay=(main_w-overlay_w)-10:10'
+HLS_PLAYLIST = 'index.m3u8'
+
+
+def load_encode_config():
+    """从配置文件读取x264编码参数"""
+    config = configparser.ConfigParser()
+    config.read('config/config.ini')
+    preset = config.get('video', 'preset', fallback='medium')
+    crf = config.getint('video', 'crf', fallback=15)
+    return preset, crf
+
+
+def hls_output(result_path, hls_dir, segment_seconds):
+    """
+    tee输出：完整mp4之外同时写fMP4分片的HLS播放列表，按分片时长强制关键帧，
+    边生成边产出分片；HLS写入失败不影响mp4
+    """
+    hls = ':'.join([
+        'f=hls', 'onfail=ignore', f'hls_time={segment_seconds}', 'hls_list_size=0', 'hls_playlist_type=event',
+        'hls_segment_type=fmp4', 'hls_flags=independent_segments', 'hls_fmp4_init_filename=init.mp4',
+        f"hls_segment_filename={os.path.join(hls_dir, 'seg_%05d.m4s')}",
+    ])
+    args = ['-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})', '-flags', '+global_header', '-f', 'tee']
+    return args, f"[f=mp4]{result_path}|[{hls}]{os.path.join(hls_dir, HLS_PLAYLIST)}"
+
+
+def build_command(result_path, audio_path, width, height, fps, watermark_path=None, digital_auth_path=None,
+                  preset='medium', crf=15, loglevel='warning', output_args=None, hls_dir=None, segment_seconds=2):
+    """组装ffmpeg命令：stdin读取bgr24原始帧，叠加水印/数字人标识，编码H.264并合成音频，给出hls_dir时同时输出HLS"""
+    command = ['ffmpeg', '-loglevel', loglevel, '-y',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+               '-i', audio_path]
+    overlays = []
+    if watermark_path:
+        command += ['-i', watermark_path]
+        overlays.append(WATERMARK_OVERLAY)
+    if digital_auth_path:
+        command += ['-i', digital_auth_path]
+        overlays.append(DIGITAL_AUTH_OVERLAY)
+    if overlays:
+        label = '[0:v]'
+        filters = []
+        for i, overlay in enumerate(overlays):
+            out_label = '[v]' if i == len(overlays) - 1 else f'[v{i}]'
+            filters.append(f'{label}[{i + 2}:v]{overlay}{out_label}')
+            label = out_label
+        command += ['-filter_complex', ';'.join(filters), '-map', '[v]']
+    else:
+        command += ['-map', '0:v']
+    command += ['-map', '1:a',
+                '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-strict', '-2']
+    if output_args:
+        command += output_args
+    if hls_dir is not None:
+        args, result_path = hls_output(result_path, hls_dir, segment_seconds)
+        command += args
+    command.append(result_path)
+    return command
+
+
+class FFmpegPipeWriter:
+    """常驻ffmpeg进程写视频，帧直接写入stdin，一次编码完成，不再落地mp4v临时文件"""
+
+    def __init__(self, result_path, audio_path, width, height, fps, watermark_path=None, digital_auth_path=None,
+                 preset=None, crf=None, output_args=None, hls_dir=None, segment_seconds=2):
+        if preset is None or crf is None:
+            default_preset, default_crf = load_encode_config()
+            preset = preset or default_preset
+            crf = default_crf if crf is None else crf
+        self.result_path = result_path
+        self.width = width
+        self.height = height
+        self.frame_count = 0
+        self.command = build_command(result_path, audio_path, width, height, fps, watermark_path,
+                                     digital_auth_path, preset, crf, output_args=output_args, hls_dir=hls_dir,
+                                     segment_seconds=segment_seconds)
+        logger.info("command:{}".format(' '.join(self.command)))
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        if frame.shape[0] != self.height or frame.shape[1] != self.width:
+            frame = cv2.resize(frame, (self.width, self.height))
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except BrokenPipeError:
+            raise CustomError("ffmpeg进程异常退出，返回码: {}".format(self.process.poll()))
+        self.frame_count += 1
+
+    def close(self):
+        """关闭stdin等待ffmpeg完成封装"""
+        self.process.stdin.close()
+        ret = self.process.wait()
+        if ret != 0:
+            raise CustomError("ffmpeg编码失败，返回码: {}".format(ret))
+        return self.result_path
+
+    def abort(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
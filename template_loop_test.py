@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板循环周期校验
+分段并行生成和实时会话都按loop_cycle的周期切块，周期与推理服务实际的循环方式不一致时，
+块与块的接缝处画面会跳变。先核对loop_cycle/template_frame_index自身的一致性，
+再用一段真实的生成结果(音频时长超过模板两倍，覆盖至少一次完整循环)逐帧匹配模板帧，核对配置的循环方式
+
+python template_loop_test.py
+python template_loop_test.py --template example/video.mp4 --result result/1004-r.mp4
+"""
+import argparse
+import sys
+
+from service.template_loop import load_loop_mode, loop_cycle, template_frame_index
+
+
+def check_cycle():
+    """周期的整数倍处都回到模板第0帧；pingpong相邻帧序号始终相差1，折返处不重复首尾帧"""
+    for frame_count in (1, 2, 3, 10, 251):
+        for mode in ('pingpong', 'forward'):
+            cycle = loop_cycle(frame_count, mode)
+            indexes = [template_frame_index(i, frame_count, mode) for i in range(cycle * 3)]
+            assert all(0 <= index < frame_count for index in indexes), (frame_count, mode)
+            assert all(indexes[k * cycle] == 0 for k in range(3)), (frame_count, mode)
+            assert indexes[:cycle] * 3 == indexes, (frame_count, mode)
+            if mode == 'pingpong' and frame_count > 1:
+                steps = [abs(indexes[i + 1] - indexes[i]) for i in range(len(indexes) - 1)]
+                assert all(step == 1 for step in steps), (frame_count, mode)
+                assert indexes[frame_count - 1] == frame_count - 1, (frame_count, mode)
+    assert [template_frame_index(i, 4, 'pingpong') for i in range(8)] == [0, 1, 2, 3, 2, 1, 0, 1]
+    assert [template_frame_index(i, 4, 'forward') for i in range(6)] == [0, 1, 2, 3, 0, 1]
+    print("✅ loop_cycle/template_frame_index自检通过")
+
+
+def check_output(template_path, result_path, mode, threshold):
+    from service.template_loop import match_loop_mode, read_video_info
+
+    frame_count, _ = read_video_info(template_path)
+    scores = match_loop_mode(result_path, template_path)
+    if not scores:
+        print("❌ 无法读取模板或生成结果")
+        return False
+    print(f"模板{frame_count}帧，各循环方式与生成结果的逐帧吻合率: "
+          + ', '.join(f"{name}: {score * 100:.1f}%" for name, score in scores.items()))
+    best = max(scores, key=scores.get)
+    if best != mode or scores[mode] < threshold:
+        print(f"❌ 配置的循环方式为{mode}，与生成结果最吻合的是{best}，请修改[template_loop] mode")
+        return False
+    print(f"✅ 配置的循环方式{mode}与生成结果一致，周期{loop_cycle(frame_count, mode)}帧")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模板循环周期校验')
+    parser.add_argument('--template', help='模板视频')
+    parser.add_argument('--result', help='用该模板和超过模板两倍时长的音频生成的结果视频')
+    parser.add_argument('--mode', default=None, help='待校验的循环方式，默认读取配置')
+    parser.add_argument('--threshold', type=float, default=0.9, help='逐帧吻合率下限')
+    opt = parser.parse_args()
+    check_cycle()
+    if opt.template and opt.result:
+        if not check_output(opt.template, opt.result, opt.mode or load_loop_mode(), opt.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : conftest.py
+@ide    : PyCharm
+@time   : 2026-10-17 23:40:12
+"""
+import os
+import sys
+
+# 在项目根目录外执行pytest时也能导入service等包
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
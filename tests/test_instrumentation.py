@@ -0,0 +1,111 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : test_instrumentation.py
+@ide    : PyCharm
+@time   : 2026-10-18 01:24:10
+"""
+import os
+import struct
+import threading
+import time
+
+import pytest
+
+from service.instrumentation import PIPE_BUF, ProcessRelay
+
+
+class Collector:
+    def __init__(self):
+        self.items = []
+        self.lock = threading.Lock()
+
+    def __call__(self, item):
+        with self.lock:
+            self.items.append(item)
+
+    def wait(self, count, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                if len(self.items) >= count:
+                    return list(self.items)
+            time.sleep(0.01)
+        return list(self.items)
+
+
+def payload(child, i):
+    # 长度不一的数据，让消息边界落在读缓冲区的不同位置
+    return child, i, 'x' * (i % 97)
+
+
+def test_messages_fit_pipe_buf_and_round_trip():
+    collector = Collector()
+    relay = ProcessRelay('test', collector)
+    items = [payload(0, i) for i in range(300)]
+    messages = list(relay._messages(items))
+    assert len(messages) > 1
+    for message in messages:
+        assert len(message) <= PIPE_BUF
+        size = struct.unpack_from('<I', message)[0]
+        assert size == len(message) - 4
+        relay._dispatch(message[4:])
+    assert collector.items == items
+
+
+def test_oversized_item_dropped_others_kept():
+    collector = Collector()
+    relay = ProcessRelay('test', collector)
+    items = [('small', 1), ('big', 'x' * PIPE_BUF), ('small', 2)]
+    for message in relay._messages(items):
+        relay._dispatch(message[4:])
+    assert collector.items == [('small', 1), ('small', 2)]
+
+
+def test_handler_error_does_not_stop_dispatch():
+    received = []
+
+    def handler(item):
+        if item == 'bad':
+            raise ValueError(item)
+        received.append(item)
+
+    relay = ProcessRelay('test', handler)
+    for message in relay._messages(['a', 'bad', 'b']):
+        relay._dispatch(message[4:])
+    assert received == ['a', 'b']
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='需要fork')
+def test_forked_children_share_pipe_without_corruption():
+    collector = Collector()
+    relay = ProcessRelay('test', collector)
+    relay.start()
+    assert relay.is_local()
+    children, count = 4, 2000
+    pids = []
+    for child in range(children):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                assert not relay.is_local()
+                for i in range(count):
+                    relay.outbox.append(payload(child, i))
+                    if i % 300 == 0:
+                        relay.flush()
+                relay.flush()
+            except BaseException:
+                code = 1
+            os._exit(code)
+        pids.append(pid)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+    items = collector.wait(children * count)
+    assert len(items) == children * count
+    for child in range(children):
+        # 同一子进程的数据保持发送顺序
+        assert [item for item in items if item[0] == child] == [payload(child, i) for i in range(count)]
+    assert relay.dropped == 0
@@ -0,0 +1,84 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : test_job_store.py
+@ide    : PyCharm
+@time   : 2026-10-17 23:41:05
+"""
+import time
+
+from service.job_store import MemoryJobStore, SQLiteJobStore
+
+
+def running(value):
+    return value[0] == 'run'
+
+
+def restore(code, value):
+    if value[0] == 'run':
+        return ['error', value[1], '', '服务重启，任务已中断']
+    return value
+
+
+def test_expire_drops_stale_finished_jobs():
+    store = MemoryJobStore(ttl=10, sweep_interval=3600, is_active=running)
+    store['a'] = ['success', 100, 'a.mp4']
+    now = time.time()
+    assert store.expire(now + 5) == 0
+    assert store.expire(now + 11) == 1
+    assert 'a' not in store
+
+
+def test_running_job_updated_in_place_survives_ttl():
+    store = MemoryJobStore(ttl=10, sweep_interval=3600, is_active=running)
+    store['a'] = ['run', 0, '']
+    now = time.time()
+    # 编译模块只原地修改进度，不经过__setitem__
+    for step in range(1, 6):
+        store['a'][1] = step * 10
+        assert store.expire(now + step * 30) == 0
+        assert store['a'][1] == step * 10
+    store['a'][0] = 'success'
+    # 结束后从最后一次检查运行时起算ttl
+    assert store.expire(now + 155) == 0
+    assert store.expire(now + 161) == 1
+    assert 'a' not in store
+
+
+def test_status_index_follows_in_place_updates():
+    store = MemoryJobStore(sweep_interval=3600)
+    store['a'] = ['run', 0, '']
+    store['b'] = ['run', 0, '']
+    store['a'][0] = 'success'
+    assert store.codes_by_status('run') == ['b']
+    assert store.codes_by_status('success') == ['a']
+    assert store.status_counts() == {'run': 1, 'success': 1}
+
+
+def test_sqlite_store_persists_and_restores(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    store = SQLiteJobStore(path, sweep_interval=3600, flush_interval=3600, on_restore=restore, is_active=running)
+    store['done'] = ['success', 100, 'done.mp4']
+    store['live'] = ['run', 0, '']
+    store['gone'] = ['success', 100, 'gone.mp4']
+    store.flush()
+    store['live'][1] = 42
+    del store['gone']
+    store.flush()
+
+    reopened = SQLiteJobStore(path, sweep_interval=3600, flush_interval=3600, on_restore=restore)
+    assert reopened['done'] == ['success', 100, 'done.mp4']
+    assert reopened['live'] == ['error', 42, '', '服务重启，任务已中断']
+    assert 'gone' not in reopened
+
+
+def test_sqlite_restore_skips_expired_rows(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    store = SQLiteJobStore(path, ttl=10, sweep_interval=3600, flush_interval=3600)
+    store['old'] = ['success', 100, 'old.mp4']
+    store.updated['old'] = time.time() - 60
+    store.flush()
+    reopened = SQLiteJobStore(path, ttl=10, sweep_interval=3600, flush_interval=3600)
+    assert 'old' not in reopened
@@ -0,0 +1,67 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : test_segment_parallel.py
+@ide    : PyCharm
+@time   : 2026-10-18 00:12:37
+"""
+import pytest
+
+from service.segment_parallel import plan_segments
+
+
+def check_plan(segments, total_frames, cycle, left_context, right_context):
+    assert segments[0].start == 0 and segments[0].left == 0
+    assert segments[-1].end == total_frames and segments[-1].right == 0
+    for prev, segment in zip(segments, segments[1:]):
+        assert prev.end == segment.start
+        assert prev.right == min(right_context, total_frames - prev.end)
+    for segment in segments:
+        assert segment.frames > 0
+        # 生成起点(含左侧上下文)对齐周期，与整段生成时的模板帧一致
+        assert (segment.start - segment.left) % cycle == 0
+        if segment.index:
+            assert segment.left >= left_context
+
+
+def test_long_cycle_keeps_left_context():
+    # 10s pingpong模板周期498帧，超过原先整周期上下文的上限
+    segments = plan_segments(3000, 498, 4, 750, 25, 25)
+    check_plan(segments, 3000, 498, 25, 25)
+    assert [segment.left for segment in segments] == [0, 25, 25]
+
+
+def test_boundaries_follow_cycle_plus_context():
+    segments = plan_segments(3000, 498, 4, 750, 25, 25)
+    assert [(segment.start, segment.end) for segment in segments] == [(0, 1021), (1021, 2017), (2017, 3000)]
+
+
+def test_short_tail_merged_into_previous():
+    # 2017起的末段只有83帧，并入前一段
+    segments = plan_segments(2100, 498, 4, 250, 25, 25)
+    assert [(segment.start, segment.end) for segment in segments] == [(0, 1021), (1021, 2100)]
+
+
+def test_segments_respect_min_length():
+    segments = plan_segments(2010, 498, 2, 300, 25, 25)
+    check_plan(segments, 2010, 498, 25, 25)
+    assert all(segment.frames >= 300 for segment in segments)
+
+
+@pytest.mark.parametrize('total_frames', [1000, 2501, 7500, 18000])
+@pytest.mark.parametrize('cycle', [1, 48, 250, 498])
+@pytest.mark.parametrize('max_segments', [1, 2, 4, 8])
+def test_plan_invariants(total_frames, cycle, max_segments):
+    segments = plan_segments(total_frames, cycle, max_segments, 250, 25, 25)
+    check_plan(segments, total_frames, cycle, 25, 25)
+    assert len(segments) <= max_segments
+    if len(segments) > 1:
+        assert segments[-1].frames >= 250
+
+
+def test_context_longer_than_cycle_stays_aligned():
+    segments = plan_segments(5000, 20, 4, 500, 50, 25)
+    check_plan(segments, 5000, 20, 50, 25)
+    assert all(segment.left == 50 for segment in segments[1:])
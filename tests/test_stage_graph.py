@@ -0,0 +1,109 @@
+#!/user/bin/env python
+# coding=utf-8
+"""
+@project : face2face_train
+@author  : huyi
+@file   : test_stage_graph.py
+@ide    : PyCharm
+@time   : 2026-10-18 01:05:46
+"""
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import pytest
+
+from service.stage_graph import StageGraph
+
+
+@pytest.fixture(params=['serial', 'parallel'])
+def executor(request):
+    if request.param == 'serial':
+        yield None
+        return
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def fail(message):
+    def fn(*args):
+        raise RuntimeError(message)
+    return fn
+
+
+def test_results_follow_dependencies(executor):
+    graph = StageGraph('job', executor)
+    graph.add('audio', lambda: 2)
+    graph.add('video', lambda: 3)
+    graph.add('render', lambda a, v: a * v, deps=('audio', 'video'))
+    assert graph.run() == {'audio': 2, 'video': 3, 'render': 6}
+
+
+def test_failure_skips_dependants(executor):
+    called = []
+    graph = StageGraph('job', executor)
+    graph.add('audio', fail('下载失败'))
+    graph.add('features', lambda a: called.append('features'), deps=('audio',))
+    graph.add('render', lambda f: called.append('render'), deps=('features',))
+    with pytest.raises(RuntimeError, match='下载失败'):
+        graph.run()
+    assert called == []
+    # 并发时异常沿依赖链传递到下游阶段，顺序执行时下游阶段被取消
+    with pytest.raises((RuntimeError, CancelledError)):
+        graph.futures['render'].result(timeout=5)
+
+
+def test_independent_branch_finishes_before_failure_is_raised():
+    release = threading.Event()
+    finished = []
+
+    def slow():
+        release.wait(5)
+        finished.append('video')
+        return 'video'
+
+    pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        graph = StageGraph('job', pool)
+        graph.add('video', slow)
+        graph.add('audio', fail('音频异常'))
+        graph.add('render', lambda v, a: None, deps=('video', 'audio'))
+        # 失败的audio在video之后定义，run等video结束后才抛出audio的异常
+        threading.Timer(0.2, release.set).start()
+        with pytest.raises(RuntimeError, match='音频异常'):
+            graph.run()
+        assert finished == ['video']
+    finally:
+        pool.shutdown(wait=True)
+
+
+def test_first_defined_failure_is_raised(executor):
+    graph = StageGraph('job', executor)
+    graph.add('a', lambda: 1)
+    graph.add('b', fail('b失败'))
+    graph.add('c', fail('c失败'))
+    with pytest.raises(RuntimeError, match='b失败'):
+        graph.run()
+
+
+def test_stage_with_two_failed_deps_fails_once(caplog):
+    pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        graph = StageGraph('job', pool)
+        graph.add('a', fail('a失败'))
+        graph.add('b', fail('b失败'))
+        graph.add('c', lambda a, b: None, deps=('a', 'b'))
+        with pytest.raises(RuntimeError, match='a失败'):
+            graph.run()
+        with pytest.raises(RuntimeError, match='[ab]失败'):
+            graph.futures['c'].result(timeout=5)
+    finally:
+        pool.shutdown(wait=True)
+    # 第二个失败的依赖不能再次设置已完成的future
+    assert not [r for r in caplog.records if r.name == 'concurrent.futures']
+
+
+def test_undefined_dependency_rejected():
+    graph = StageGraph('job')
+    with pytest.raises(ValueError):
+        graph.add('render', lambda a: a, deps=('audio',))